@@ -2,6 +2,9 @@
 ASGI config for app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the app through this (e.g. uvicorn app.asgi:application) for the
+/api/market-stream/ Server-Sent Events endpoint; under WSGI the dashboard
+falls back to polling.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -12,5 +15,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+# Serve the market data endpoints from the async views (needs httpx)
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
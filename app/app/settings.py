@@ -29,6 +29,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'bot.metrics.ServerTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'app.urls'
@@ -58,6 +59,11 @@ DATABASES = {
     }
 }
 
+# Applied to every SQLite connection (bot.persistence.configure_sqlite) on top of
+# bot.persistence.DEFAULT_SQLITE_PRAGMAS (WAL, synchronous=NORMAL, busy_timeout, ...);
+# set a pragma to None to leave SQLite's default
+SQLITE_PRAGMAS = {}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -93,4 +99,162 @@ import os
 STATICFILES_DIRS = [
     os.path.join(STATIC_ROOT, 'js'),
     os.path.join(STATIC_ROOT, 'css'),
-]
\ No newline at end of file
+]
+
+# Upstream market data hosts (bot.services). Point all three at http://127.0.0.1:8900
+# to run against manage.py simulate_exchanges.
+UPSTREAM_BASE_URLS = {
+    'bybit': os.environ.get('BYBIT_MARKET_URL', 'https://api.bybit.com'),
+    'valr': os.environ.get('VALR_MARKET_URL', 'https://api.valr.com'),
+    'fx': os.environ.get('FX_RATE_URL', 'https://open.er-api.com'),
+}
+
+# Local exchange simulator (manage.py simulate_exchanges, and manage.py load_test's
+# in-process upstreams) - see bot.simulator.DEFAULT_SIMULATOR_OPTIONS for the books'
+# random walk and the latency, error, stall, gap and disconnect injection rates.
+EXCHANGE_SIMULATOR = {
+    'depth': 50,
+    'update_interval': 0.1,
+    'latency': 0.0,
+    'error_rate': 0.0,
+}
+
+# Async market data views, which wait on the upstreams without holding a thread. app/asgi.py
+# turns them on; they need httpx. Under WSGI the sync views serve the same endpoints.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+
+# Upstream HTTP clients - per-host overrides of bot.clients.DEFAULT_CLIENT_OPTIONS. The async
+# views share these through bot.clients.AsyncExchangeClient.
+EXCHANGE_CLIENTS = {
+    'bybit': {'connect_timeout': 3.05, 'read_timeout': 5, 'max_retries': 2},
+    'valr': {'connect_timeout': 3.05, 'read_timeout': 5, 'max_retries': 2},
+    # FX rates are slow-moving reference data, fail fast rather than retry
+    'fx': {'connect_timeout': 3.05, 'read_timeout': 5, 'max_retries': 1},
+}
+
+# Reference data caches - per-cache overrides of bot.cache.DEFAULT_CACHE_OPTIONS.
+# Shared caches go through a cross-process CACHES backend (the 'reference' alias
+# below; Redis or Memcached work too) so every gunicorn worker reuses one FX rate.
+REFERENCE_CACHES = {
+    'fx': {'ttl': 300, 'stale_ttl': 3600, 'shared': True, 'cache_alias': 'reference'},
+}
+
+# The market data ingestor (manage.py ingest_market_data) publishes snapshots to this
+# cache; it must be shared across processes for web workers to see them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'snapshots': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'snapshots',
+    },
+    # Shared tier of the REFERENCE_CACHES, read by every worker process
+    'reference': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'reference',
+    },
+}
+SNAPSHOT_CACHE_ALIAS = 'snapshots'
+MARKET_INGEST_INTERVAL = 5
+
+# Order book websocket feeds for ingest_market_data --stream. Point these at
+# ws://127.0.0.1:8765/bybit and ws://127.0.0.1:8765/valr to use replay_order_books
+# or simulate_exchanges. Valr's wss:// feed only accepts connections signed with
+# the EXECUTION['valr'] API key; without one, --stream falls back to polling.
+ORDERBOOK_STREAMS = {
+    'bybit': 'wss://stream.bybit.com/v5/public/spot',
+    'valr': 'wss://api.valr.com/ws/trade',
+}
+
+# Snapshot history written by the ingestor - see bot.history.DEFAULT_HISTORY_OPTIONS.
+# Retention is in days per resolution; run manage.py compact_history periodically.
+SNAPSHOT_HISTORY = {
+    'batch_size': 200,
+    'flush_interval': 30,
+    'retention': {'raw': 2, '1m': 30, '1h': None},
+}
+
+# Write-behind persistence of executed trades (bot.persistence) - see
+# DEFAULT_PERSISTENCE_OPTIONS. Records are journaled to `journal` before they are
+# queued and replayed from it after a crash; fsync also survives power loss.
+PERSISTENCE = {
+    'batch_size': 500,
+    'flush_interval': 0.5,
+    'journal': BASE_DIR / '.cache' / 'trade-journal.jsonl',
+    'fsync': False,
+}
+
+# Alert rules (bot.models.AlertRule, add them with manage.py add_alert_rule) evaluated
+# by ingest_market_data on every snapshot - see bot.alerts.DEFAULT_ALERT_OPTIONS. The
+# sink is 'log', 'jsonl' (with sink_options={'path': ...}) or a dotted class path.
+ALERTS = {
+    'enabled': True,
+    'sink': 'log',
+    'sink_options': {},
+}
+
+# Trade history API (bot.trades) - see bot.trades.DEFAULT_TRADE_HISTORY_OPTIONS. With
+# use_rollups, run manage.py rollup_trades periodically to keep the P&L rollups fresh.
+TRADE_HISTORY = {
+    'page_size': 50,
+    'max_page_size': 200,
+    'use_rollups': False,
+}
+
+# Server-Sent Events push of market data (/api/market-stream/, ASGI only)
+MARKET_STREAM = {
+    'poll_interval': 0.5,
+    'keepalive': 15,
+}
+
+# Base assets compared across venues by /api/scan/ (each quoted in USDT and ZAR)
+SCANNER_BASES = ['BTC', 'ETH', 'SOL', 'XRP', 'BNB', 'ADA', 'DOGE', 'LTC', 'TRX', 'AVAX']
+
+# Automated trade execution (manage.py ingest_market_data --execute) - see
+# bot.execution.DEFAULT_EXECUTION_OPTIONS. Point the base_urls at
+# http://127.0.0.1:8900 to trade against manage.py mock_exchange (or simulate_exchanges).
+EXECUTION = {
+    'enabled': os.environ.get('EXECUTION_ENABLED') == '1',
+    'fill_timeout': 10,
+    'cooldown': 30,
+    'bybit': {
+        'base_url': os.environ.get('BYBIT_TRADE_URL', 'https://api.bybit.com'),
+        'api_key': os.environ.get('BYBIT_API_KEY', ''),
+        'api_secret': os.environ.get('BYBIT_API_SECRET', ''),
+    },
+    'valr': {
+        'base_url': os.environ.get('VALR_TRADE_URL', 'https://api.valr.com'),
+        'api_key': os.environ.get('VALR_API_KEY', ''),
+        'api_secret': os.environ.get('VALR_API_SECRET', ''),
+    },
+}
+
+# Instrumentation (bot.metrics) - timings are always collected and exposed at /metrics;
+# server_timing adds a per-request Server-Timing header for browser dev tools. The header
+# shows anyone how long each internal section took, so it is only on while debugging.
+METRICS = {
+    'server_timing': DEBUG,
+}
+
+# JSON library for upstream payloads and API responses (bot.codec): 'json', 'orjson'
+# or 'msgspec'. None picks orjson when it is installed, else the standard library.
+JSON_CODEC = None
+
+# Rendered /api/market-data/ and /api/simulate-trade/ responses, cached per snapshot
+# version (responses carry an ETag, so clients can revalidate with If-None-Match)
+RESPONSE_CACHE = {
+    'ttl': 5,
+    'max_entries': 1000,
+}
+
+# Upstream rate limits (bot.ratelimit): token buckets per upstream, refilled at `rate`
+# requests/second up to `burst`, with optional per-endpoint buckets. Bucket state is
+# kept in RATE_LIMIT_DIR and shared by every process on the host.
+UPSTREAM_RATE_LIMITS = {
+    # ByBit allows 600 requests per 5s per IP on public endpoints
+    'bybit': {'rate': 50, 'burst': 100},
+    'valr': {'rate': 5, 'burst': 10, 'endpoints': {'/v1/public/BTCZAR/orderbook': {'rate': 2, 'burst': 4}}},
+    'fx': {'rate': 0.05, 'burst': 5},
+}
+RATE_LIMIT_DIR = BASE_DIR / '.cache' / 'ratelimit'
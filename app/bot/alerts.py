@@ -0,0 +1,265 @@
+import bisect
+import json
+import logging
+import queue
+import threading
+from collections import deque, namedtuple
+from dataclasses import asdict, dataclass
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.module_loading import import_string
+
+import bot.services as services
+from bot import matching, metrics
+from bot.models import AlertRule
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable via settings.ALERTS
+DEFAULT_ALERT_OPTIONS = {
+    'enabled': True,
+    'sink': 'log',            # a name from SINKS, or the dotted path of a sink class
+    'sink_options': {},       # keyword arguments for the sink
+    'reload_interval': 5,     # seconds between checks for added, changed or removed rules
+}
+
+def alert_options():
+    return {**DEFAULT_ALERT_OPTIONS, **getattr(settings, 'ALERTS', {})}
+
+
+# An enabled AlertRule as the evaluator sees it (threshold as a float)
+CompiledRule = namedtuple('CompiledRule', 'id name metric operator threshold change_window cooldown')
+
+@dataclass(frozen=True)
+class Alert:
+    rule_id: int
+    name: str
+    metric: str
+    operator: str
+    threshold: float
+    change_window: int
+    value: float
+    fired_at: float
+
+
+def snapshot_metrics(snapshot):
+    """Alertable values of a snapshot as floats, None where the snapshot lacks the data"""
+    tradable_btc = None
+    if snapshot.bybit_volume is not None and snapshot.valr_volume is not None:
+        tradable_btc = services.calculate_tradable_btc(snapshot.bybit_volume, snapshot.valr_volume)
+
+    # Top of book spread in the direction we trade: buy the Valr ask, sell the ByBit bid
+    spread = None
+    valr_book, bybit_book = snapshot.valr_orderbook, snapshot.bybit_orderbook
+    if valr_book and bybit_book and len(valr_book['asks']) and len(bybit_book['bids']) and snapshot.exchange_rate:
+        spread = matching.spread_percentage(valr_book['asks'].price(0) / snapshot.exchange_rate, bybit_book['bids'].price(0))
+
+    values = {
+        AlertRule.PREMIUM: snapshot.percentage_premium,
+        AlertRule.TRADABLE_BTC: tradable_btc,
+        AlertRule.SPREAD: spread,
+    }
+    return {metric: float(value) if value is not None else None for metric, value in values.items()}
+
+
+class ThresholdIndex:
+    """Rules sharing a metric, change window and operator, sorted by threshold.
+
+    Only edges are reported: a tick bisects the previous and the current value
+    into the thresholds and returns the rules in between that now hold, so its
+    cost is two binary searches plus the rules that actually crossed.
+    """
+
+    def __init__(self, operator, rules, value=None):
+        rules = sorted(rules, key=lambda rule: rule.threshold)
+        self.thresholds = [rule.threshold for rule in rules]
+        self.rules = rules
+        self.above = operator == AlertRule.ABOVE
+        self.value = value
+
+    def crossed(self, value):
+        """Rules that started holding as the metric moved from its previous value to value"""
+        previous, self.value = self.value, value
+        if self.above:
+            # value >= threshold holds for the first bisect_right(value) rules
+            now = bisect.bisect_right(self.thresholds, value)
+            before = 0 if previous is None else bisect.bisect_right(self.thresholds, previous)
+            return self.rules[before:now] if now > before else ()
+        # value <= threshold holds from bisect_left(value) on
+        now = bisect.bisect_left(self.thresholds, value)
+        before = len(self.thresholds) if previous is None else bisect.bisect_left(self.thresholds, previous)
+        return self.rules[now:before] if now < before else ()
+
+
+class ChangeRate:
+    """A metric's change per minute over a sliding window of snapshots"""
+
+    def __init__(self, window):
+        self.window = window
+        self.samples = deque()
+
+    def update(self, at, value):
+        self.samples.append((at, value))
+        # Keep the newest sample at least `window` old as the baseline
+        while len(self.samples) > 1 and self.samples[1][0] <= at - self.window:
+            self.samples.popleft()
+        started_at, started = self.samples[0]
+        elapsed = at - started_at
+        if elapsed < self.window / 2:
+            return None  # not enough history for a meaningful rate yet
+        return (value - started) / elapsed * 60
+
+
+class AlertEvaluator:
+    """Compiled rules: one ThresholdIndex per (metric, change window, operator).
+
+    Alerts are edge-triggered, so a rule fires once when its condition starts
+    holding rather than on every snapshot it holds for, and a rule that fired
+    stays quiet for its cooldown (crossings within it are dropped). Index
+    values, change rates and cooldowns carry over from `previous`, so
+    recompiling after a rule change doesn't re-fire anything.
+    """
+
+    def __init__(self, rules, previous=None):
+        groups = {}
+        for rule in rules:
+            groups.setdefault((rule.metric, rule.change_window, rule.operator), []).append(rule)
+
+        previous_indexes = previous.indexes if previous is not None else {}
+        previous_rates = previous.rates if previous is not None else {}
+        self.indexes = {
+            key: ThresholdIndex(key[2], group, getattr(previous_indexes.get(key), 'value', None))
+            for key, group in groups.items()
+        }
+        self.rates = {
+            (metric, window): previous_rates.get((metric, window)) or ChangeRate(window)
+            for metric, window, _ in groups if window
+        }
+        self.last_fired = previous.last_fired if previous is not None else {}
+        self.rule_count = len(rules)
+
+    def evaluate(self, values, at):
+        """Alerts for the rules that started holding with these metric values"""
+        rates = {}
+        for (metric, window), rate in self.rates.items():
+            value = values.get(metric)
+            rates[metric, window] = rate.update(at, value) if value is not None else None
+
+        alerts = []
+        for (metric, window, operator), index in self.indexes.items():
+            value = rates[metric, window] if window else values.get(metric)
+            if value is None:
+                continue
+            for rule in index.crossed(value):
+                fired_at = self.last_fired.get(rule.id)
+                if fired_at is not None and at - fired_at < rule.cooldown:
+                    continue
+                self.last_fired[rule.id] = at
+                alerts.append(Alert(rule.id, rule.name, metric, operator, rule.threshold, window, value, at))
+        return alerts
+
+
+def load_rules():
+    """Every enabled AlertRule, compiled"""
+    return [
+        CompiledRule(rule_id, name, metric, operator, float(threshold), change_window, cooldown)
+        for rule_id, name, metric, operator, threshold, change_window, cooldown in
+        AlertRule.objects.filter(enabled=True).values_list(
+            'id', 'name', 'metric', 'operator', 'threshold', 'change_window', 'cooldown'
+        )
+    ]
+
+def rules_version():
+    """Changes whenever a rule is added, edited or deleted"""
+    summary = AlertRule.objects.aggregate(count=Count('id'), updated=Max('updated_at'))
+    return summary['count'], summary['updated']
+
+
+class LogSink:
+    """Logs each alert as a warning"""
+
+    def send(self, alerts):
+        for alert in alerts:
+            change = f" per minute over {alert.change_window}s" if alert.change_window else ''
+            logger.warning(
+                f"ALERT {alert.name}: {alert.metric}{change} is {alert.value:.4f} ({alert.operator} {alert.threshold})"
+            )
+
+class JsonlSink:
+    """Appends each alert as a JSON line to a local file, for another process to tail"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, alerts):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(asdict(alert)) + '\n' for alert in alerts)
+
+SINKS = {'log': LogSink, 'jsonl': JsonlSink}
+
+def get_sink(name, **options):
+    """A sink by SINKS name or dotted class path; sinks only need a send(alerts) method"""
+    return (SINKS.get(name) or import_string(name))(**options)
+
+
+class AlertEngine:
+    """Evaluates the enabled AlertRules against each published snapshot.
+
+    Evaluation is all in memory; delivering alerts to the sink and reloading
+    changed rules both happen on background threads, off the publish path.
+    """
+
+    def __init__(self, sink=None, reload_interval=None):
+        options = alert_options()
+        self.sink = sink or get_sink(options['sink'], **options['sink_options'])
+        self.reload_interval = reload_interval or options['reload_interval']
+        self.evaluator = AlertEvaluator(load_rules())
+        self._version = rules_version()
+        self._lock = threading.Lock()
+        self._outbox = queue.SimpleQueue()
+        self._stopped = threading.Event()
+        self._sender = threading.Thread(target=self._send_alerts, name='alert-sink', daemon=True)
+        self._sender.start()
+        threading.Thread(target=self._reload_rules, name='alert-rules', daemon=True).start()
+        logger.info(f"Evaluating {self.evaluator.rule_count} alert rules")
+
+    def evaluate(self, snapshot):
+        with metrics.timer('alert_evaluation'):
+            values = snapshot_metrics(snapshot)
+            with self._lock:
+                alerts = self.evaluator.evaluate(values, snapshot.fetched_at)
+        if alerts:
+            metrics.increment('alerts_fired_total', len(alerts))
+            self._outbox.put(alerts)
+        return alerts
+
+    def close(self, timeout=5):
+        self._stopped.set()
+        self._outbox.put(None)
+        self._sender.join(timeout)
+
+    def _send_alerts(self):
+        while True:
+            alerts = self._outbox.get()
+            if alerts is None:
+                return
+            try:
+                self.sink.send(alerts)
+            except Exception as e:
+                logger.error(f"Alert sink failed to send {len(alerts)} alerts: {e}")
+                metrics.increment('alert_sink_errors_total')
+
+    def _reload_rules(self):
+        while not self._stopped.wait(self.reload_interval):
+            try:
+                version = rules_version()
+                if version == self._version:
+                    continue
+                rules = load_rules()
+                with self._lock:
+                    self.evaluator = AlertEvaluator(rules, previous=self.evaluator)
+                self._version = version
+                logger.info(f"Reloaded {len(rules)} alert rules")
+            except Exception as e:
+                logger.error(f"Could not reload alert rules: {e}")
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bot'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from bot.persistence import configure_sqlite
+
+        connection_created.connect(configure_sqlite, dispatch_uid='bot.configure_sqlite')
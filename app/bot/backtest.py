@@ -0,0 +1,113 @@
+import bisect
+import itertools
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import bot.services as services
+from bot.recording import Recording
+
+logger = logging.getLogger(__name__)
+
+# Strategy parameters a backtest can vary, with the live values as defaults
+DEFAULT_PARAMETERS = {
+    'min_spread_percentage': services.MIN_SPREAD_PERCENTAGE,
+    'liquidity_factor': services.LIQUIDITY_FACTOR,
+    'fee_percentage': services.TAKER_FEE_PERCENTAGE,
+    'latency': 0.0,                    # seconds from signal to execution
+    'cooldown': 0.0,                   # seconds after a trade before the next signal counts
+}
+
+
+def _analyze(snapshot, target, parameters):
+    return services.analyze_order_books(
+        snapshot.bybit_orderbook, snapshot.valr_orderbook, target,
+        usd_zar_rate=snapshot.exchange_rate, min_spread_percentage=parameters['min_spread_percentage'],
+    )
+
+
+def run_backtest(recording, **parameters):
+    """Replay a recording, trading every qualifying snapshot, and report P&L and fill volume.
+
+    A signal is taken when the books can fill a trade in the direction we execute
+    (buy Valr asks, sell ByBit bids), as execution.find_opportunity gates live;
+    it is executed by walking the books of the first snapshot at least ``latency``
+    seconds later, and counted as missed if those books no longer fill.
+    """
+    parameters = {**DEFAULT_PARAMETERS, **parameters}
+    if isinstance(recording, str):
+        recording = Recording(recording)
+
+    started = time.perf_counter()
+    timestamps = [recording.timestamp(i) for i in range(len(recording))]
+    fee_rate = parameters['fee_percentage'] / 100
+
+    trades = 0
+    volume = Decimal('0')
+    pnl_usd = Decimal('0')
+    missed = 0
+    next_signal_at = float('-inf')
+
+    for index, signal_time in enumerate(timestamps):
+        if signal_time < next_signal_at:
+            continue
+
+        snapshot = recording[index]
+        if snapshot.bybit_volume is None or snapshot.valr_volume is None:
+            continue
+
+        target = services.calculate_tradable_btc(snapshot.bybit_volume, snapshot.valr_volume, parameters['liquidity_factor'])
+        analysis = _analyze(snapshot, target, parameters)
+        if not analysis['can_execute']:
+            continue
+
+        # Execute on the books as they were once the latency has passed
+        execute_index = bisect.bisect_left(timestamps, signal_time + parameters['latency'], lo=index)
+        if execute_index >= len(recording):
+            break
+        if execute_index != index:
+            analysis = _analyze(recording[execute_index], target, parameters)
+        if not analysis['can_execute']:
+            missed += 1
+            continue
+
+        filled = analysis['tradable_volume']
+        cost = analysis['vwap_valr_price_usd'] * filled
+        proceeds = analysis['vwap_bybit_price_usd'] * filled
+        pnl_usd += proceeds - cost - (proceeds + cost) * fee_rate
+        volume += filled
+        trades += 1
+        next_signal_at = signal_time + parameters['cooldown']
+
+    elapsed = time.perf_counter() - started
+    duration = timestamps[-1] - timestamps[0] if timestamps else 0
+    return {
+        'parameters': parameters,
+        'snapshots': len(timestamps),
+        'trades': trades,
+        'missed_signals': missed,
+        'volume_btc': volume,
+        'pnl_usd': pnl_usd,
+        'elapsed': elapsed,
+        'speedup': duration / elapsed if elapsed else None,
+    }
+
+
+def _run_backtest_worker(path, parameters):
+    import django
+
+    # Spawned workers start without Django configured; forked ones already have it
+    django.setup()
+    return run_backtest(path, **parameters)
+
+
+def sweep(path, grid, workers=None):
+    """Run a backtest for every combination in grid ({parameter: [values]}) across a process pool"""
+    names = list(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+    logger.info(f"Sweeping {len(combinations)} parameter combinations over {path}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Workers memory-map the recording themselves, so only the path is sent over
+        return list(executor.map(_run_backtest_worker, itertools.repeat(path), combinations))
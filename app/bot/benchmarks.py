@@ -0,0 +1,433 @@
+import functools
+import itertools
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.test import RequestFactory, override_settings
+
+import bot.clients as clients
+import bot.services as services
+import bot.store as store
+from bot import alerts, upstream
+from bot.cache import get_cache
+from bot.orderbook import OrderBook
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEVELS = [50, 500, 5000, 50000]
+DEFAULT_CONCURRENCY = [1, 8, 32]
+ALERT_RULES = 20000
+# A benchmark regresses when its median time grows by more than this fraction
+DEFAULT_TOLERANCE = 0.25
+
+def synthetic_fixtures(levels, bybit_price=Decimal('60000'), exchange_rate=Decimal('18.5'), seed=0):
+    """Upstream responses in the exchanges' own shapes ({client: {path: payload}}) with `levels`-deep books.
+
+    Valr trades at a 1.5% premium while its asks start 3% under ByBit's bids and
+    the books cross about halfway down, so order book walks go deep.
+    """
+    rng = random.Random(seed)
+    tick = bybit_price * Decimal('0.06') / levels
+
+    def quantity():
+        return str(Decimal(rng.randint(100_000, 50_000_000)) / Decimal(100_000_000))
+
+    bybit_bids = [[str(bybit_price - tick * i), quantity()] for i in range(levels)]
+    bybit_asks = [[str(bybit_price + tick * (i + 1)), quantity()] for i in range(levels)]
+    valr_ask_start = bybit_price * Decimal('0.97') * exchange_rate
+    valr_asks = [{'side': 'sell', 'price': str((valr_ask_start + tick * exchange_rate * i).quantize(Decimal('1'))),
+                  'quantity': quantity(), 'currencyPair': 'BTCZAR', 'orderCount': 1} for i in range(levels)]
+    valr_bids = [{'side': 'buy', 'price': str((valr_ask_start - tick * exchange_rate * (i + 1)).quantize(Decimal('1'))),
+                  'quantity': quantity(), 'currencyPair': 'BTCZAR', 'orderCount': 1} for i in range(levels)]
+    valr_price = (bybit_price * Decimal('1.015') * exchange_rate).quantize(Decimal('1'))
+    valr_summary = {
+        'currencyPair': 'BTCZAR',
+        'lastTradedPrice': str(valr_price),
+        'baseVolume': '120.5',
+        'quoteVolume': str(valr_price * Decimal('120.5')),
+    }
+
+    return {
+        'bybit': {
+            services.BYBIT_TICKER_ENDPOINT: {'retCode': 0, 'retMsg': 'OK', 'result': {
+                'category': 'spot', 'list': [{'symbol': 'BTCUSDT', 'lastPrice': str(bybit_price), 'volume24h': '25000',
+                          'turnover24h': str(bybit_price * 25000)}],
+            }},
+            services.BYBIT_ORDERBOOK_ENDPOINT: {'retCode': 0, 'retMsg': 'OK', 'result': {
+                's': 'BTCUSDT', 'b': bybit_bids, 'a': bybit_asks, 'ts': 0, 'u': 1,
+            }},
+            services.BYBIT_KLINE_ENDPOINT: {'retCode': 0, 'retMsg': 'OK', 'result': {
+                'category': 'spot', 'symbol': 'BTCUSDT',
+                'list': [['0', str(bybit_price), str(bybit_price), str(bybit_price), str(bybit_price), '25000', '0']],
+            }},
+        },
+        'valr': {
+            services.VALR_MARKET_SUMMARY_ENDPOINT: valr_summary,
+            services.VALR_ORDERBOOK_ENDPOINT: {'Asks': valr_asks, 'Bids': valr_bids, 'SequenceNumber': 1},
+        },
+        'fx': {
+            services.EXCHANGE_RATE_ENDPOINT: {'result': 'success', 'base_code': 'USD', 'rates': {'ZAR': float(exchange_rate)}},
+        },
+    }
+
+def record_fixtures(path):
+    """Fetch every registered upstream resource once and save the raw responses as a fixtures file"""
+    fixtures = {}
+    for resource in upstream.RESOURCES.values():
+        response = requests.get(resource.base_url + resource.path, params=resource.params, timeout=10)
+        response.raise_for_status()
+        fixtures.setdefault(resource.client, {})[resource.path] = response.json()
+    with open(path, 'w') as f:
+        json.dump(fixtures, f)
+    return fixtures
+
+def load_fixtures(path):
+    with open(path) as f:
+        fixtures = json.load(f)
+    # Older recordings keyed the FX response by an empty path
+    if '' in fixtures.get('fx', {}):
+        fixtures['fx'][services.EXCHANGE_RATE_ENDPOINT] = fixtures['fx'].pop('')
+    return fixtures
+
+
+class FixtureServer:
+    """Local HTTP stub serving fixtures at /<client><endpoint path>, ignoring query strings"""
+
+    def __init__(self, fixtures, host='127.0.0.1', port=0):
+        # Encode once so the stub's own cost stays out of the measurements as far as possible
+        self.responses = {
+            f'/{name}{endpoint}': json.dumps(payload).encode()
+            for name, endpoints in fixtures.items() for endpoint, payload in endpoints.items()
+        }
+        responses = self.responses
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real upstreams
+
+            def do_GET(self):
+                body = responses.get(urlsplit(self.path).path)
+                self.send_response(200 if body is not None else 404)
+                body = body or b'{}'
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://{}:{}'.format(*self.server.server_address)
+        threading.Thread(target=self.server.serve_forever, name='fixture-server', daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@contextmanager
+def serving(fixtures):
+    """Point the shared upstream clients at a FixtureServer and keep snapshots out of the real store"""
+    server = FixtureServer(fixtures)
+    names = {resource.client for resource in upstream.RESOURCES.values()}
+    try:
+        with _upstreams_at({name: f'{server.url}/{name}' for name in names}, max_retries=0):
+            yield server
+    finally:
+        server.close()
+
+@contextmanager
+def simulating(**options):
+    """Run an ExchangeSimulator (see bot.simulator) on free ports and point the shared upstream clients at it"""
+    from bot.simulator import ExchangeSimulator
+
+    simulator = ExchangeSimulator(port=0, ws_port=None, **options)
+    host, port = simulator.start()
+    url = f'http://{host}:{port}'
+    try:
+        # Retries stay on (unlike serving) so injected errors exercise them
+        with _upstreams_at({'bybit': url, 'valr': url, 'fx': url}):
+            yield simulator
+    finally:
+        simulator.stop()
+
+@contextmanager
+def _upstreams_at(base_urls, **client_options):
+    saved = dict(clients._clients)
+    for name, base_url in base_urls.items():
+        options = {**getattr(settings, 'EXCHANGE_CLIENTS', {}).get(name, {}), **client_options}
+        client = clients._clients[name] = clients.ExchangeClient(name, base_url, **options)
+        client.limiter = None  # local stand-ins have no rate limits to respect
+    get_cache('fx').clear()
+    try:
+        with override_settings(SNAPSHOT_CACHE_ALIAS='default'):
+            yield
+    finally:
+        clients._clients.clear()
+        clients._clients.update(saved)
+        get_cache('fx').clear()
+
+
+def measure(func, min_time=0.5, min_rounds=5, max_rounds=10_000):
+    """Time repeated calls of func, then trace one more call's peak allocation"""
+    func()  # warm up
+    durations = []
+    started = time.perf_counter()
+    while len(durations) < min_rounds or (time.perf_counter() - started < min_time and len(durations) < max_rounds):
+        call_started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - call_started)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'rounds': len(durations),
+        'median': statistics.median(durations),
+        'p99': _percentile(durations, 0.99),
+        'ops_per_second': len(durations) / sum(durations),
+        'peak_bytes': peak,
+    }
+
+def measure_load(func, concurrency, requests_per_worker=50):
+    """Call func from `concurrency` threads at once, reporting throughput and latency percentiles"""
+    def worker():
+        durations = []
+        for _ in range(requests_per_worker):
+            call_started = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - call_started)
+        return durations
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        durations = [d for result in [executor.submit(worker) for _ in range(concurrency)] for d in result.result()]
+    elapsed = time.perf_counter() - started
+
+    return {
+        'rounds': len(durations),
+        'median': statistics.median(durations),
+        'p99': _percentile(durations, 0.99),
+        'ops_per_second': len(durations) / elapsed,
+    }
+
+def drive_load(call, concurrency, duration, rate=None):
+    """Call `call` from `concurrency` threads for `duration` seconds, reporting throughput, errors and tail latency.
+
+    Without a rate every worker calls back to back. With one, calls are
+    scheduled `rate` per second across the workers and each call's latency
+    counts from its scheduled start, so a stalling target shows in the tail
+    rather than quietly lowering the request rate.
+    """
+    schedule = itertools.count()
+    lock = threading.Lock()
+    durations, errors = [], {}
+    started = time.perf_counter()
+    ends = started + duration
+
+    def worker():
+        local_durations, local_errors = [], {}
+        while True:
+            call_started = time.perf_counter()
+            if rate:
+                call_started = started + next(schedule) / rate
+                if call_started >= ends:
+                    break
+                time.sleep(max(0.0, call_started - time.perf_counter()))
+            elif call_started >= ends:
+                break
+            try:
+                call()
+            except Exception as e:
+                reason = f'HTTP {e.response.status_code}' if isinstance(e, requests.HTTPError) else type(e).__name__
+                local_errors[reason] = local_errors.get(reason, 0) + 1
+            local_durations.append(time.perf_counter() - call_started)
+        with lock:
+            durations.extend(local_durations)
+            for reason, count in local_errors.items():
+                errors[reason] = errors.get(reason, 0) + count
+
+    threads = [threading.Thread(target=worker, name=f'load-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if not durations:
+        return {'rounds': 0, 'errors': errors, 'ops_per_second': 0.0}
+    return {
+        'rounds': len(durations),
+        'errors': errors,
+        'ops_per_second': len(durations) / elapsed,
+        'median': statistics.median(durations),
+        'p90': _percentile(durations, 0.9),
+        'p99': _percentile(durations, 0.99),
+        'p999': _percentile(durations, 0.999),
+        'max': max(durations),
+    }
+
+def http_target(url, timeout=10):
+    """A load target GETting url on a keep-alive session per worker thread; error statuses raise"""
+    local = threading.local()
+
+    def call():
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        session.get(url, timeout=timeout).raise_for_status()
+    return call
+
+class MissingFieldsError(Exception):
+    """A load target's snapshot came back without some of its fields"""
+
+def pipeline_targets():
+    """In-process load targets for the upstream fetch and the market data views.
+
+    With no snapshot published the views fetch live (shared between concurrent
+    requests), so under simulating() each call runs the whole pipeline.
+    """
+    from bot.views import get_market_data, simulate_trade
+
+    def fetch_snapshot():
+        snapshot = services.fetch_market_snapshot()
+        if snapshot.missing:
+            raise MissingFieldsError(', '.join(snapshot.missing))
+
+    factory = RequestFactory()
+    return {
+        'fetch_market_snapshot': fetch_snapshot,
+        'get_market_data': _view_target(get_market_data, factory.get('/api/market-data/')),
+        'simulate_trade': _view_target(simulate_trade, factory.get('/api/simulate-trade/', {'amount': '10000'})),
+    }
+
+def _view_target(view, request):
+    def call():
+        response = view(request)
+        if response.status_code >= 400:
+            raise requests.HTTPError(response=response)
+    return call
+
+def run_load_test(targets, concurrency=None, duration=10, rate=None):
+    """Drive each of {name: call} at each concurrency, returning {'name[c=N]': drive_load() result}"""
+    results = {}
+    for name, call in targets.items():
+        for workers in concurrency or DEFAULT_CONCURRENCY:
+            logger.info(f"Driving {name} from {workers} workers for {duration}s")
+            results[f'{name}[c={workers}]'] = drive_load(call, workers, duration, rate)
+    return results
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_benchmarks(levels=None, concurrency=None, fixtures=None, min_time=0.5):
+    """Run the suite, returning {benchmark name: measurements}"""
+    from bot.views import get_market_data
+
+    # Bypass snapshot_response, whose per-version cache would make every round after the first a cache hit
+    market_data_view = get_market_data.__wrapped__
+    levels = levels or DEFAULT_LEVELS
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+    request = RequestFactory().get('/api/market-data/')
+    results = {}
+
+    suites = [(f'synthetic-{depth}', synthetic_fixtures(depth)) for depth in levels]
+    if fixtures is not None:
+        suites.append(('recorded', fixtures))
+
+    for label, suite_fixtures in suites:
+        logger.info(f"Benchmarking {label} books")
+        bybit_raw = suite_fixtures['bybit'][services.BYBIT_ORDERBOOK_ENDPOINT]['result']
+        results[f'parse_orderbook[{label}]'] = measure(
+            functools.partial(OrderBook.from_levels, bybit_raw['b'], bybit_raw['a'], currency='USD'), min_time
+        )
+
+        with serving(suite_fixtures):
+            snapshot = services.fetch_market_snapshot()
+            if snapshot.missing:
+                raise RuntimeError(f"Fixtures for {label} are missing {', '.join(snapshot.missing)}")
+
+            target = sum(quantity for _, quantity in snapshot.valr_orderbook['asks'])
+            results[f'analyze_order_books[{label}]'] = measure(
+                functools.partial(
+                    services.analyze_order_books,
+                    snapshot.bybit_orderbook, snapshot.valr_orderbook, target, usd_zar_rate=snapshot.exchange_rate,
+                ), min_time
+            )
+            results[f'fetch_market_snapshot[{label}]'] = measure(services.fetch_market_snapshot, min_time)
+            results[f'evaluate_alerts[{label},rules={ALERT_RULES}]'] = measure(
+                _alert_tick(snapshot, ALERT_RULES), min_time
+            )
+
+            # The web path: read the published snapshot, build the payload and serialize it
+            store.publish_snapshot(snapshot)
+            results[f'get_market_data[{label}]'] = measure(lambda: market_data_view(request), min_time)
+            for workers in concurrency:
+                results[f'get_market_data_load[{label},c={workers}]'] = measure_load(
+                    lambda: market_data_view(request), workers
+                )
+
+    return results
+
+def _alert_tick(snapshot, count, seed=0):
+    """One alert evaluation per call against `count` random rules, the metrics drifting every tick"""
+    rng = random.Random(seed)
+    metric_names = [metric for metric, _ in alerts.AlertRule.METRIC_CHOICES]
+    evaluator = alerts.AlertEvaluator([
+        alerts.CompiledRule(i, f'rule {i}', rng.choice(metric_names), rng.choice(['above', 'below']),
+                            rng.uniform(-5, 5), rng.choice([None, None, 60, 300]), 300)
+        for i in range(count)
+    ])
+    values = alerts.snapshot_metrics(snapshot)
+    clock = [snapshot.fetched_at]
+
+    def tick():
+        clock[0] += 1
+        for metric, value in values.items():
+            values[metric] = (value or 0.0) + rng.gauss(0, 0.05)
+        evaluator.evaluate(values, clock[0])
+    return tick
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Benchmarks whose median time grew by more than tolerance over the baseline, as messages"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        change = result['median'] / previous['median'] - 1
+        if change > tolerance:
+            regressions.append(
+                f"{name}: median {previous['median'] * 1000:.3f}ms -> {result['median'] * 1000:.3f}ms (+{change:.0%})"
+            )
+    return regressions
+
+def load_history(path):
+    """Entries of a benchmark history file (JSONL, oldest first); empty if it doesn't exist"""
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def append_history(path, results, label=None):
+    with open(path, 'a') as f:
+        f.write(json.dumps({'recorded_at': time.time(), 'label': label, 'results': results}) + '\n')
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+import bot.services as services
+import bot.store as store
+from bot import codec
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable via settings.MARKET_STREAM
+DEFAULT_STREAM_OPTIONS = {
+    'poll_interval': 0.5,   # seconds between checks of the shared snapshot store
+    'keepalive': 15,        # seconds of silence before a keepalive comment is sent
+}
+
+
+def diff_payload(old, new):
+    """Top-level keys of new whose values differ from old"""
+    return {key: value for key, value in new.items() if old.get(key) != value}
+
+def sse_event(event, data, event_id=None):
+    """Encode one Server-Sent Event"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {codec.dumps(data).decode()}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class SnapshotBroadcaster:
+    """Fans each new snapshot out to every Server-Sent Events subscriber in this process.
+
+    One producer task per process polls the shared store's version key, loads
+    the snapshot only when it moves and builds the payload once per version,
+    encoding it once as a full event and once as a diff against the previous
+    version. Subscribers are pulled by their own response stream, so a slow
+    client never queues anything: when it is ready for more it gets the diff
+    between what it last saw and the current payload, skipping the versions it
+    was too slow for.
+    """
+
+    def __init__(self, build_payload):
+        self.build_payload = build_payload
+        self.options = {**DEFAULT_STREAM_OPTIONS, **getattr(settings, 'MARKET_STREAM', {})}
+        self.version = None
+        self.payload = None
+        self.full_event = None
+        self.previous_version = None
+        self.diff_event = None
+        self.subscribers = 0
+        self._changed = None
+        self._producer = None
+
+    async def subscribe(self):
+        """Async iterator of SSE-encoded events for one client"""
+        self.subscribers += 1
+        self._ensure_producer()
+        sent_version = None
+        sent_payload = None
+        try:
+            while True:
+                if self.version is not None and self.version != sent_version:
+                    if sent_payload is None:
+                        event = self.full_event
+                    elif sent_version == self.previous_version:
+                        event = self.diff_event
+                    else:
+                        # Fell behind by more than one version, diff against what it last saw
+                        event = sse_event('diff', diff_payload(sent_payload, self.payload), self.version)
+                    # Noted before yielding: newer versions may be published before the client pulls again
+                    sent_version, sent_payload = self.version, self.payload
+                    yield event
+                    continue
+
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.options['keepalive'])
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+        finally:
+            self.subscribers -= 1
+
+    def _ensure_producer(self):
+        if self._producer is None or self._producer.done():
+            self._changed = asyncio.Event()
+            self._producer = asyncio.ensure_future(self._produce())
+
+    async def _produce(self):
+        live_fetched_at = 0.0
+        while self.subscribers:
+            try:
+                # Poll the small version key and only load (and unpickle) the books when it moves.
+                # Cache reads don't touch the ORM, so they needn't queue for Django's single sync thread
+                snapshot = None
+                version = await sync_to_async(store.latest_version, thread_sensitive=False)(
+                    max_age=services.SNAPSHOT_MAX_AGE
+                )
+                if version is not None and version != self.version:
+                    snapshot = await sync_to_async(store.latest_snapshot, thread_sensitive=False)(
+                        max_age=services.SNAPSHOT_MAX_AGE
+                    )
+                if version is None and time.monotonic() - live_fetched_at >= getattr(settings, 'MARKET_INGEST_INTERVAL', 5):
+                    # No ingestor running - fetch live, at the ingestor's cadence rather than ours
+                    snapshot = await services.afetch_market_snapshot()
+                    snapshot.version = time.time_ns() // 1_000_000
+                    live_fetched_at = time.monotonic()
+
+                if snapshot is not None and snapshot.version != self.version:
+                    await self._publish(snapshot)
+            except Exception as e:
+                logger.error(f"Error broadcasting market data: {e}")
+
+            await asyncio.sleep(self.options['poll_interval'])
+
+    async def _publish(self, snapshot):
+        payload = await sync_to_async(self.build_payload)(snapshot)
+        payload['version'] = snapshot.version
+
+        if self.payload is not None:
+            self.diff_event = sse_event('diff', diff_payload(self.payload, payload), snapshot.version)
+        self.previous_version = self.version
+        self.version = snapshot.version
+        self.payload = payload
+        self.full_event = sse_event('snapshot', payload, snapshot.version)
+
+        # Wake every waiting subscriber, then start a fresh event for the next version
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Defaults for every reference cache, overridable per cache via settings.REFERENCE_CACHES
+DEFAULT_CACHE_OPTIONS = {
+    'ttl': 300,            # seconds a value is served as fresh
+    'stale_ttl': 3600,     # extra seconds a value may be served while it is refreshed in the background
+    'shared': False,       # also read/write the Django cache so all workers share one value
+    'cache_alias': 'default',
+}
+
+
+class ReferenceCache:
+    """TTL cache for slow-moving reference data with stale-while-revalidate refresh.
+
+    Values live in an in-process dict and, when ``shared`` is on, in the Django
+    cache so every worker process sees the same value. Entries are stored as
+    ``(value, stored_at)`` using wall-clock time so both tiers agree on age.
+    """
+
+    def __init__(self, name, **options):
+        self.name = name
+        self.options = {**DEFAULT_CACHE_OPTIONS, **options}
+        self._local = {}
+        self._refreshing = set()
+        # The event loop only keeps weak references to tasks, so background refreshes are held here
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'shared_hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0}
+
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss or in the background when stale"""
+        entry, tier = self._get_entry(key)
+
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.options['ttl']:
+                self._count('shared_hits' if tier == 'shared' else 'hits')
+                return value
+            if age < self.options['ttl'] + self.options['stale_ttl']:
+                # Serve the stale value now and refresh it off the request path
+                self._count('stale_hits')
+                self._refresh_in_background(key, loader)
+                return value
+
+        self._count('misses')
+        return self._load(key, loader)
+
+    async def aget(self, key, loader):
+        """get() for an async loader; stale values are refreshed in a task on the running loop"""
+        entry, tier = self._get_entry(key)
+
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.options['ttl']:
+                self._count('shared_hits' if tier == 'shared' else 'hits')
+                return value
+            if age < self.options['ttl'] + self.options['stale_ttl']:
+                self._count('stale_hits')
+                with self._lock:
+                    refreshing = key in self._refreshing
+                    self._refreshing.add(key)
+                if not refreshing:
+                    task = asyncio.ensure_future(self._arefresh(key, loader))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                return value
+
+        self._count('misses')
+        return await self._aload(key, loader)
+
+    async def _aload(self, key, loader):
+        try:
+            value = await loader()
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Loading {self.name}:{key} failed: {e}")
+            return None
+
+        if value is None:
+            self._count('errors')
+            return None
+
+        self.set(key, value)
+        return value
+
+    async def _arefresh(self, key, loader):
+        try:
+            self._count('refreshes')
+            await self._aload(key, loader)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def set(self, key, value):
+        entry = (value, time.time())
+        self._local[key] = entry
+        if self.options['shared']:
+            self._shared_cache().set(self._shared_key(key), entry, self.options['ttl'] + self.options['stale_ttl'])
+
+    def clear(self):
+        self._local.clear()
+
+    def stats(self):
+        """Counters plus the hit rate over all lookups"""
+        stats = dict(self.counters)
+        lookups = stats['hits'] + stats['shared_hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = (lookups - stats['misses']) / lookups if lookups else None
+        return stats
+
+    def _get_entry(self, key):
+        """Return (entry, tier) preferring whichever tier holds the newer value"""
+        entry = self._local.get(key)
+        if entry is not None and time.time() - entry[1] < self.options['ttl']:
+            return entry, 'local'
+
+        if self.options['shared']:
+            shared_entry = self._shared_cache().get(self._shared_key(key))
+            if shared_entry is not None and (entry is None or shared_entry[1] > entry[1]):
+                self._local[key] = shared_entry
+                return shared_entry, 'shared'
+
+        return entry, 'local'
+
+    def _load(self, key, loader):
+        try:
+            value = loader()
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Loading {self.name}:{key} failed: {e}")
+            return None
+
+        if value is None:
+            self._count('errors')
+            return None
+
+        self.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._count('refreshes')
+                self._load(key, loader)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f'cache-refresh-{self.name}', daemon=True).start()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _shared_cache(self):
+        return caches[self.options['cache_alias']]
+
+    def _shared_key(self, key):
+        return f'bot:refcache:{self.name}:{key}'
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key: one caller runs, the rest wait for its result"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'coalesced': 0}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.counters['calls'] += 1
+            else:
+                self.counters['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines; calls are coalesced per event loop"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = weakref.WeakKeyDictionary()  # event loop -> {key: future}
+        self.counters = {'calls': 0, 'coalesced': 0}
+
+    async def do(self, key, func):
+        calls = self._calls.setdefault(asyncio.get_running_loop(), {})
+        future = calls.get(key)
+        if future is not None:
+            self.counters['coalesced'] += 1
+            # Shielded so one cancelled waiter doesn't cancel the call for everyone
+            return await asyncio.shield(future)
+
+        self.counters['calls'] += 1
+        future = calls[key] = asyncio.ensure_future(func())
+        future.add_done_callback(lambda _: calls.pop(key, None))
+        return await asyncio.shield(future)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResponseCache:
+    """Small in-process LRU of values that expire `ttl` seconds after they are stored"""
+
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(name):
+    """Return the shared reference cache with the given name, creating it on first use"""
+    cache = _caches.get(name)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(name)
+            if cache is None:
+                options = getattr(settings, 'REFERENCE_CACHES', {}).get(name, {})
+                cache = _caches[name] = ReferenceCache(name, **options)
+    return cache
+
+def cache_stats():
+    """Counters for every reference cache created so far"""
+    return {name: cache.stats() for name, cache in _caches.items()}
@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from bot import metrics
+from bot.cache import AsyncSingleFlight, SingleFlight
+from bot.ratelimit import get_limiter
+
+logger = logging.getLogger(__name__)
+
+# Defaults for every upstream client, overridable per client via settings.EXCHANGE_CLIENTS
+DEFAULT_CLIENT_OPTIONS = {
+    'connect_timeout': 3.05,
+    'read_timeout': 5,
+    'pool_size': 10,
+    'max_retries': 2,
+    'backoff': 0.2,          # base backoff in seconds, doubled per attempt with full jitter
+    'failure_threshold': 5,  # consecutive failures before the circuit opens
+    'reset_timeout': 30,     # seconds the circuit stays open before a trial request
+    'queue_timeout': 2,      # seconds a request may wait for the rate limiter before giving up
+}
+
+# Status codes worth retrying - rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def retry_after(response, attempt, backoff):
+    """Seconds to back off after a 429, from Retry-After or ByBit's reset timestamp if given.
+
+    Without either, a multiple of the retry backoff for the attempt. Works on
+    requests and httpx responses alike.
+    """
+    try:
+        if 'Retry-After' in response.headers:
+            return float(response.headers['Retry-After'])
+        if 'X-Bapi-Limit-Reset-Timestamp' in response.headers:
+            return max(0.0, int(response.headers['X-Bapi-Limit-Reset-Timestamp']) / 1000 - time.time())
+    except ValueError:
+        pass
+    return backoff * (2 ** attempt) * 5
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised when a request is short-circuited because the upstream is failing"""
+
+
+class RateLimitedError(requests.RequestException):
+    """Raised when a request can't get a rate limit token within the queue timeout"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial request"""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Check whether a request may go out, moving open -> half-open once the timeout passes.
+
+        Returns False to short-circuit, HALF_OPEN for the trial request (which
+        must end in record_success, record_failure or release) and True otherwise.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let exactly one trial request through
+                self.state = self.HALF_OPEN
+                return self.HALF_OPEN
+            return False
+
+    def release(self):
+        """Give back a trial request that ended without reaching the upstream, so the next one can try"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class ExchangeClient:
+    """Keep-alive HTTP client for one upstream host with timeouts, retries and a circuit breaker"""
+
+    def __init__(self, name, base_url, **options):
+        self.name = name
+        self.base_url = base_url
+        self.options = {**DEFAULT_CLIENT_OPTIONS, **options}
+        self.timeout = (self.options['connect_timeout'], self.options['read_timeout'])
+        self.breaker = CircuitBreaker(self.options['failure_threshold'], self.options['reset_timeout'])
+        self.limiter = get_limiter(name)
+        # Identical concurrent GETs (e.g. Valr's ticker and volume share marketsummary) go out once
+        self._inflight = SingleFlight(name)
+
+        # Persistent connection pool; retries are handled here so they share the breaker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.options['pool_size'], max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, path='', params=None, priority=None):
+        """GET base_url + path, retrying transient failures with jittered backoff.
+
+        Requests wait their turn with the upstream's rate limiter (see bot.ratelimit),
+        by ``priority`` or the endpoint's default priority.
+        """
+        key = (path, tuple(sorted((params or {}).items())))
+        return self._inflight.do(key, lambda: self._get(path, params, priority))
+
+    def _get(self, path, params, priority):
+        allowed = self.breaker.allow_request()
+        if not allowed:
+            raise CircuitOpenError(f"Circuit open for {self.name}, skipping {path or self.base_url}")
+        try:
+            response = self._send(path, params, priority)
+        except RateLimitedError:
+            # Never reached the upstream, so says nothing about its health
+            if allowed == CircuitBreaker.HALF_OPEN:
+                self.breaker.release()
+            raise
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            if allowed == CircuitBreaker.HALF_OPEN:
+                self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return response
+
+    def _send(self, path, params, priority):
+        """The request with its retries; the caller records the outcome with the breaker"""
+        url = self.base_url + path
+        max_retries = self.options['max_retries']
+        endpoint = path or '/'
+
+        for attempt in range(max_retries + 1):
+            if self.limiter is not None and not self.limiter.acquire(endpoint, priority, self.options['queue_timeout']):
+                raise RateLimitedError(f"{self.name} rate limit queue timed out for {endpoint}")
+
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                metrics.increment('upstream_errors_total', client=self.name, endpoint=endpoint, reason=type(e).__name__)
+                # Only connection failures and timeouts are transient; anything else (bad
+                # redirects, TLS or broken chunked bodies) fails the request straight away
+                if attempt == max_retries or not isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                    raise
+                logger.warning(f"{self.name} request to {path or url} failed ({e}), retrying")
+            else:
+                metrics.observe('upstream_request_seconds', time.perf_counter() - started,
+                                client=self.name, endpoint=endpoint)
+                metrics.observe('upstream_response_bytes', len(response.content), metrics.SIZE_BUCKETS,
+                                client=self.name, endpoint=endpoint)
+                if response.status_code >= 400:
+                    metrics.increment('upstream_errors_total', client=self.name, endpoint=endpoint,
+                                      reason=str(response.status_code))
+                if response.status_code == 429 and self.limiter is not None:
+                    self.limiter.penalize(retry_after(response, attempt, self.options['backoff']))
+                if response.status_code not in RETRY_STATUSES:
+                    # Other 4xx are our request's fault: no payload, and retrying won't help
+                    response.raise_for_status()
+                    return response
+                if attempt == max_retries:
+                    response.raise_for_status()
+                logger.warning(f"{self.name} returned {response.status_code} for {path or url}, retrying")
+
+            self._sleep_before_retry(attempt)
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: uniform in [0, backoff * 2^attempt]
+        time.sleep(random.uniform(0, self.options['backoff'] * (2 ** attempt)))
+
+
+class AsyncExchangeClient:
+    """ExchangeClient for coroutines on a pooled httpx.AsyncClient.
+
+    Shares the circuit breaker, rate limiter and options of the upstream's sync
+    client, and raises the same requests exceptions so callers handle both alike.
+    """
+
+    def __init__(self, sync_client):
+        import httpx  # optional dependency, only needed for the async service layer
+
+        self.httpx = httpx
+        self.name = sync_client.name
+        self.base_url = sync_client.base_url
+        self.options = sync_client.options
+        self.breaker = sync_client.breaker
+        self.limiter = sync_client.limiter
+        self._inflight = AsyncSingleFlight(self.name)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.options['read_timeout'], connect=self.options['connect_timeout']),
+            limits=httpx.Limits(max_connections=self.options['pool_size'],
+                                max_keepalive_connections=self.options['pool_size']),
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def get(self, path='', params=None, priority=None):
+        """Async ExchangeClient.get"""
+        key = (path, tuple(sorted((params or {}).items())))
+        return await self._inflight.do(key, lambda: self._get(path, params, priority))
+
+    async def _get(self, path, params, priority):
+        allowed = self.breaker.allow_request()
+        if not allowed:
+            raise CircuitOpenError(f"Circuit open for {self.name}, skipping {path or self.base_url}")
+        try:
+            response = await self._send(path, params, priority)
+        except RateLimitedError:
+            if allowed == CircuitBreaker.HALF_OPEN:
+                self.breaker.release()
+            raise
+        except (requests.RequestException, self.httpx.HTTPError):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Including cancellation by a fetch deadline
+            if allowed == CircuitBreaker.HALF_OPEN:
+                self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return response
+
+    async def _send(self, path, params, priority):
+        url = self.base_url + path
+        max_retries = self.options['max_retries']
+        endpoint = path or '/'
+
+        for attempt in range(max_retries + 1):
+            if self.limiter is not None and not await self.limiter.aacquire(endpoint, priority, self.options['queue_timeout']):
+                raise RateLimitedError(f"{self.name} rate limit queue timed out for {endpoint}")
+
+            started = time.perf_counter()
+            try:
+                response = await self.client.get(url, params=params)
+            except self.httpx.TransportError as e:
+                metrics.increment('upstream_errors_total', client=self.name, endpoint=endpoint, reason=type(e).__name__)
+                if attempt == max_retries:
+                    error = requests.Timeout if isinstance(e, self.httpx.TimeoutException) else requests.ConnectionError
+                    raise error(f"{self.name} request to {path or url} failed: {e}") from e
+                logger.warning(f"{self.name} request to {path or url} failed ({e}), retrying")
+            else:
+                metrics.observe('upstream_request_seconds', time.perf_counter() - started,
+                                client=self.name, endpoint=endpoint)
+                metrics.observe('upstream_response_bytes', len(response.content), metrics.SIZE_BUCKETS,
+                                client=self.name, endpoint=endpoint)
+                if response.status_code >= 400:
+                    metrics.increment('upstream_errors_total', client=self.name, endpoint=endpoint,
+                                      reason=str(response.status_code))
+                if response.status_code == 429 and self.limiter is not None:
+                    self.limiter.penalize(retry_after(response, attempt, self.options['backoff']))
+                if response.status_code not in RETRY_STATUSES:
+                    if response.status_code >= 400:
+                        raise requests.HTTPError(f"{self.name} returned {response.status_code} for {path or url}")
+                    return response
+                if attempt == max_retries:
+                    raise requests.HTTPError(f"{self.name} returned {response.status_code} for {path or url}")
+                logger.warning(f"{self.name} returned {response.status_code} for {path or url}, retrying")
+
+            await asyncio.sleep(random.uniform(0, self.options['backoff'] * (2 ** attempt)))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(name, base_url):
+    """Return the shared client for an upstream, creating it on first use"""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                options = getattr(settings, 'EXCHANGE_CLIENTS', {}).get(name, {})
+                client = _clients[name] = ExchangeClient(name, base_url, **options)
+    return client
+
+# Async clients are bound to the event loop their connections were opened on, so
+# each loop gets its own, closed when the loop shuts down
+_async_clients = weakref.WeakKeyDictionary()
+_async_closers = weakref.WeakKeyDictionary()
+
+def get_async_client(name, base_url):
+    """Return the async client for an upstream on the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _async_clients[loop] = {}
+        _async_closers[loop] = _close_on_shutdown(clients)
+    client = clients.get(name)
+    if client is None:
+        client = clients[name] = AsyncExchangeClient(get_client(name, base_url))
+    return client
+
+def _close_on_shutdown(clients):
+    """Close a loop's clients as it shuts down.
+
+    asyncio.run() (and so uvicorn, and asgiref's per-call loops) finalizes the
+    loop's suspended async generators before closing it; this one closes the
+    clients on the way out. Returns the generator, which the caller must keep.
+    """
+    async def closer():
+        try:
+            yield
+        finally:
+            for client in list(clients.values()):
+                await client.aclose()
+            clients.clear()
+
+    generator = closer()
+    asyncio.ensure_future(generator.asend(None))  # start it, registering it with the loop
+    return generator
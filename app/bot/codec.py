@@ -0,0 +1,152 @@
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from bot.orderbook import BookSide, OrderBook
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib json module is the fallback
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec is optional, only used for typed order book decoding
+    msgspec = None
+
+
+def _default(value):
+    """Types the JSON libraries don't serialize natively"""
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonCodec:
+    """Standard library codec; also the base the faster codecs override"""
+    name = 'json'
+    decode_errors = (json.JSONDecodeError,)
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, value):
+        """Serialize to UTF-8 bytes, Decimals as JSON numbers"""
+        return json.dumps(value, default=_default, separators=(',', ':')).encode()
+
+    def decode_bybit_orderbook(self, data):
+        """OrderBook from a ByBit /v5/market/orderbook response body, or None if retCode isn't 0"""
+        response = self.loads(data)
+        if response['retCode'] != 0:
+            return None
+        result = response['result'] or {}
+        return OrderBook.from_levels(result.get('b', []), result.get('a', []), currency='USD')
+
+    def decode_valr_orderbook(self, data):
+        """OrderBook from a Valr /v1/public/<pair>/orderbook response body"""
+        response = self.loads(data)
+        return OrderBook.from_levels(
+            ((bid['price'], bid['quantity']) for bid in response['Bids']),
+            ((ask['price'], ask['quantity']) for ask in response['Asks']),
+            currency='ZAR',
+        )
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def __init__(self):
+        self.decode_errors = (orjson.JSONDecodeError,)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, value):
+        # Dataclasses and NumPy arrays serialize natively, Decimals go through _default
+        return orjson.dumps(value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+if msgspec is not None:
+    # ByBit sends "result": {} alongside a non-zero retCode, so every field needs a default
+    class _BybitBook(msgspec.Struct):
+        b: list[tuple[str, str]] = []
+        a: list[tuple[str, str]] = []
+
+    class _BybitBookResponse(msgspec.Struct):
+        retCode: int
+        result: _BybitBook | None = None
+
+    class _ValrLevel(msgspec.Struct):
+        price: str
+        quantity: str
+
+    class _ValrBookResponse(msgspec.Struct, rename={'bids': 'Bids', 'asks': 'Asks'}):
+        bids: list[_ValrLevel]
+        asks: list[_ValrLevel]
+
+
+class MsgspecCodec(JsonCodec):
+    """Decodes order books against typed schemas, skipping every field the book doesn't use"""
+    name = 'msgspec'
+
+    def __init__(self):
+        self.decode_errors = (msgspec.DecodeError,)
+        self.encoder = msgspec.json.Encoder(enc_hook=_default, decimal_format='number')
+        self.bybit_book_decoder = msgspec.json.Decoder(_BybitBookResponse)
+        self.valr_book_decoder = msgspec.json.Decoder(_ValrBookResponse)
+
+    def loads(self, data):
+        return msgspec.json.decode(data)
+
+    def dumps(self, value):
+        return self.encoder.encode(value)
+
+    def decode_bybit_orderbook(self, data):
+        response = self.bybit_book_decoder.decode(data)
+        if response.retCode != 0 or response.result is None:
+            return None
+        return OrderBook.from_levels(response.result.b, response.result.a, currency='USD')
+
+    def decode_valr_orderbook(self, data):
+        response = self.valr_book_decoder.decode(data)
+        return OrderBook(
+            BookSide.from_levels((level.price, level.quantity) for level in response.bids),
+            BookSide.from_levels((level.price, level.quantity) for level in response.asks),
+            'ZAR',
+        )
+
+
+CODECS = {'json': JsonCodec, 'orjson': OrjsonCodec, 'msgspec': MsgspecCodec}
+AVAILABLE_CODECS = ['json'] + [name for name, module in (('orjson', orjson), ('msgspec', msgspec)) if module is not None]
+
+_codec = None
+
+def get_codec():
+    """The codec named by settings.JSON_CODEC, or the fastest one installed"""
+    global _codec
+    if _codec is None:
+        name = getattr(settings, 'JSON_CODEC', None) or ('orjson' if orjson is not None else AVAILABLE_CODECS[-1])
+        if name not in AVAILABLE_CODECS:
+            raise ValueError(f"JSON codec {name!r} is not installed (available: {', '.join(AVAILABLE_CODECS)})")
+        _codec = CODECS[name]()
+    return _codec
+
+def loads(data):
+    return get_codec().loads(data)
+
+def dumps(value):
+    return get_codec().dumps(value)
+
+def decode_errors():
+    """Exception types raised for malformed bodies, for use in except clauses"""
+    return (json.JSONDecodeError,) + get_codec().decode_errors
+
+
+class CodecJsonResponse(HttpResponse):
+    """JsonResponse serialized with the configured codec; Decimals are written as numbers"""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
@@ -0,0 +1,362 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import ROUND_DOWN, Decimal
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+import bot.services as services
+from bot.models import Trade, TradeLevel
+from bot.persistence import get_trade_writer
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable via settings.EXECUTION
+DEFAULT_EXECUTION_OPTIONS = {
+    'enabled': False,
+    'fill_timeout': 10,       # seconds to wait for both legs to reach a final state
+    'poll_interval': 0.2,     # seconds between order status checks
+    'cooldown': 30,           # seconds after a trade before the next one may start
+    'quantity_step': '0.000001',
+    'connect_timeout': 3.05,
+    'read_timeout': 5,
+}
+
+BUY = 'buy'
+SELL = 'sell'
+
+
+class OrderRejected(Exception):
+    """Raised when an exchange refuses an order"""
+
+
+def valr_auth_headers(api_key, api_secret, verb, path, body=''):
+    """Valr's request signing headers: an HMAC-SHA512 of timestamp + verb + path + body keyed by the secret bytes"""
+    timestamp = str(int(time.time() * 1000))
+    signature = hmac.new(api_secret, (timestamp + verb + path + body).encode(), hashlib.sha512)
+    return {'X-VALR-API-KEY': api_key, 'X-VALR-TIMESTAMP': timestamp, 'X-VALR-SIGNATURE': signature.hexdigest()}
+
+
+class ExchangeTrader:
+    """Authenticated order client for one exchange on a pre-warmed keep-alive session.
+
+    Static headers and signing prefixes are prepared once, so placing an order
+    only costs a timestamp, one HMAC and the POST itself. Orders are never
+    retried here, as order placement isn't idempotent.
+    """
+    venue = None
+    time_endpoint = None
+
+    def __init__(self, base_url, api_key, api_secret, connect_timeout=3.05, read_timeout=5):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.api_secret = api_secret.encode()
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.mount(base_url, HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+
+    def warm(self):
+        """Open (and keep open) the TCP+TLS connection before the first order needs it"""
+        self.session.get(self.base_url + self.time_endpoint, timeout=self.timeout)
+
+    def place_market_order(self, side, quantity, client_order_id):
+        """Place a market order for quantity BTC, returning the exchange's order id"""
+        raise NotImplementedError
+
+    def order_status(self, order_id):
+        """{'filled': Decimal, 'average_price': Decimal or None, 'done': bool}"""
+        raise NotImplementedError
+
+
+class BybitTrader(ExchangeTrader):
+    venue = 'bybit'
+    symbol = 'BTCUSDT'
+    currency = 'USD'
+    time_endpoint = '/v5/market/time'
+    order_endpoint = '/v5/order/create'
+    status_endpoint = '/v5/order/realtime'
+    final_statuses = {'Filled', 'Cancelled', 'Rejected', 'PartiallyFilledCanceled'}
+
+    def __init__(self, *args, recv_window=5000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.headers = {
+            'X-BAPI-API-KEY': self.api_key,
+            'X-BAPI-RECV-WINDOW': str(recv_window),
+            'Content-Type': 'application/json',
+        }
+        # Signature payload is timestamp + api key + recv window + body/query
+        self.sign_prefix = self.api_key + str(recv_window)
+
+    def place_market_order(self, side, quantity, client_order_id):
+        body = json.dumps({
+            'category': 'spot',
+            'symbol': self.symbol,
+            'side': 'Buy' if side == BUY else 'Sell',
+            'orderType': 'Market',
+            'marketUnit': 'baseCoin',
+            'qty': str(quantity),
+            'orderLinkId': client_order_id,
+        }, separators=(',', ':'))
+        response = self.session.post(
+            self.base_url + self.order_endpoint, data=body, headers=self._signed(body), timeout=self.timeout
+        )
+        data = response.json()
+        if data['retCode'] != 0:
+            raise OrderRejected(f"ByBit rejected order: {data['retMsg']}")
+        return data['result']['orderId']
+
+    def order_status(self, order_id):
+        query = urlencode({'category': 'spot', 'orderId': order_id})
+        response = self.session.get(
+            f'{self.base_url}{self.status_endpoint}?{query}', headers=self._signed(query), timeout=self.timeout
+        )
+        data = response.json()
+        if data['retCode'] != 0 or not data['result']['list']:
+            raise OrderRejected(f"ByBit order {order_id} not found: {data.get('retMsg')}")
+        order = data['result']['list'][0]
+        return {
+            'filled': Decimal(order['cumExecQty']),
+            'average_price': Decimal(order['avgPrice']) if order.get('avgPrice') else None,
+            'done': order['orderStatus'] in self.final_statuses,
+        }
+
+    def _signed(self, payload):
+        timestamp = str(int(time.time() * 1000))
+        signature = hmac.new(self.api_secret, (timestamp + self.sign_prefix + payload).encode(), hashlib.sha256)
+        return {**self.headers, 'X-BAPI-TIMESTAMP': timestamp, 'X-BAPI-SIGN': signature.hexdigest()}
+
+
+class ValrTrader(ExchangeTrader):
+    venue = 'valr'
+    pair = 'BTCZAR'
+    currency = 'ZAR'
+    time_endpoint = '/v1/public/time'
+    order_endpoint = '/v1/orders/market'
+    status_endpoint = '/v1/orders/history/summary/orderid/{}'
+    final_statuses = {'Filled', 'Cancelled', 'Failed'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.headers = {'X-VALR-API-KEY': self.api_key, 'Content-Type': 'application/json'}
+
+    def place_market_order(self, side, quantity, client_order_id):
+        body = json.dumps({
+            'side': side.upper(),
+            'baseAmount': str(quantity),
+            'pair': self.pair,
+            'customerOrderId': client_order_id,
+        }, separators=(',', ':'))
+        response = self.session.post(
+            self.base_url + self.order_endpoint, data=body,
+            headers=self._signed('POST', self.order_endpoint, body), timeout=self.timeout
+        )
+        if response.status_code != 202:
+            raise OrderRejected(f"Valr rejected order: {response.text}")
+        return response.json()['id']
+
+    def order_status(self, order_id):
+        path = self.status_endpoint.format(order_id)
+        response = self.session.get(self.base_url + path, headers=self._signed('GET', path), timeout=self.timeout)
+        response.raise_for_status()
+        order = response.json()
+        return {
+            'filled': Decimal(order['originalQuantity']) - Decimal(order['remainingQuantity']),
+            'average_price': Decimal(order['averagePrice']) if order.get('averagePrice') else None,
+            'done': order['orderStatusType'] in self.final_statuses,
+        }
+
+    def _signed(self, verb, path, body=''):
+        return {**self.headers, **valr_auth_headers(self.api_key, self.api_secret, verb, path, body)}
+
+
+def execution_options():
+    return {**DEFAULT_EXECUTION_OPTIONS, **getattr(settings, 'EXECUTION', {})}
+
+
+class ExecutionEngine:
+    """Fires both legs of an arbitrage at once, waits for fills and flattens any imbalance"""
+
+    def __init__(self, buy_trader, sell_trader, writer=None, **options):
+        self.buy_trader = buy_trader
+        self.sell_trader = sell_trader
+        # Trades are persisted write-behind, so the database never delays an order
+        self.writer = writer or get_trade_writer()
+        self.options = {**execution_options(), **options}
+        self.quantity_step = Decimal(self.options['quantity_step'])
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='execution')
+        self._busy = threading.Lock()
+        self._last_trade_at = float('-inf')
+
+    @classmethod
+    def from_settings(cls):
+        """Buy on Valr and sell on ByBit, matching how analyze_order_books walks the books"""
+        options = execution_options()
+        timeouts = {'connect_timeout': options['connect_timeout'], 'read_timeout': options['read_timeout']}
+        return cls(ValrTrader(**options['valr'], **timeouts), BybitTrader(**options['bybit'], **timeouts))
+
+    def warm(self):
+        for future in [self.executor.submit(trader.warm) for trader in (self.buy_trader, self.sell_trader)]:
+            try:
+                future.result()
+            except requests.RequestException as e:
+                logger.warning(f"Could not pre-warm connection: {e}")
+
+    def close(self, timeout=10):
+        """Wait for a running trade, then write every queued trade record"""
+        self.executor.shutdown(wait=True)
+        self.writer.flush(timeout)
+
+    def submit(self, snapshot, analysis, signal_at):
+        """Execute in the background unless a trade is running or the cooldown hasn't passed"""
+        if time.monotonic() - self._last_trade_at < self.options['cooldown'] or not self._busy.acquire(blocking=False):
+            return None
+
+        def run():
+            try:
+                return self.execute(snapshot, analysis, signal_at)
+            finally:
+                self._last_trade_at = time.monotonic()
+                self._busy.release()
+
+        return self.executor.submit(run)
+
+    def execute(self, snapshot, analysis, signal_at):
+        """Place both legs for the analysed volume and record the outcome; signal_at is a perf_counter()"""
+        quantity = analysis['tradable_volume'].quantize(self.quantity_step, rounding=ROUND_DOWN)
+        if quantity <= 0:
+            return None
+
+        client_order_id = uuid.uuid4().hex[:32]
+        trade = self._create_trade(snapshot, analysis, quantity, client_order_id)
+
+        # Both legs go out together; each records its own signal-to-acknowledgement time
+        buy = self.executor.submit(self._place, self.buy_trader, BUY, quantity, f'b{client_order_id}', signal_at)
+        sell = self.executor.submit(self._place, self.sell_trader, SELL, quantity, f's{client_order_id}', signal_at)
+        legs = {BUY: buy.result(), SELL: sell.result()}
+
+        self._wait_for_fills(legs)
+        hedge = self._hedge(legs, client_order_id)
+        self._record_outcome(trade, snapshot, legs, hedge)
+        return trade
+
+    def _place(self, trader, side, quantity, client_order_id, signal_at):
+        leg = {'trader': trader, 'side': side, 'quantity': quantity, 'order_id': None,
+               'ack_ms': None, 'filled': Decimal('0'), 'average_price': None, 'done': True, 'error': None}
+        try:
+            leg['order_id'] = trader.place_market_order(side, quantity, client_order_id)
+            leg['ack_ms'] = (time.perf_counter() - signal_at) * 1000
+            leg['done'] = False
+        except Exception as e:
+            logger.error(f"{trader.venue} {side} leg failed: {e}")
+            leg['error'] = str(e)
+        return leg
+
+    def _wait_for_fills(self, legs):
+        deadline = time.monotonic() + self.options['fill_timeout']
+        while any(not leg['done'] for leg in legs.values()) and time.monotonic() < deadline:
+            for leg in legs.values():
+                if leg['done']:
+                    continue
+                try:
+                    leg.update(leg['trader'].order_status(leg['order_id']))
+                except Exception as e:
+                    logger.warning(f"Could not fetch {leg['trader'].venue} order {leg['order_id']}: {e}")
+            time.sleep(self.options['poll_interval'])
+
+    def _hedge(self, legs, client_order_id):
+        """Flatten any BTC imbalance left by a failed or partial leg on the venue that over-filled"""
+        imbalance = legs[BUY]['filled'] - legs[SELL]['filled']
+        if abs(imbalance) < self.quantity_step:
+            return None
+
+        # Bought more than we sold: sell the excess back; sold more than we bought: buy it back
+        trader, side = (self.buy_trader, SELL) if imbalance > 0 else (self.sell_trader, BUY)
+        quantity = abs(imbalance).quantize(self.quantity_step, rounding=ROUND_DOWN)
+        logger.warning(f"Legs filled unevenly, hedging {side} {quantity} BTC on {trader.venue}")
+        try:
+            order_id = trader.place_market_order(side, quantity, f'h{client_order_id}')
+            return f"Hedged {side} {quantity} BTC on {trader.venue} (order {order_id})"
+        except Exception as e:
+            logger.error(f"Hedge on {trader.venue} failed: {e}")
+            return f"Hedge {side} {quantity} BTC on {trader.venue} FAILED: {e}"
+
+    def _create_trade(self, snapshot, analysis, quantity, client_order_id):
+        """Queue a pending trade and its levels, so there is a record of it even if we die mid-trade"""
+        rate = snapshot.exchange_rate
+        trade = Trade(
+            client_order_id=client_order_id,
+            investment_amount_zar=analysis['vwap_valr_price_usd'] * rate * quantity,
+            btc_volume=quantity,
+            bybit_price_usd=analysis['vwap_bybit_price_usd'],
+            valr_price_zar=analysis['vwap_valr_price_usd'] * rate,
+            usd_zar_rate=rate,
+            premium_percentage=analysis['average_spread_percentage'],
+            signal_at=timezone.now(),
+        )
+        levels = [
+            TradeLevel(
+                bybit_price_usd=level['bybit_price_usd'],
+                valr_price_zar=level['valr_price_zar'],
+                btc_volume=level['quantity'],
+                spread_percentage=level['spread_percentage'],
+            )
+            for level in analysis['trade_levels']
+        ]
+        self.writer.enqueue(trade, levels)
+        return trade
+
+    def _record_outcome(self, trade, snapshot, legs, hedge):
+        buy, sell = legs[BUY], legs[SELL]
+        for leg in (buy, sell):
+            setattr(trade, f"{leg['trader'].venue}_transaction_id", leg['order_id'])
+            setattr(trade, f"{leg['trader'].venue}_ack_ms", leg['ack_ms'])
+
+        notes = [f"{leg['trader'].venue} {leg['side']}: {leg['error']}" for leg in (buy, sell) if leg['error']]
+        if hedge:
+            notes.append(hedge)
+
+        if buy['error'] or sell['error'] or buy['filled'] < buy['quantity'] or sell['filled'] < sell['quantity']:
+            trade.status = Trade.FAILED
+        else:
+            trade.status = Trade.COMPLETED
+
+        matched = min(buy['filled'], sell['filled'])
+        if matched and buy['average_price'] and sell['average_price']:
+            # Profit on the matched volume, in ZAR
+            buy_zar, sell_zar = self._in_zar(buy, snapshot), self._in_zar(sell, snapshot)
+            trade.profit_zar = (sell_zar - buy_zar) * matched
+
+        trade.notes = '\n'.join(notes) or None
+        self.writer.enqueue(trade)
+        logger.info(f"Trade {trade.client_order_id} {trade.status} - buy {buy['filled']} / sell {sell['filled']} BTC")
+
+    def _in_zar(self, leg, snapshot):
+        if leg['trader'].currency == 'ZAR':
+            return leg['average_price']
+        return leg['average_price'] * snapshot.exchange_rate
+
+
+def find_opportunity(snapshot):
+    """Analysis for a snapshot if the books can fill a trade in the direction we execute, else None.
+
+    The Live Gross Premium is Valr over ByBit, the opposite of buying Valr asks
+    and selling ByBit bids, so the only gate is the walk itself: every level it
+    takes already clears MIN_SPREAD_PERCENTAGE in the traded direction.
+    """
+    if snapshot.bybit_volume is None or snapshot.valr_volume is None:
+        return None
+
+    target = services.calculate_tradable_btc(snapshot.bybit_volume, snapshot.valr_volume)
+    analysis = services.analyze_order_books(
+        snapshot.bybit_orderbook, snapshot.valr_orderbook, target, usd_zar_rate=snapshot.exchange_rate
+    )
+    return analysis if analysis['can_execute'] else None
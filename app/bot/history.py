@@ -0,0 +1,167 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, F, Q, Sum
+from django.db.models.functions import TruncHour, TruncMinute
+
+import bot.services as services
+from bot.models import MarketSnapshotRecord
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable via settings.SNAPSHOT_HISTORY
+DEFAULT_HISTORY_OPTIONS = {
+    'batch_size': 200,      # rows per bulk_create
+    'flush_interval': 30,   # seconds a row may sit in the buffer
+    # Days each resolution is kept before it is rolled up into the next one (None keeps forever)
+    'retention': {
+        MarketSnapshotRecord.RAW: 2,
+        MarketSnapshotRecord.MINUTE: 30,
+        MarketSnapshotRecord.HOUR: None,
+    },
+}
+
+# Resolution -> (coarser resolution it rolls up into, truncation function)
+ROLLUPS = {
+    MarketSnapshotRecord.RAW: (MarketSnapshotRecord.MINUTE, TruncMinute),
+    MarketSnapshotRecord.MINUTE: (MarketSnapshotRecord.HOUR, TruncHour),
+}
+
+AVERAGED_FIELDS = [
+    'bybit_price_usd', 'valr_price_zar', 'usd_zar_rate', 'premium_percentage', 'tradable_btc',
+    'bybit_bid_usd', 'bybit_ask_usd', 'valr_bid_zar', 'valr_ask_zar',
+]
+
+def history_options():
+    return {**DEFAULT_HISTORY_OPTIONS, **getattr(settings, 'SNAPSHOT_HISTORY', {})}
+
+
+def snapshot_to_record(snapshot):
+    """Build an unsaved MarketSnapshotRecord from a MarketSnapshot"""
+    tradable_btc = None
+    if snapshot.bybit_volume is not None and snapshot.valr_volume is not None:
+        tradable_btc = services.calculate_tradable_btc(snapshot.bybit_volume, snapshot.valr_volume)
+
+    return MarketSnapshotRecord(
+        recorded_at=datetime.fromtimestamp(snapshot.fetched_at, tz=timezone.utc),
+        bybit_price_usd=snapshot.bybit_ticker,
+        valr_price_zar=snapshot.valr_ticker,
+        usd_zar_rate=snapshot.exchange_rate,
+        premium_percentage=snapshot.percentage_premium,
+        tradable_btc=tradable_btc,
+        bybit_bid_usd=_best_price(snapshot.bybit_orderbook, 'bids'),
+        bybit_ask_usd=_best_price(snapshot.bybit_orderbook, 'asks'),
+        valr_bid_zar=_best_price(snapshot.valr_orderbook, 'bids'),
+        valr_ask_zar=_best_price(snapshot.valr_orderbook, 'asks'),
+    )
+
+def _best_price(orderbook, side):
+    if not orderbook or not len(orderbook[side]):
+        return None
+    return orderbook[side].price(0)
+
+
+class SnapshotRecorder:
+    """Buffers snapshot records and writes them with bulk_create in batches"""
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        options = history_options()
+        self.batch_size = batch_size or options['batch_size']
+        self.flush_interval = flush_interval or options['flush_interval']
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def record(self, snapshot):
+        self.buffer.append(snapshot_to_record(snapshot))
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        records, self.buffer = self.buffer, []
+        try:
+            MarketSnapshotRecord.objects.bulk_create(records, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f"Failed to write {len(records)} snapshot records: {e}")
+
+
+def downsample(resolution, older_than, now=None):
+    """Roll rows of a resolution older than the cutoff up into the next resolution, deleting the originals"""
+    target_resolution, trunc = ROLLUPS[resolution]
+    now = now or datetime.now(timezone.utc)
+
+    # Only roll up whole buckets, so a bucket is never split across two rows
+    cutoff = now - older_than
+    cutoff = cutoff.replace(second=0, microsecond=0)
+    if target_resolution == MarketSnapshotRecord.HOUR:
+        cutoff = cutoff.replace(minute=0)
+
+    rows = MarketSnapshotRecord.objects.filter(resolution=resolution, recorded_at__lt=cutoff)
+    # Rows average different numbers of snapshots, so each counts by its samples rather than once
+    weighted = {}
+    for name in AVERAGED_FIELDS:
+        weighted[f'sum_{name}'] = Sum(F(name) * F('samples'), output_field=DecimalField())
+        weighted[f'samples_{name}'] = Sum('samples', filter=Q(**{f'{name}__isnull': False}))
+    buckets = (
+        rows.annotate(bucket=trunc('recorded_at'))
+        .values('bucket')
+        .annotate(samples_total=Sum('samples'), **weighted)
+        .order_by('bucket')
+    )
+
+    with transaction.atomic():
+        rollups = [
+            MarketSnapshotRecord(
+                recorded_at=bucket['bucket'],
+                resolution=target_resolution,
+                samples=bucket['samples_total'],
+                **{name: _weighted_mean(bucket, name) for name in AVERAGED_FIELDS},
+            )
+            for bucket in buckets
+        ]
+        MarketSnapshotRecord.objects.bulk_create(rollups, batch_size=history_options()['batch_size'])
+        deleted, _ = rows.delete()
+
+    logger.info(f"Rolled {deleted} {resolution} rows up into {len(rollups)} {target_resolution} rows")
+    return len(rollups), deleted
+
+def _weighted_mean(bucket, name):
+    samples = bucket[f'samples_{name}']
+    return bucket[f'sum_{name}'] / samples if samples else None
+
+def compact_history(now=None):
+    """Apply the retention policy: roll up each resolution past its retention, drop the coarsest when expired"""
+    retention = history_options()['retention']
+    for resolution in (MarketSnapshotRecord.RAW, MarketSnapshotRecord.MINUTE, MarketSnapshotRecord.HOUR):
+        days = retention.get(resolution)
+        if days is None:
+            continue
+        if resolution in ROLLUPS:
+            downsample(resolution, timedelta(days=days), now)
+        else:
+            cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=days)
+            deleted, _ = MarketSnapshotRecord.objects.filter(resolution=resolution, recorded_at__lt=cutoff).delete()
+            logger.info(f"Deleted {deleted} expired {resolution} rows")
+
+
+def premium_history(start, end, resolution=None):
+    """Snapshot rows between start and end, at the given or the finest resolution still retained for start"""
+    if resolution is None:
+        retention = history_options()['retention']
+        age = datetime.now(timezone.utc) - start
+        resolution = MarketSnapshotRecord.HOUR
+        for candidate in (MarketSnapshotRecord.MINUTE, MarketSnapshotRecord.RAW):
+            days = retention.get(candidate)
+            if days is None or age <= timedelta(days=days):
+                resolution = candidate
+
+    return (
+        MarketSnapshotRecord.objects
+        .filter(resolution=resolution, recorded_at__gte=start, recorded_at__lt=end)
+        .order_by('recorded_at')
+    )
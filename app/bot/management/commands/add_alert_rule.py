@@ -0,0 +1,31 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from bot.models import AlertRule
+
+
+class Command(BaseCommand):
+    help = "Add an alert rule, e.g. add_alert_rule 'Premium 2%' premium_percentage above 2"
+
+    def add_arguments(self, parser):
+        parser.add_argument('name')
+        parser.add_argument('metric', choices=[metric for metric, _ in AlertRule.METRIC_CHOICES])
+        parser.add_argument('operator', choices=[operator for operator, _ in AlertRule.OPERATOR_CHOICES])
+        parser.add_argument('threshold', type=Decimal)
+        parser.add_argument(
+            '--change-window', type=int,
+            help="Compare the metric's change per minute over this many seconds instead of its value",
+        )
+        parser.add_argument('--cooldown', type=int, default=300, help="Seconds to stay quiet after firing")
+
+    def handle(self, *args, **options):
+        rule = AlertRule.objects.create(
+            name=options['name'],
+            metric=options['metric'],
+            operator=options['operator'],
+            threshold=options['threshold'],
+            change_window=options['change_window'],
+            cooldown=options['cooldown'],
+        )
+        self.stdout.write(f"Added alert rule #{rule.id}: {rule}")
@@ -0,0 +1,41 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from bot.backtest import DEFAULT_PARAMETERS, sweep
+
+
+class Command(BaseCommand):
+    help = "Backtest the arbitrage strategy over a snapshot recording, sweeping parameters across processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('recording', help="Recording written by ingest_market_data --snapshot-file")
+        parser.add_argument('--min-spread', type=Decimal, nargs='+', default=[DEFAULT_PARAMETERS['min_spread_percentage']])
+        parser.add_argument('--liquidity-factor', type=Decimal, nargs='+', default=[DEFAULT_PARAMETERS['liquidity_factor']])
+        parser.add_argument('--fee', type=Decimal, nargs='+', default=[DEFAULT_PARAMETERS['fee_percentage']])
+        parser.add_argument('--latency', type=float, nargs='+', default=[DEFAULT_PARAMETERS['latency']],
+                            help="Seconds from signal to execution")
+        parser.add_argument('--cooldown', type=float, default=DEFAULT_PARAMETERS['cooldown'])
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, *args, **options):
+        grid = {
+            'min_spread_percentage': options['min_spread'],
+            'liquidity_factor': options['liquidity_factor'],
+            'fee_percentage': options['fee'],
+            'latency': options['latency'],
+            'cooldown': [options['cooldown']],
+        }
+        results = sweep(options['recording'], grid, options['workers'])
+
+        self.stdout.write(
+            f"{'spread':>7} {'liq':>6} {'fee':>5} {'latency':>8} "
+            f"{'trades':>7} {'missed':>7} {'volume BTC':>12} {'P&L USD':>14} {'speedup':>9}"
+        )
+        for result in sorted(results, key=lambda r: r['pnl_usd'], reverse=True):
+            p = result['parameters']
+            self.stdout.write(
+                f"{p['min_spread_percentage']:>7} {p['liquidity_factor']:>6} "
+                f"{p['fee_percentage']:>5} {p['latency']:>8} {result['trades']:>7} {result['missed_signals']:>7} "
+                f"{result['volume_btc']:>12.8f} {result['pnl_usd']:>14.2f} {result['speedup'] or 0:>8.0f}x"
+            )
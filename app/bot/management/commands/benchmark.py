@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.benchmarks import (
+    DEFAULT_CONCURRENCY, DEFAULT_LEVELS, DEFAULT_TOLERANCE, append_history, compare, load_fixtures,
+    load_history, record_fixtures, run_benchmarks,
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark order book parsing, analysis, snapshot fetches and the market data view against a local stub"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--levels', type=int, nargs='+', default=DEFAULT_LEVELS,
+                            help="Depths of the synthetic order books")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=DEFAULT_CONCURRENCY,
+                            help="Concurrent clients for the view load test")
+        parser.add_argument('--fixtures', help="Also benchmark recorded upstream responses from this file")
+        parser.add_argument('--record-fixtures', metavar='PATH',
+                            help="Record the live upstream responses to PATH and exit")
+        parser.add_argument('--min-time', type=float, default=0.5, help="Seconds to spend timing each benchmark")
+        parser.add_argument('--history', help="JSONL file of past runs; compare against the last one and append")
+        parser.add_argument('--label', help="Label stored with this run in the history, e.g. a commit hash")
+        parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                            help="Fractional slowdown of a median that counts as a regression")
+
+    def handle(self, *args, **options):
+        if options['record_fixtures']:
+            record_fixtures(options['record_fixtures'])
+            self.stdout.write(f"Recorded upstream responses to {options['record_fixtures']}")
+            return
+
+        fixtures = load_fixtures(options['fixtures']) if options['fixtures'] else None
+        results = run_benchmarks(options['levels'], options['concurrency'], fixtures, options['min_time'])
+
+        self.stdout.write(f"{'benchmark':<50} {'median ms':>10} {'p99 ms':>10} {'ops/s':>10} {'peak KiB':>10}")
+        for name, result in results.items():
+            peak = f"{result['peak_bytes'] / 1024:>10.0f}" if 'peak_bytes' in result else f"{'-':>10}"
+            self.stdout.write(
+                f"{name:<50} {result['median'] * 1000:>10.3f} {result['p99'] * 1000:>10.3f} "
+                f"{result['ops_per_second']:>10.0f} {peak}"
+            )
+
+        if not options['history']:
+            return
+
+        history = load_history(options['history'])
+        regressions = compare(results, history[-1]['results'], options['tolerance']) if history else []
+        append_history(options['history'], results, options['label'])
+        if regressions:
+            raise CommandError("Performance regressions:\n" + '\n'.join(regressions))
+        self.stdout.write(f"No regressions beyond {options['tolerance']:.0%}, appended run to {options['history']}")
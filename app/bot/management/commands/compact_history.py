@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bot.history import compact_history
+
+
+class Command(BaseCommand):
+    help = "Roll old snapshot history up into coarser buckets and drop rows past retention (run from cron)"
+
+    def handle(self, *args, **options):
+        compact_history()
+        self.stdout.write("Snapshot history compacted")
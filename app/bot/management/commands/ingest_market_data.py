@@ -0,0 +1,210 @@
+import contextlib
+import dataclasses
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import bot.services as services
+import bot.store as store
+from bot.alerts import AlertEngine, alert_options
+from bot.execution import ExecutionEngine, execution_options, find_opportunity
+from bot.history import SnapshotRecorder
+from bot.recording import RecordingWriter
+from bot.matching import IncrementalMatcher
+from bot.streaming import BybitOrderBookStream, ValrOrderBookStream, start_streams
+
+logger = logging.getLogger(__name__)
+
+# Fields still polled over REST when order books come from the websocket streams
+STREAM_MODE_REST_FIELDS = ['bybit_ticker', 'bybit_volume', 'bybit_turnover', 'valr_ticker', 'valr_volume',
+                           'valr_turnover', 'exchange_rate']
+
+# Seconds between INFO logs of the streamed opportunity; the changes in between go to DEBUG
+OPPORTUNITY_LOG_INTERVAL = 10
+
+
+class Command(BaseCommand):
+    help = "Poll ByBit, Valr and the FX provider on a schedule and publish the latest market snapshot"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Set by the matcher when the live books can trade, to publish without waiting out the interval
+        self.opportunity_ready = threading.Event()
+        self.opportunity_logged_at = float('-inf')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=getattr(settings, 'MARKET_INGEST_INTERVAL', 5),
+            help="Seconds between snapshot fetches",
+        )
+        parser.add_argument('--once', action='store_true', help="Publish a single snapshot and exit")
+        parser.add_argument(
+            '--stream', action='store_true',
+            help="Maintain order books from the exchange websockets instead of polling REST",
+        )
+        parser.add_argument(
+            '--publish-interval', type=float, default=0.25,
+            help="In stream mode, seconds between publishing snapshots with the live books",
+        )
+        parser.add_argument('--record', help="In stream mode, append raw websocket messages to this JSONL file")
+        parser.add_argument('--no-history', action='store_true', help="Don't store snapshots in the history table")
+        parser.add_argument('--no-alerts', action='store_true', help="Don't evaluate the alert rules")
+        parser.add_argument('--snapshot-file', help="Append every published snapshot to this recording for backtests")
+        parser.add_argument(
+            '--execute', action='store_true',
+            help="Place both legs of every qualifying opportunity (also requires settings.EXECUTION['enabled'])",
+        )
+
+    def handle(self, *args, **options):
+        self.recorder = None if options['no_history'] else SnapshotRecorder()
+        self.snapshot_file = RecordingWriter(options['snapshot_file']) if options['snapshot_file'] else None
+        enable_alerts = alert_options()['enabled'] and not options['no_alerts']
+        self.alerts = AlertEngine() if enable_alerts else None
+        self.engine = None
+        if options['execute']:
+            if not execution_options()['enabled']:
+                self.stderr.write("Execution is disabled in settings.EXECUTION, not trading")
+            else:
+                self.engine = ExecutionEngine.from_settings()
+                self.engine.warm()
+        try:
+            if options['stream']:
+                self.stream(options)
+            else:
+                self.poll(options)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping market data ingestion")
+        finally:
+            if self.recorder is not None:
+                self.recorder.flush()
+            if self.snapshot_file is not None:
+                self.snapshot_file.close()
+            if self.engine is not None:
+                self.engine.close()
+            if self.alerts is not None:
+                self.alerts.close()
+
+    def poll(self, options):
+        interval = options['interval']
+        self.stdout.write(f"Ingesting market data every {interval}s")
+
+        while True:
+            started = time.monotonic()
+            self.publish(services.fetch_market_snapshot())
+            if options['once']:
+                break
+            # Keep a fixed cadence regardless of how long the fetch took
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def stream(self, options):
+        if not ValrOrderBookStream().can_connect:
+            self.stderr.write(
+                "Valr's order book websocket needs API credentials in settings.EXECUTION['valr'], polling instead"
+            )
+            return self.poll(options)
+
+        with contextlib.ExitStack() as stack:
+            record_to = stack.enter_context(open(options['record'], 'a', buffering=1)) if options['record'] else None
+            bybit_stream = BybitOrderBookStream(record_to=record_to)
+            valr_stream = ValrOrderBookStream(record_to=record_to)
+
+            # Re-evaluate the opportunity on every delta rather than on every publish
+            matcher = IncrementalMatcher(
+                valr_stream.book, bybit_stream.book, None,
+                min_spread_percentage=services.MIN_SPREAD_PERCENTAGE, on_change=self.opportunity_changed,
+            )
+            valr_stream.add_listener(matcher.on_book_update)
+            bybit_stream.add_listener(matcher.on_book_update)
+
+            start_streams([bybit_stream, valr_stream])
+            self.stdout.write(
+                f"Streaming order books, polling tickers every {options['interval']}s, "
+                f"publishing every {options['publish_interval']}s"
+            )
+
+            rest_snapshot = None
+            rest_fetched_at = 0.0
+            published = (None, None)
+            while True:
+                if rest_snapshot is None or time.monotonic() - rest_fetched_at >= options['interval']:
+                    rest_snapshot = services.fetch_market_snapshot(fields=STREAM_MODE_REST_FIELDS)
+                    rest_fetched_at = time.monotonic()
+                    self.configure_matcher(matcher, rest_snapshot)
+
+                # Only publish when either book has moved since the last publish
+                current = (bybit_stream.book.updated_at, valr_stream.book.updated_at)
+                if current != published:
+                    snapshot = dataclasses.replace(
+                        rest_snapshot,
+                        bybit_orderbook=bybit_stream.book.as_orderbook(currency=bybit_stream.currency),
+                        valr_orderbook=valr_stream.book.as_orderbook(currency=valr_stream.currency),
+                        fetched_at=time.time(),
+                    )
+                    snapshot.missing = [name for name in services.SNAPSHOT_FIELDS if getattr(snapshot, name) is None]
+                    self.publish(snapshot)
+                    published = current
+
+                # Publishing submits to the engine and evaluates alerts, so a tradable
+                # opportunity cuts the wait short rather than sitting out the interval
+                self.opportunity_ready.wait(options['publish_interval'])
+                self.opportunity_ready.clear()
+
+    def configure_matcher(self, matcher, snapshot):
+        parameters = {}
+        if snapshot.exchange_rate:
+            parameters['usd_zar_rate'] = snapshot.exchange_rate
+        if snapshot.bybit_volume is not None and snapshot.valr_volume is not None:
+            parameters['target_volume'] = services.calculate_tradable_btc(snapshot.bybit_volume, snapshot.valr_volume)
+        matcher.configure(**parameters)
+
+    def opportunity_changed(self, opportunity):
+        """Matcher callback on a stream thread: wake the publish loop when the books can trade"""
+        if opportunity['tradable_volume']:
+            self.opportunity_ready.set()
+
+        # Deltas can change the opportunity many times a second
+        now = time.monotonic()
+        level = logging.DEBUG
+        if now - self.opportunity_logged_at >= OPPORTUNITY_LOG_INTERVAL:
+            level = logging.INFO
+            self.opportunity_logged_at = now
+        if not logger.isEnabledFor(level):
+            return
+        if opportunity['average_spread_percentage'] is not None:
+            logger.log(
+                level,
+                f"Opportunity changed: {opportunity['tradable_volume']} BTC tradable "
+                f"at {opportunity['average_spread_percentage']:.2f}% over {opportunity['levels']} fills"
+            )
+        else:
+            logger.log(level, "Opportunity changed: nothing tradable")
+
+    def publish(self, snapshot):
+        signal_at = time.perf_counter()
+        if len(snapshot.missing) == len(services.SNAPSHOT_FIELDS):
+            # Nothing came back - keep serving the previous snapshot until it ages out
+            logger.error("All upstream calls failed, not publishing snapshot")
+            return
+
+        # Trade first: publishing, history and the recording can wait, the books won't
+        if self.engine is not None:
+            analysis = find_opportunity(snapshot)
+            if analysis is not None and self.engine.submit(snapshot, analysis, signal_at) is not None:
+                logger.info(f"Executing {analysis['tradable_volume']} BTC opportunity")
+
+        if snapshot.missing:
+            logger.warning(f"Snapshot missing {', '.join(snapshot.missing)}")
+
+        version = store.publish_snapshot(snapshot)
+        logger.info(f"Published snapshot v{version} in {snapshot.elapsed:.3f}s")
+
+        if self.recorder is not None:
+            self.recorder.record(snapshot)
+        if self.snapshot_file is not None:
+            self.snapshot_file.append(snapshot)
+
+        if self.alerts is not None:
+            self.alerts.evaluate(snapshot)
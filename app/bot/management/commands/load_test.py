@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.benchmarks import DEFAULT_CONCURRENCY, http_target, pipeline_targets, run_load_test, simulating
+
+
+class Command(BaseCommand):
+    help = "Drive load at the market data pipeline and report throughput, errors and tail latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', default=[],
+                            help="Load a running server's endpoint instead of the in-process pipeline (repeatable)")
+        parser.add_argument('--target', action='append',
+                            choices=['fetch_market_snapshot', 'get_market_data', 'simulate_trade'],
+                            help="In-process targets to drive (default: all), against a local simulator")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=DEFAULT_CONCURRENCY)
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to drive each target")
+        parser.add_argument('--rate', type=float,
+                            help="Requests per second to schedule (latency counts from the schedule), "
+                                 "instead of calling back to back")
+        parser.add_argument('--depth', type=int, default=50, help="Simulated book depth")
+        parser.add_argument('--latency', type=float, default=0.0, help="Simulated upstream latency in seconds")
+        parser.add_argument('--jitter', type=float, default=0.0)
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of simulated upstream errors")
+        parser.add_argument('--stall-rate', type=float, default=0.0, help="Fraction of stalled upstream requests")
+
+    def handle(self, *args, **options):
+        if options['url'] and options['target']:
+            raise CommandError("--url and --target are exclusive")
+
+        if options['url']:
+            results = run_load_test(
+                {url: http_target(url) for url in options['url']},
+                options['concurrency'], options['duration'], options['rate'],
+            )
+        else:
+            faults = {name: options[name] for name in ('depth', 'latency', 'jitter', 'error_rate', 'stall_rate')}
+            with simulating(**faults):
+                targets = pipeline_targets()
+                if options['target']:
+                    targets = {name: targets[name] for name in options['target']}
+                results = run_load_test(targets, options['concurrency'], options['duration'], options['rate'])
+
+        self.stdout.write(
+            f"{'target':<50} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p90 ms':>9} "
+            f"{'p99 ms':>9} {'p99.9 ms':>9} {'max ms':>9}  errors"
+        )
+        for name, result in results.items():
+            errors = ', '.join(f'{reason}: {count}' for reason, count in result['errors'].items()) or '-'
+            if not result['rounds']:
+                self.stdout.write(f"{name:<50} {0:>9}  {errors}")
+                continue
+            latencies = ' '.join(
+                f"{result[key] * 1000:>9.1f}" for key in ('median', 'p90', 'p99', 'p999', 'max')
+            )
+            self.stdout.write(f"{name:<50} {result['rounds']:>9} {result['ops_per_second']:>9.0f} {latencies}  {errors}")
@@ -0,0 +1,40 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from bot.mock_exchange import MockExchange
+
+
+class Command(BaseCommand):
+    help = "Serve mock ByBit and Valr order APIs locally for testing trade execution"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--bybit-secret', default='bybit-secret')
+        parser.add_argument('--valr-secret', default='valr-secret')
+        for venue in ('bybit', 'valr'):
+            parser.add_argument(f'--{venue}-fill-ratio', type=Decimal, default=Decimal('1'),
+                                help=f"Fraction of each {venue} order that fills")
+            parser.add_argument(f'--{venue}-reject', action='store_true', help=f"Reject every {venue} order")
+            parser.add_argument(f'--{venue}-latency', type=float, default=0.0,
+                                help=f"Seconds added to every {venue} response")
+
+    def handle(self, *args, **options):
+        behaviour = {
+            venue: {
+                'fill_ratio': options[f'{venue}_fill_ratio'],
+                'reject': options[f'{venue}_reject'],
+                'latency': options[f'{venue}_latency'],
+            }
+            for venue in ('bybit', 'valr')
+        }
+        exchange = MockExchange(
+            options['host'], options['port'],
+            secrets={'bybit': options['bybit_secret'], 'valr': options['valr_secret']}, **behaviour,
+        )
+        self.stdout.write(f"Point settings.EXECUTION base_urls at http://{options['host']}:{options['port']}")
+        try:
+            exchange.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping mock exchange")
@@ -0,0 +1,24 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from bot.replay import ReplayServer, load_recording
+
+
+class Command(BaseCommand):
+    help = "Serve a recorded order book stream on a local websocket, standing in for ByBit and Valr"
+
+    def add_arguments(self, parser):
+        parser.add_argument('recording', help="JSONL file written by ingest_market_data --stream --record")
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier, 0 for no delay")
+
+    def handle(self, *args, **options):
+        recording = load_recording(options['recording'])
+        server = ReplayServer(recording, options['host'], options['port'], options['speed'])
+        self.stdout.write(f"Point settings.ORDERBOOK_STREAMS at ws://{options['host']}:{options['port']}/<venue>")
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping replay server")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from bot.models import TradePnlRollup
+from bot.trades import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = "Refresh the materialized daily and weekly trade P&L rollups (run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=[TradePnlRollup.DAY, TradePnlRollup.WEEK], action='append',
+                            help="Period to refresh (repeatable, default: all)")
+        parser.add_argument('--full', action='store_true', help="Rebuild every period instead of just the newest")
+
+    def handle(self, *args, **options):
+        for period in options['period'] or [TradePnlRollup.DAY, TradePnlRollup.WEEK]:
+            rows = refresh_rollups(period, full=options['full'])
+            self.stdout.write(f"Refreshed {rows} {period} rollups")
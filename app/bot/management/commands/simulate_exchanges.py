@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from bot.simulator import ExchangeSimulator, simulator_options
+
+
+class Command(BaseCommand):
+    help = "Serve simulated ByBit, Valr and FX market data (REST and websockets) and order APIs locally"
+
+    def add_arguments(self, parser):
+        defaults = simulator_options()
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900, help="REST port, for market data and orders")
+        parser.add_argument('--ws-port', type=int, default=8765, help="Websocket port, 0 to serve REST only")
+        parser.add_argument('--bybit-secret', default='bybit-secret')
+        parser.add_argument('--valr-secret', default='valr-secret')
+        parser.add_argument('--depth', type=int, default=defaults['depth'], help="Price levels a side")
+        parser.add_argument('--update-interval', type=float, default=defaults['update_interval'],
+                            help="Seconds between book updates")
+        parser.add_argument('--volatility', type=float, default=defaults['volatility'],
+                            help="Standard deviation of ByBit's log price move per update")
+        parser.add_argument('--premium', type=float, default=defaults['premium'], help="Valr's mean premium")
+        parser.add_argument('--latency', type=float, default=defaults['latency'],
+                            help="Seconds added to every REST response")
+        parser.add_argument('--jitter', type=float, default=defaults['jitter'],
+                            help="Up to this many more seconds, at random")
+        parser.add_argument('--error-rate', type=float, default=defaults['error_rate'],
+                            help="Fraction of market data requests answered with an error")
+        parser.add_argument('--stall-rate', type=float, default=defaults['stall_rate'],
+                            help="Fraction of REST requests held past the clients' timeouts")
+        parser.add_argument('--gap-rate', type=float, default=defaults['gap_rate'],
+                            help="Fraction of websocket deltas dropped")
+        parser.add_argument('--disconnect-rate', type=float, default=defaults['disconnect_rate'],
+                            help="Chance per update of dropping each websocket subscriber")
+        parser.add_argument('--seed', type=int, default=defaults['seed'])
+
+    def handle(self, *args, **options):
+        simulator = ExchangeSimulator(
+            options['host'], options['port'], options['ws_port'] or None,
+            secrets={'bybit': options['bybit_secret'], 'valr': options['valr_secret']},
+            **{name: options[name] for name in (
+                'depth', 'update_interval', 'volatility', 'premium', 'latency', 'jitter',
+                'error_rate', 'stall_rate', 'gap_rate', 'disconnect_rate', 'seed',
+            )},
+        )
+        url = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(f"Point settings.UPSTREAM_BASE_URLS (and EXECUTION base_urls) at {url}")
+        if options['ws_port']:
+            self.stdout.write(f"Point settings.ORDERBOOK_STREAMS at ws://{options['host']}:{options['ws_port']}/<venue>")
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping simulator")
+            simulator.stop()
@@ -0,0 +1,261 @@
+import bisect
+import threading
+from decimal import Decimal
+from itertools import accumulate
+
+from bot.orderbook import QTY_SCALE, np
+
+# Use the NumPy merge once both books are at least this deep (if NumPy is installed)
+VECTORIZE_MIN_LEVELS = 2000
+
+
+def walk_books(asks, bids, target_volume=None, min_spread_percentage=Decimal('1')):
+    """Match asks we buy against bids we sell into by cumulative volume.
+
+    ``asks`` and ``bids`` are BookSides priced in the same currency. Leftover
+    quantity on the deeper level carries over to the next level on the other
+    side, and the walk stops at the first fill whose marginal spread is below
+    ``min_spread_percentage`` or once ``target_volume`` BTC is matched.
+    Returns fills as (ask_index, bid_index, satoshis) tuples.
+    """
+    remaining = int(target_volume * QTY_SCALE) if target_volume is not None else None
+    if remaining is not None and remaining <= 0:
+        return []
+
+    if np is not None and min(len(asks), len(bids)) >= VECTORIZE_MIN_LEVELS:
+        return _walk_books_numpy(asks, bids, remaining, min_spread_percentage)
+
+    fills = []
+    i = j = 0
+    ask_left = bid_left = 0
+    while i < len(asks) and j < len(bids):
+        if not ask_left:
+            ask_left = asks.quantities[i]
+            ask_price = asks.price(i)
+        if not bid_left:
+            bid_left = bids.quantities[j]
+            bid_price = bids.price(j)
+
+        if ask_left and bid_left:
+            if spread_percentage(ask_price, bid_price) < min_spread_percentage:
+                break
+
+            quantity = min(ask_left, bid_left) if remaining is None else min(ask_left, bid_left, remaining)
+            fills.append((i, j, quantity))
+            ask_left -= quantity
+            bid_left -= quantity
+            if remaining is not None:
+                remaining -= quantity
+                if not remaining:
+                    break
+
+        # Advance whichever side is used up (empty levels are skipped the same way)
+        if not ask_left:
+            i += 1
+        if not bid_left:
+            j += 1
+
+    return fills
+
+
+def _walk_books_numpy(asks, bids, remaining, min_spread_percentage):
+    """Vectorized walk_books: merge both cumulative-depth curves in one pass"""
+    ask_prices, _ = asks.to_numpy()
+    bid_prices, _ = bids.to_numpy()
+    ask_depth = np.asarray(asks.cumulative, dtype=np.int64)
+    bid_depth = np.asarray(bids.cumulative, dtype=np.int64)
+
+    total = min(ask_depth[-1], bid_depth[-1])
+    if remaining is not None:
+        total = min(total, remaining)
+    if total <= 0:
+        return []
+
+    # Every point where either side moves to its next level ends a fill segment
+    ends = np.union1d(ask_depth, bid_depth)
+    ends = np.append(ends[ends < total], total)
+    starts = np.concatenate(([0], ends[:-1]))
+    ask_index = np.searchsorted(ask_depth, ends, side='left')
+    bid_index = np.searchsorted(bid_depth, ends, side='left')
+
+    spreads = (bid_prices[bid_index] - ask_prices[ask_index]) / ask_prices[ask_index] * 100
+    profitable = spreads >= float(min_spread_percentage)
+    cut = len(profitable) if profitable.all() else int(np.argmin(profitable))
+
+    return list(zip(ask_index[:cut].tolist(), bid_index[:cut].tolist(), (ends - starts)[:cut].tolist()))
+
+
+def fill_curve(side, amounts, quote=False):
+    """Fill every order size in ``amounts`` by walking one BookSide from the best level.
+
+    Sizes are BTC, or with ``quote=True`` an amount of the side's currency to
+    spend. The book is summed into cumulative depth and notional curves once
+    and each size is located on one with a binary search. Returns
+    ``(base, notional)`` lists of Decimals: BTC filled and the currency it cost
+    or raised. A size the book can fill comes back exactly; sizes beyond the
+    book fill only its full depth.
+    """
+    prices = [side.price(i) for i in range(len(side))]
+    quantities = [side.quantity(i) for i in range(len(side))]
+    depth = list(accumulate(quantities))
+    notional = list(accumulate(price * quantity for price, quantity in zip(prices, quantities)))
+    curve = notional if quote else depth
+
+    base, cost = [], []
+    for amount in amounts:
+        amount = Decimal(str(amount))
+        index = bisect.bisect_left(curve, amount)
+        if index == len(curve):
+            base.append(depth[-1] if depth else Decimal('0'))
+            cost.append(notional[-1] if notional else Decimal('0'))
+            continue
+        depth_before = depth[index - 1] if index else Decimal('0')
+        notional_before = notional[index - 1] if index else Decimal('0')
+        if quote:
+            base.append(depth_before + (amount - notional_before) / prices[index])
+            cost.append(amount)
+        else:
+            base.append(amount)
+            cost.append(notional_before + (amount - depth_before) * prices[index])
+    return base, cost
+
+
+def spread_percentage(buy_price, sell_price):
+    """Spread of selling at sell_price over buying at buy_price, as a percentage of the buy price"""
+    return (sell_price - buy_price) / buy_price * 100
+
+
+class IncrementalMatcher:
+    """Keeps the walk_books result for two live L2Books up to date as deltas arrive.
+
+    Buys the ``ask_book`` asks (priced in ZAR, converted at ``usd_zar_rate``) and
+    sells into the ``bid_book`` bids. The walk state before every fill is kept,
+    so a delta only re-walks from the first fill at or beyond the best changed
+    level; deltas deeper than where the walk stopped cost a bisect per price.
+    ``on_change(opportunity)`` runs whenever the tradable volume or spread moves.
+    """
+
+    def __init__(self, ask_book, bid_book, usd_zar_rate, target_volume=None,
+                 min_spread_percentage=Decimal('1'), on_change=None):
+        self.ask_book = ask_book
+        self.bid_book = bid_book
+        self.usd_zar_rate = usd_zar_rate
+        self.target_volume = target_volume
+        self.min_spread_percentage = min_spread_percentage
+        self.on_change = on_change
+        # fills[k] = (ask_rank, bid_rank, satoshis, ask_price, bid_price, cum_satoshis, cum_cost, cum_proceeds)
+        self.fills = []
+        # states[k] = (ask_rank, bid_rank, ask_left, bid_left, remaining, ask_price, bid_price) before fills[k];
+        # the extra last entry is where the walk stopped
+        self.states = []
+        self.opportunity = None
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def configure(self, **parameters):
+        """Thread-safe way to change usd_zar_rate / target_volume; applied on the next book update"""
+        with self._pending_lock:
+            self._pending.update(parameters)
+
+    def set_rate(self, usd_zar_rate):
+        if usd_zar_rate != self.usd_zar_rate:
+            self.usd_zar_rate = usd_zar_rate
+            self.recompute()
+
+    def set_target_volume(self, target_volume):
+        if target_volume != self.target_volume:
+            self.target_volume = target_volume
+            self.recompute()
+
+    def recompute(self):
+        """Walk both books from the top"""
+        remaining = int(self.target_volume * QTY_SCALE) if self.target_volume is not None else None
+        self._walk(0, 0, 0, 0, 0, remaining, None, None)
+
+    def on_book_update(self, book):
+        """Stream listener: re-walk only what the book's last delta can have changed"""
+        if self._pending:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            if 'usd_zar_rate' in pending:
+                self.set_rate(pending['usd_zar_rate'])
+            if 'target_volume' in pending:
+                self.set_target_volume(pending['target_volume'])
+
+        if book.last_changes is None or not self.states:
+            self.recompute()
+            return
+
+        if book is self.ask_book:
+            self.update(ask_rank=min((book.rank('asks', p) for p in book.last_changes['asks']), default=None))
+        if book is self.bid_book:
+            self.update(bid_rank=min((book.rank('bids', p) for p in book.last_changes['bids']), default=None))
+
+    def update(self, ask_rank=None, bid_rank=None):
+        """Re-walk from the first fill touching a changed ask or bid rank, if any"""
+        if ask_rank is None and bid_rank is None:
+            return
+
+        for k, (i, j, ask_left, bid_left, remaining, ask_price, bid_price) in enumerate(self.states):
+            ask_changed = ask_rank is not None and i >= ask_rank
+            bid_changed = bid_rank is not None and j >= bid_rank
+            if ask_changed or bid_changed:
+                # The walk moves one level at a time, so a changed side is exactly at
+                # the changed rank here and has to be reloaded from the book
+                self._walk(k, i, j, 0 if ask_changed else ask_left, 0 if bid_changed else bid_left,
+                           remaining, ask_price, bid_price)
+                return
+
+    def _walk(self, k, i, j, ask_left, bid_left, remaining, ask_price, bid_price):
+        del self.fills[k:]
+        del self.states[k:]
+        fills, states = self.fills, self.states
+        cum_satoshis, cum_cost, cum_proceeds = fills[-1][5:] if fills else (0, Decimal('0'), Decimal('0'))
+
+        if self.usd_zar_rate and self.ask_book.synced and self.bid_book.synced:
+            ask_levels = self.ask_book.size('asks')
+            bid_levels = self.bid_book.size('bids')
+            while i < ask_levels and j < bid_levels and remaining != 0:
+                if not ask_left:
+                    price, quantity = self.ask_book.level('asks', i)
+                    ask_price, ask_left = price / self.usd_zar_rate, int(quantity * QTY_SCALE)
+                if not bid_left:
+                    bid_price, quantity = self.bid_book.level('bids', j)
+                    bid_left = int(quantity * QTY_SCALE)
+
+                states.append((i, j, ask_left, bid_left, remaining, ask_price, bid_price))
+                if spread_percentage(ask_price, bid_price) < self.min_spread_percentage:
+                    break
+
+                quantity = min(ask_left, bid_left) if remaining is None else min(ask_left, bid_left, remaining)
+                cum_satoshis += quantity
+                cum_cost += ask_price * quantity
+                cum_proceeds += bid_price * quantity
+                fills.append((i, j, quantity, ask_price, bid_price, cum_satoshis, cum_cost, cum_proceeds))
+
+                ask_left -= quantity
+                bid_left -= quantity
+                if remaining is not None:
+                    remaining -= quantity
+                if not ask_left:
+                    i += 1
+                if not bid_left:
+                    j += 1
+            else:
+                states.append((i, j, ask_left, bid_left, remaining, ask_price, bid_price))
+
+        self._emit()
+
+    def _emit(self):
+        opportunity = {'tradable_volume': Decimal('0'), 'average_spread_percentage': None, 'levels': len(self.fills)}
+        if self.fills:
+            cum_satoshis, cum_cost, cum_proceeds = self.fills[-1][5:]
+            opportunity['tradable_volume'] = Decimal(cum_satoshis) / QTY_SCALE
+            opportunity['average_spread_percentage'] = spread_percentage(cum_cost, cum_proceeds)
+
+        changed = self.opportunity is None or any(
+            opportunity[key] != self.opportunity[key] for key in ('tradable_volume', 'average_spread_percentage')
+        )
+        self.opportunity = opportunity
+        if changed and self.on_change is not None:
+            self.on_change(opportunity)
@@ -0,0 +1,232 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Prefix of every exported metric name
+NAMESPACE = 'flashpoint'
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+QUANTILES = (0.5, 0.99)
+
+# Timings of the current request, for the Server-Timing header (None outside a request)
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram; observing is a bisect and two additions under a lock"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket, as histogram_quantile does"""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class Registry:
+    """Process-wide counters and histograms, keyed by metric name and label values"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        histogram.observe(value)
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)"""
+        lines = []
+        for name, series in _group(self.counters).items():
+            lines.extend(self._header(name, 'counter'))
+            lines.extend(f'{name}{_labels(labels)} {value}' for labels, value in series)
+
+        for name, series in _group(self.histograms).items():
+            lines.extend(self._header(name, 'histogram'))
+            for labels, histogram in series:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+            # Precomputed quantiles for dashboards without histogram_quantile
+            lines.extend(self._header(f'{name}_quantile', 'gauge'))
+            for labels, histogram in series:
+                for q in QUANTILES:
+                    value = histogram.quantile(q)
+                    if value is not None:
+                        lines.append(f'{name}_quantile{_labels(labels + (("quantile", q),))} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, name, kind):
+        if name in self.help:
+            yield f'# HELP {name} {self.help[name]}'
+        yield f'# TYPE {name} {kind}'
+
+
+def _group(metrics):
+    grouped = {}
+    for (name, labels), value in sorted(metrics.items(), key=lambda item: item[0]):
+        grouped.setdefault(name, []).append((labels, value))
+    return grouped
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+registry = Registry()
+registry.describe(f'{NAMESPACE}_upstream_request_seconds', 'Latency of each upstream HTTP attempt')
+registry.describe(f'{NAMESPACE}_upstream_response_bytes', 'Size of upstream response bodies')
+registry.describe(f'{NAMESPACE}_upstream_errors_total', 'Failed upstream HTTP attempts')
+registry.describe(f'{NAMESPACE}_fetch_errors_total', 'Fetchers that gave up and returned None')
+registry.describe(f'{NAMESPACE}_timing_seconds', 'Latency of instrumented hot-path sections')
+
+
+def increment(name, amount=1, **labels):
+    registry.increment(f'{NAMESPACE}_{name}', amount, **labels)
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    registry.observe(f'{NAMESPACE}_{name}', value, buckets, **labels)
+
+@contextmanager
+def timer(section, **labels):
+    """Time a block into the timing histogram and the current request's Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe(f'{NAMESPACE}_timing_seconds', elapsed, section=section, **labels)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((section, elapsed))
+
+def timed(section):
+    """Decorator form of timer()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(section):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def render():
+    """Every metric, plus reference cache counters, in Prometheus text format"""
+    from bot.cache import cache_stats
+
+    lines = [registry.render()]
+    stats = cache_stats()
+    if stats:
+        lines.append(f'# TYPE {NAMESPACE}_cache_lookups_total counter')
+        for name, counters in stats.items():
+            for counter in ('hits', 'shared_hits', 'stale_hits', 'misses', 'refreshes', 'errors'):
+                lines.append(f'{NAMESPACE}_cache_lookups_total{{cache="{name}",result="{counter}"}} {counters[counter]}')
+        lines.append(f'# TYPE {NAMESPACE}_cache_hit_ratio gauge')
+        for name, counters in stats.items():
+            if counters['hit_rate'] is not None:
+                lines.append(f'{NAMESPACE}_cache_hit_ratio{{cache="{name}"}} {counters["hit_rate"]}')
+        lines.append('')
+    return '\n'.join(lines)
+
+
+class ServerTimingMiddleware:
+    """Adds a Server-Timing header listing the timer() sections run while handling the request.
+
+    Off unless settings.METRICS['server_timing'] is set, as the header is visible to every client.
+    """
+    sync_capable = True
+    async_capable = True  # keeps async views on the event loop under ASGI
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'METRICS', {}).get('server_timing', False)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        timings = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self._add_header(response, timings, started)
+
+    async def _acall(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        timings = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self._add_header(response, timings, started)
+
+    def _add_header(self, response, timings, started):
+        timings.append(('total', time.perf_counter() - started))
+        response['Server-Timing'] = ', '.join(f'{name};dur={elapsed * 1000:.2f}' for name, elapsed in timings)
+        return response
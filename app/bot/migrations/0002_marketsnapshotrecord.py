@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarketSnapshotRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField()),
+                ('resolution', models.CharField(choices=[('raw', 'Raw'), ('1m', '1 minute'), ('1h', '1 hour')], default='raw', max_length=3)),
+                ('samples', models.PositiveIntegerField(default=1)),
+                ('bybit_price_usd', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('valr_price_zar', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('usd_zar_rate', models.DecimalField(decimal_places=4, max_digits=10, null=True)),
+                ('premium_percentage', models.DecimalField(decimal_places=4, max_digits=10, null=True)),
+                ('tradable_btc', models.DecimalField(decimal_places=8, max_digits=20, null=True)),
+                ('bybit_bid_usd', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('bybit_ask_usd', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('valr_bid_zar', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('valr_ask_zar', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+            ],
+            options={
+                'ordering': ['-recorded_at'],
+                'indexes': [models.Index(fields=['resolution', 'recorded_at'], name='snapshot_resolution_time_idx')],
+            },
+        ),
+    ]
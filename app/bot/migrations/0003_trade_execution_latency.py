@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0002_marketsnapshotrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trade',
+            name='signal_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='bybit_ack_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='valr_ack_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_trade_execution_latency'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='trade',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['-created_at', '-id'], name='trade_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='trade_status_created_idx'),
+        ),
+        migrations.CreateModel(
+            name='TradePnlRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week')], max_length=4)),
+                ('period_start', models.DateTimeField()),
+                ('trades', models.PositiveIntegerField(default=0)),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('btc_volume', models.DecimalField(decimal_places=8, default=0, max_digits=24)),
+                ('investment_zar', models.DecimalField(decimal_places=2, default=0, max_digits=24)),
+                ('profit_zar', models.DecimalField(decimal_places=2, default=0, max_digits=24)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['period', 'period_start'],
+                'constraints': [models.UniqueConstraint(fields=('period', 'period_start'), name='trade_rollup_period_unique')],
+            },
+        ),
+    ]
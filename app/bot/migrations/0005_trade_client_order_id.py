@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0004_trade_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trade',
+            name='client_order_id',
+            field=models.CharField(blank=True, max_length=32, null=True, unique=True),
+        ),
+    ]
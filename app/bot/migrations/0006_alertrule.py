@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_trade_client_order_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('metric', models.CharField(choices=[('premium_percentage', 'Live Gross Premium (%)'), ('tradable_btc', 'Tradable BTC'), ('spread_percentage', 'Top of book spread (%)')], max_length=32)),
+                ('operator', models.CharField(choices=[('above', 'At or above'), ('below', 'At or below')], default='above', max_length=5)),
+                ('threshold', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('change_window', models.PositiveIntegerField(blank=True, null=True)),
+                ('cooldown', models.PositiveIntegerField(default=300)),
+                ('enabled', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['metric', 'threshold'],
+                'indexes': [models.Index(fields=['enabled', 'metric'], name='alert_rule_enabled_idx')],
+            },
+        ),
+    ]
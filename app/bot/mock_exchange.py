@@ -0,0 +1,198 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import uuid
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Behaviour of each venue, overridable per MockExchange
+DEFAULT_VENUE_BEHAVIOUR = {
+    'bybit': {'price': Decimal('60000'), 'fill_ratio': Decimal('1'), 'reject': False, 'latency': 0.0},
+    'valr': {'price': Decimal('1080000'), 'fill_ratio': Decimal('1'), 'reject': False, 'latency': 0.0},
+}
+
+
+class MockExchange:
+    """In-process stand-in for the ByBit v5 and Valr order APIs, for testing execution end to end.
+
+    Both venues are served from one port (ByBit paths start /v5, Valr paths /v1),
+    signatures are checked against the configured secrets, and market orders fill
+    immediately at a fixed price, up to ``fill_ratio`` of the requested quantity.
+    Point settings.EXECUTION's base_urls at ``http://host:port``.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8900, secrets=None, **behaviour):
+        self.host = host
+        self.port = port
+        self.secrets = secrets or {'bybit': 'bybit-secret', 'valr': 'valr-secret'}
+        self.behaviour = {
+            venue: {**defaults, **behaviour.get(venue, {})} for venue, defaults in DEFAULT_VENUE_BEHAVIOUR.items()
+        }
+        self.orders = {}
+        self._lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        """Serve in a daemon thread, returning the bound (host, port)"""
+        self.server = self._make_server()
+        threading.Thread(target=self.server.serve_forever, name='mock-exchange', daemon=True).start()
+        return self.server.server_address
+
+    def serve_forever(self):
+        self.server = self._make_server()
+        self.server.serve_forever()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def venue(self, path):
+        """The venue a request path belongs to"""
+        return 'bybit' if path.startswith('/v5/') else 'valr'
+
+    def delay(self, venue):
+        """Hold a response for the venue's latency"""
+        time.sleep(self.behaviour[venue]['latency'])
+
+    def public(self, venue, verb, url):
+        """(status, payload) for an unsigned public endpoint, or None to handle the request as an order API call"""
+        if url.path in ('/v5/market/time', '/v1/public/time'):
+            return 200, {'time': int(time.time() * 1000)}
+        return None
+
+    def fill_price(self, venue, side, quantity):
+        return self.behaviour[venue]['price']
+
+    def place(self, venue, side, quantity, client_order_id):
+        filled = quantity * self.behaviour[venue]['fill_ratio']
+        price = self.fill_price(venue, side, filled)
+        order = {
+            'id': uuid.uuid4().hex,
+            'venue': venue,
+            'side': side,
+            'quantity': quantity,
+            'filled': filled,
+            'price': price,
+            'client_order_id': client_order_id,
+            'created_at': time.time(),
+        }
+        with self._lock:
+            self.orders[order['id']] = order
+        logger.info(f"{venue} {side} {quantity} filled {filled} at {price}")
+        return order
+
+    def _make_server(self):
+        server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        server.daemon_threads = True
+        return server
+
+    def _handler_class(self):
+        exchange = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real venues
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def _dispatch(self, verb):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+                venue = exchange.venue(url.path)
+                exchange.delay(venue)
+
+                response = exchange.public(venue, verb, url)
+                if response is not None:
+                    return self._reply(*response)
+                if venue == 'bybit':
+                    return self._bybit(verb, url, body)
+                return self._valr(verb, url, body)
+
+            def _bybit(self, verb, url, body):
+                timestamp = self.headers.get('X-BAPI-TIMESTAMP', '')
+                payload = timestamp + self.headers.get('X-BAPI-API-KEY', '') + self.headers.get('X-BAPI-RECV-WINDOW', '')
+                payload += body if verb == 'POST' else url.query
+                if not self._valid('bybit', payload, hashlib.sha256, self.headers.get('X-BAPI-SIGN')):
+                    return self._reply(200, {'retCode': 10004, 'retMsg': 'error sign!', 'result': {}})
+
+                if verb == 'POST' and url.path == '/v5/order/create':
+                    if exchange.behaviour['bybit']['reject']:
+                        return self._reply(200, {'retCode': 170131, 'retMsg': 'Insufficient balance.', 'result': {}})
+                    request = json.loads(body)
+                    order = exchange.place('bybit', request['side'].lower(), Decimal(request['qty']), request['orderLinkId'])
+                    return self._reply(200, {
+                        'retCode': 0, 'retMsg': 'OK',
+                        'result': {'orderId': order['id'], 'orderLinkId': order['client_order_id']},
+                    })
+
+                if verb == 'GET' and url.path == '/v5/order/realtime':
+                    order = exchange.orders.get(parse_qs(url.query).get('orderId', [''])[0])
+                    rows = [] if order is None else [{
+                        'orderId': order['id'],
+                        'orderLinkId': order['client_order_id'],
+                        'orderStatus': 'Filled' if order['filled'] == order['quantity'] else 'PartiallyFilledCanceled',
+                        'qty': str(order['quantity']),
+                        'cumExecQty': str(order['filled']),
+                        'avgPrice': str(order['price']) if order['filled'] else '',
+                    }]
+                    return self._reply(200, {'retCode': 0, 'retMsg': 'OK', 'result': {'list': rows}})
+
+                self._reply(404, {'retCode': 10001, 'retMsg': 'unknown endpoint', 'result': {}})
+
+            def _valr(self, verb, url, body):
+                payload = self.headers.get('X-VALR-TIMESTAMP', '') + verb + url.path + body
+                if not self._valid('valr', payload, hashlib.sha512, self.headers.get('X-VALR-SIGNATURE')):
+                    return self._reply(401, {'code': -11252, 'message': 'Request has an invalid signature'})
+
+                if verb == 'POST' and url.path == '/v1/orders/market':
+                    if exchange.behaviour['valr']['reject']:
+                        return self._reply(400, {'code': -6, 'message': 'Insufficient Balance'})
+                    request = json.loads(body)
+                    order = exchange.place('valr', request['side'].lower(), Decimal(request['baseAmount']),
+                                           request.get('customerOrderId'))
+                    return self._reply(202, {'id': order['id']})
+
+                prefix = '/v1/orders/history/summary/orderid/'
+                if verb == 'GET' and url.path.startswith(prefix):
+                    order = exchange.orders.get(url.path[len(prefix):])
+                    if order is None:
+                        return self._reply(404, {'code': -1, 'message': 'Order not found'})
+                    return self._reply(200, {
+                        'orderId': order['id'],
+                        'customerOrderId': order['client_order_id'],
+                        'orderStatusType': 'Filled' if order['filled'] == order['quantity'] else 'Cancelled',
+                        'currencyPair': 'BTCZAR',
+                        'orderSide': order['side'],
+                        'originalQuantity': str(order['quantity']),
+                        'remainingQuantity': str(order['quantity'] - order['filled']),
+                        'averagePrice': str(order['price']) if order['filled'] else '0',
+                    })
+
+                self._reply(404, {'code': -1, 'message': 'unknown endpoint'})
+
+            def _valid(self, venue, payload, digest, signature):
+                expected = hmac.new(exchange.secrets[venue].encode(), payload.encode(), digest).hexdigest()
+                return signature is not None and hmac.compare_digest(expected, signature)
+
+            def _reply(self, status, data):
+                body = data if isinstance(data, bytes) else json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
@@ -28,12 +28,25 @@ class Trade(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
     
     # Additional details for debugging/audit
+    # Shared prefix of both legs' client order ids; also keys write-behind updates (bot.persistence)
+    client_order_id = models.CharField(max_length=32, unique=True, blank=True, null=True)
     bybit_transaction_id = models.CharField(max_length=100, blank=True, null=True)
     valr_transaction_id = models.CharField(max_length=100, blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
 
+    # Execution latency: when the opportunity was signalled, and milliseconds from
+    # that signal to each exchange acknowledging its leg
+    signal_at = models.DateTimeField(blank=True, null=True)
+    bybit_ack_ms = models.FloatField(blank=True, null=True)
+    valr_ack_ms = models.FloatField(blank=True, null=True)
+
     class Meta:
-        ordering = ['-created_at']
+        # id breaks ties between trades created in the same instant, so pages are stable
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='trade_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='trade_status_created_idx'),
+        ]
     
     def __str__(self):
         return f"Trade #{self.id} - {self.btc_volume} BTC - {self.status}"
@@ -55,4 +68,115 @@ class TradeLevel(models.Model):
     spread_percentage = models.DecimalField(max_digits=10, decimal_places=2)
     
     def __str__(self):
-        return f"Level for Trade #{self.trade.id} - {self.btc_volume} BTC at {self.spread_percentage}% spread"
\ No newline at end of file
+        return f"Level for Trade #{self.trade_id} - {self.btc_volume} BTC at {self.spread_percentage}% spread"
+
+class MarketSnapshotRecord(models.Model):
+    """Model to store market snapshot history (LGP and top of book), downsampled as it ages"""
+    RAW = 'raw'
+    MINUTE = '1m'
+    HOUR = '1h'
+
+    RESOLUTION_CHOICES = [
+        (RAW, 'Raw'),
+        (MINUTE, '1 minute'),
+        (HOUR, '1 hour'),
+    ]
+
+    # Start of the bucket for downsampled rows
+    recorded_at = models.DateTimeField()
+    resolution = models.CharField(max_length=3, choices=RESOLUTION_CHOICES, default=RAW)
+    # Number of raw snapshots a downsampled row averages
+    samples = models.PositiveIntegerField(default=1)
+
+    bybit_price_usd = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+    valr_price_zar = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+    usd_zar_rate = models.DecimalField(max_digits=10, decimal_places=4, null=True)
+    premium_percentage = models.DecimalField(max_digits=10, decimal_places=4, null=True)
+    tradable_btc = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+
+    # Top of book on both venues
+    bybit_bid_usd = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+    bybit_ask_usd = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+    valr_bid_zar = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+    valr_ask_zar = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+
+    class Meta:
+        ordering = ['-recorded_at']
+        indexes = [
+            models.Index(fields=['resolution', 'recorded_at'], name='snapshot_resolution_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"Snapshot {self.recorded_at:%Y-%m-%d %H:%M:%S} ({self.resolution}) - {self.premium_percentage}% premium"
+
+
+class TradePnlRollup(models.Model):
+    """Materialized daily or weekly P&L of completed trades (see bot.trades.refresh_rollups)"""
+    DAY = 'day'
+    WEEK = 'week'
+
+    PERIOD_CHOICES = [
+        (DAY, 'Day'),
+        (WEEK, 'Week'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateTimeField()
+    trades = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    btc_volume = models.DecimalField(max_digits=24, decimal_places=8, default=0)
+    investment_zar = models.DecimalField(max_digits=24, decimal_places=2, default=0)
+    profit_zar = models.DecimalField(max_digits=24, decimal_places=2, default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['period', 'period_start']
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start'], name='trade_rollup_period_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} from {self.period_start:%Y-%m-%d} - {self.trades} trades, {self.profit_zar} ZAR"
+
+
+class AlertRule(models.Model):
+    """User-defined alert on a snapshot metric, evaluated on every published snapshot (see bot.alerts)"""
+    PREMIUM = 'premium_percentage'
+    TRADABLE_BTC = 'tradable_btc'
+    SPREAD = 'spread_percentage'
+
+    METRIC_CHOICES = [
+        (PREMIUM, 'Live Gross Premium (%)'),
+        (TRADABLE_BTC, 'Tradable BTC'),
+        (SPREAD, 'Top of book spread (%)'),
+    ]
+
+    ABOVE = 'above'
+    BELOW = 'below'
+
+    OPERATOR_CHOICES = [
+        (ABOVE, 'At or above'),
+        (BELOW, 'At or below'),
+    ]
+
+    name = models.CharField(max_length=100)
+    metric = models.CharField(max_length=32, choices=METRIC_CHOICES)
+    operator = models.CharField(max_length=5, choices=OPERATOR_CHOICES, default=ABOVE)
+    threshold = models.DecimalField(max_digits=20, decimal_places=8)
+    # When set, the rule compares the metric's change per minute over this many seconds
+    change_window = models.PositiveIntegerField(blank=True, null=True)
+    # Seconds after firing during which the rule stays quiet
+    cooldown = models.PositiveIntegerField(default=300)
+    enabled = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['metric', 'threshold']
+        indexes = [
+            models.Index(fields=['enabled', 'metric'], name='alert_rule_enabled_idx'),
+        ]
+
+    def __str__(self):
+        change = f" per minute over {self.change_window}s" if self.change_window else ''
+        return f"{self.name}: {self.metric}{change} {self.operator} {self.threshold}"
@@ -0,0 +1,136 @@
+from array import array
+from decimal import Decimal
+from itertools import accumulate
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only used for vectorized analysis
+    np = None
+
+# Fixed-point scales: prices in 1e-8 ticks, quantities in satoshis
+PRICE_PLACES = 8
+QTY_PLACES = 8
+PRICE_SCALE = Decimal(10 ** PRICE_PLACES)
+QTY_SCALE = Decimal(10 ** QTY_PLACES)
+
+
+def parse_fixed(value, places):
+    """Parse a decimal string (or number) into an integer scaled by 10**places, truncating extra digits"""
+    if not isinstance(value, str):
+        value = format(Decimal(str(value)), 'f')
+    whole, _, fraction = value.partition('.')
+    return int((whole or '0') + fraction[:places].ljust(places, '0'))
+
+
+class BookSide:
+    """One side of an order book, best level first, as parallel int64 arrays.
+
+    Slicing returns a new BookSide over memoryviews of the same buffers, so
+    taking the top n levels copies nothing. Indexing and iteration yield
+    ``(price, quantity)`` Decimal tuples, the same shape as the REST fetchers
+    used to return, with prices divided by ``rate`` when the side is a
+    converted view.
+    """
+    __slots__ = ('prices', 'quantities', 'rate', '_cumulative')
+
+    def __init__(self, prices, quantities, rate=None, cumulative=None):
+        self.prices = prices
+        self.quantities = quantities
+        self.rate = rate
+        self._cumulative = cumulative
+
+    @classmethod
+    def from_levels(cls, levels):
+        """Build from an iterable of (price, quantity) pairs of strings, numbers or Decimals"""
+        prices = array('q')
+        quantities = array('q')
+        for price, quantity in levels:
+            prices.append(parse_fixed(price, PRICE_PLACES))
+            quantities.append(parse_fixed(quantity, QTY_PLACES))
+        return cls(prices, quantities)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            cumulative = self._cumulative[index] if self._cumulative is not None and index.start in (None, 0) else None
+            return BookSide(memoryview(self.prices)[index], memoryview(self.quantities)[index], self.rate, cumulative)
+        return self.price(index), self.quantity(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.price(i), self.quantity(i)
+
+    def __getstate__(self):
+        # memoryviews can't be pickled, so snapshots store plain arrays
+        cumulative = array('q', self._cumulative) if self._cumulative is not None else None
+        return array('q', self.prices), array('q', self.quantities), self.rate, cumulative
+
+    def __setstate__(self, state):
+        self.prices, self.quantities, self.rate, self._cumulative = state
+
+    def price(self, index):
+        price = Decimal(self.prices[index]) / PRICE_SCALE
+        return price / self.rate if self.rate is not None else price
+
+    def quantity(self, index):
+        return Decimal(self.quantities[index]) / QTY_SCALE
+
+    @property
+    def cumulative(self):
+        """Prefix sums of quantity in satoshis: cumulative[i] is the depth of levels 0..i inclusive"""
+        if self._cumulative is None:
+            self._cumulative = array('q', accumulate(self.quantities))
+        return self._cumulative
+
+    def depth(self, levels=None):
+        """Total quantity of the best n levels (all levels by default) as a Decimal"""
+        n = len(self) if levels is None else min(levels, len(self))
+        return Decimal(self.cumulative[n - 1]) / QTY_SCALE if n else Decimal('0')
+
+    def converted(self, rate):
+        """View of this side with prices divided by rate; the arrays are shared, not copied"""
+        rate = Decimal(str(rate))
+        return BookSide(self.prices, self.quantities, rate if self.rate is None else self.rate * rate, self._cumulative)
+
+    def to_numpy(self):
+        """(prices, quantities) as float64 arrays in real units, for vectorized analysis"""
+        if np is None:
+            raise ImportError("numpy is required for vectorized order book analysis")
+        prices = np.frombuffer(self.prices, dtype=np.int64) / 10 ** PRICE_PLACES
+        if self.rate is not None:
+            prices = prices / float(self.rate)
+        quantities = np.frombuffer(self.quantities, dtype=np.int64) / 10 ** QTY_PLACES
+        return prices, quantities
+
+
+class OrderBook:
+    """Compact two-sided order book; supports book['bids'] / book['asks'] like the old dicts"""
+
+    def __init__(self, bids, asks, currency):
+        self.bids = bids
+        self.asks = asks
+        self.currency = currency
+
+    @classmethod
+    def from_levels(cls, bids, asks, currency):
+        return cls(BookSide.from_levels(bids), BookSide.from_levels(asks), currency)
+
+    def __getitem__(self, side):
+        if side == 'bids':
+            return self.bids
+        if side == 'asks':
+            return self.asks
+        raise KeyError(side)
+
+    def __bool__(self):
+        return True
+
+    def top(self, n):
+        """Zero-copy view of the best n levels on each side"""
+        return OrderBook(self.bids[:n], self.asks[:n], self.currency)
+
+    def converted(self, rate, currency):
+        """Lazy view of the book priced in another currency (prices divided by rate)"""
+        return OrderBook(self.bids.converted(rate), self.asks.converted(rate), currency)
@@ -0,0 +1,278 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connection as db_connection, transaction
+
+from bot import metrics
+from bot.models import Trade, TradeLevel
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable via settings.PERSISTENCE
+DEFAULT_PERSISTENCE_OPTIONS = {
+    'batch_size': 500,        # trades per transaction
+    'flush_interval': 0.5,    # seconds a trade may wait for others to share its transaction
+    'journal': None,          # append-only journal path; None puts it under BASE_DIR/.cache
+    'fsync': False,           # fsync every journal append (survives power loss, not just crashes)
+    'max_backoff': 30,        # seconds between retries while the database is unavailable
+}
+
+# Per-connection SQLite settings, overridable (or disabled with None) via settings.SQLITE_PRAGMAS
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',    # readers don't block the writer and vice versa
+    'synchronous': 'NORMAL',  # safe with WAL, fsyncs at checkpoints rather than every commit
+    'busy_timeout': 5000,     # milliseconds to wait on a locked database instead of failing
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,     # KiB of page cache
+    'mmap_size': 134217728,
+}
+
+def persistence_options():
+    return {**DEFAULT_PERSISTENCE_OPTIONS, **getattr(settings, 'PERSISTENCE', {})}
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created receiver applying the SQLite pragmas to every new connection"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = {**DEFAULT_SQLITE_PRAGMAS, **getattr(settings, 'SQLITE_PRAGMAS', {})}
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if value is not None:
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+# Trade fields written from records; created_at is set by the first insert only
+TRADE_FIELDS = [f.attname for f in Trade._meta.concrete_fields if not f.primary_key and f.attname != 'created_at']
+UPDATE_FIELDS = [name for name in TRADE_FIELDS if name != 'client_order_id']
+LEVEL_FIELDS = [f.attname for f in TradeLevel._meta.concrete_fields if not f.primary_key and f.attname != 'trade_id']
+
+
+class TradeWriter:
+    """Write-behind queue for trades and their levels.
+
+    enqueue() appends the record to a local journal and returns; a background
+    thread writes queued records in batched transactions with bulk_create.
+    Records are keyed by the trade's client_order_id, so a trade can be
+    enqueued when it starts and again with its outcome: later records update
+    the row, and levels are only inserted with the trade's first write.
+    Whatever the journal holds past its last commit marker is written again
+    after a crash.
+    """
+
+    def __init__(self, journal=None, batch_size=None, flush_interval=None, fsync=None, max_backoff=None):
+        options = persistence_options()
+        self.batch_size = batch_size or options['batch_size']
+        self.flush_interval = flush_interval if flush_interval is not None else options['flush_interval']
+        self.fsync = options['fsync'] if fsync is None else fsync
+        self.max_backoff = max_backoff or options['max_backoff']
+        self.journal_path = str(journal or options['journal'] or os.path.join(settings.BASE_DIR, '.cache', 'trade-journal.jsonl'))
+
+        self._pending = deque()
+        self._writing = 0
+        self._sequence = 0
+        self._closing = False
+        self._condition = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._journal = None
+        self._thread = None
+
+    def start(self):
+        """Open the journal, queue anything it holds that was never committed and start writing"""
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        replayed = self._replay()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        if replayed:
+            logger.warning(f"Replaying {replayed} uncommitted trade records from {self.journal_path}")
+        self._thread = threading.Thread(target=self._run, name='trade-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def enqueue(self, trade, levels=None):
+        """Queue a trade (and, on its first write, its levels); never touches the database"""
+        entry = {
+            'trade': {name: getattr(trade, name) for name in TRADE_FIELDS},
+            'levels': [{name: getattr(level, name) for name in LEVEL_FIELDS} for level in levels or ()],
+        }
+        with self._journal_lock:
+            self._sequence += 1
+            entry['seq'] = self._sequence
+            self._journal.write(json.dumps(entry, default=str) + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+
+            # Queue under the same lock that numbered the entry, so the queue stays in
+            # sequence order and a batch's last seq commits everything before it
+            with self._condition:
+                self._pending.append(entry)
+                self._condition.notify_all()
+        metrics.increment('persistence_enqueued_total')
+
+    def flush(self, timeout=None):
+        """Block until every queued record is written; False if timeout passes first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._condition.notify_all()
+            while self._pending or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        """Write what is queued (up to timeout seconds) and stop; anything left stays in the journal"""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._journal is not None:
+            with self._journal_lock:
+                self._journal.close()
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                if not self._write_with_retry(batch):
+                    return
+                self._mark_committed(batch[-1]['seq'])
+                with self._condition:
+                    self._writing = 0
+                    self._condition.notify_all()
+        finally:
+            db_connection.close()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending and not self._closing:
+                self._condition.wait()
+            if not self._pending:
+                return None
+
+            # Give records arriving shortly after this one a chance to share its transaction
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            self._writing = len(batch)
+            return batch
+
+    def _write_with_retry(self, batch):
+        attempt = 0
+        while True:
+            try:
+                with metrics.timer('persistence_flush'):
+                    self.write(batch)
+                metrics.increment('persistence_written_total', len(batch))
+                return True
+            except Exception as e:
+                attempt += 1
+                backoff = min(self.max_backoff, 2 ** attempt * 0.1)
+                logger.error(f"Writing {len(batch)} trade records failed (attempt {attempt}), retrying in {backoff:.1f}s: {e}")
+                metrics.increment('persistence_errors_total')
+                db_connection.close()  # start the retry on a fresh connection
+                if self._closing and attempt >= 3:
+                    logger.error(f"Giving up on {len(batch)} trade records, they stay in {self.journal_path}")
+                    return False
+                time.sleep(backoff)
+
+    @staticmethod
+    def write(batch):
+        """Write journal entries in one transaction: upsert trades by client_order_id, insert new levels"""
+        trades, levels = {}, {}
+        for entry in batch:
+            order_id = entry['trade']['client_order_id']
+            trades.setdefault(order_id, {}).update(entry['trade'])
+            if entry['levels']:
+                levels.setdefault(order_id, []).extend(entry['levels'])
+
+        with transaction.atomic():
+            # Levels go in with a trade's first write only, which also makes replays idempotent
+            existing = set(Trade.objects.filter(client_order_id__in=list(levels)).values_list('client_order_id', flat=True))
+            Trade.objects.bulk_create(
+                [Trade(**_from_json(Trade, fields)) for fields in trades.values()],
+                update_conflicts=True,
+                unique_fields=['client_order_id'],
+                update_fields=UPDATE_FIELDS,
+            )
+            new_levels = {order_id: rows for order_id, rows in levels.items() if order_id not in existing}
+            if new_levels:
+                trade_ids = dict(
+                    Trade.objects.filter(client_order_id__in=list(new_levels)).values_list('client_order_id', 'id')
+                )
+                TradeLevel.objects.bulk_create([
+                    TradeLevel(trade_id=trade_ids[order_id], **_from_json(TradeLevel, row))
+                    for order_id, rows in new_levels.items() for row in rows
+                ])
+
+    def _mark_committed(self, sequence):
+        with self._journal_lock:
+            if self._journal.closed:
+                return
+            if sequence == self._sequence:
+                # Everything journaled is in the database, start the journal afresh
+                self._journal.truncate(0)
+                self._journal.seek(0)
+            else:
+                self._journal.write(json.dumps({'committed': sequence}) + '\n')
+            self._journal.flush()
+
+    def _replay(self):
+        """Queue journal entries past the last commit marker; returns how many"""
+        try:
+            with open(self.journal_path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+
+        entries, committed = [], 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn final line from a crash mid-append
+            if 'committed' in record:
+                committed = max(committed, record['committed'])
+            else:
+                entries.append(record)
+                self._sequence = max(self._sequence, record['seq'])
+
+        self._pending.extend(entry for entry in entries if entry['seq'] > committed)
+        return len(self._pending)
+
+
+def _from_json(model, fields):
+    """Field values back from the journal's JSON, which stores Decimals and datetimes as strings"""
+    model_fields = {f.attname: f for f in model._meta.concrete_fields}
+    return {
+        name: model_fields[name].to_python(value) if isinstance(value, str) else value
+        for name, value in fields.items()
+    }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_trade_writer():
+    """The process-wide TradeWriter, started (and its journal replayed) on first use"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = TradeWriter().start()
+                atexit.register(_writer.close)
+    return _writer
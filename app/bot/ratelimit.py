@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from bot import metrics
+
+try:
+    import fcntl
+except ImportError:  # no flock (e.g. Windows) - buckets are per process instead of shared
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Request priorities, lowest value first
+HIGH = 0     # order books
+NORMAL = 1   # tickers
+LOW = 2      # 24h volume, klines, FX and other slow-moving data
+
+# Default priority per endpoint path; anything unlisted is NORMAL
+ENDPOINT_PRIORITIES = {
+    '/v5/market/orderbook': HIGH,
+    '/v1/public/BTCZAR/orderbook': HIGH,
+    '/v5/market/kline': LOW,
+    '/v1/public/marketsummary': LOW,
+    '/v6/latest/USD': LOW,  # FX rates (bot.services.EXCHANGE_RATE_ENDPOINT)
+}
+
+# Share of a bucket's burst that only HIGH priority requests may use. Other
+# processes respect it too, so order books keep their headroom across workers.
+DEFAULT_RESERVE = 0.25
+
+
+class TokenBucket:
+    """Token bucket whose state lives in a small file shared by every process on the host.
+
+    Each take locks the file with flock, refills by the wall-clock time since the
+    last update and writes the new level back: a few microseconds, no server.
+    """
+    STATE = struct.Struct('<dd')  # tokens, updated_at
+
+    def __init__(self, path, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        else:
+            self.fd = None
+            self._state = (float(burst), time.time())
+
+    def try_take(self, minimum=1.0):
+        """Take a token if at least `minimum` are available; returns 0 if taken, else seconds until there will be"""
+        with self._locked():
+            tokens, now = self._refill()
+            if tokens >= minimum:
+                self._write(tokens - 1, now)
+                return 0.0
+            self._write(tokens, now)
+            return (minimum - tokens) / self.rate
+
+    def refund(self):
+        """Give back a token taken for a request that didn't go out"""
+        with self._locked():
+            tokens, now = self._refill()
+            self._write(min(self.burst, tokens + 1), now)
+
+    def drain(self, seconds):
+        """Empty the bucket so nothing is taken for `seconds` (after a 429)"""
+        with self._locked():
+            self._write(-seconds * self.rate, time.time())
+
+    def _refill(self):
+        tokens, updated_at = self._read()
+        now = time.time()
+        return min(self.burst, tokens + max(0.0, now - updated_at) * self.rate), now
+
+    def _read(self):
+        if self.fd is None:
+            return self._state
+        data = os.pread(self.fd, self.STATE.size, 0)
+        if len(data) < self.STATE.size:
+            return float(self.burst), time.time()
+        return self.STATE.unpack(data)
+
+    def _write(self, tokens, now):
+        if self.fd is None:
+            self._state = (tokens, now)
+        else:
+            os.pwrite(self.fd, self.STATE.pack(tokens, now), 0)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if self.fd is None:
+                yield
+                return
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    """Schedules one upstream's requests through its venue bucket and any per-endpoint buckets.
+
+    Waiting requests queue by priority inside the process, so an order book
+    fetch overtakes queued volume calls, and lower priorities leave the
+    reserved share of each bucket to HIGH ones.
+    """
+
+    def __init__(self, name, rate, burst, endpoints=None, reserve=DEFAULT_RESERVE, directory=None):
+        self.name = name
+        self.reserve = reserve
+        directory = directory or _bucket_directory()
+        self.bucket = TokenBucket(os.path.join(directory, name), rate, burst)
+        self.endpoint_buckets = {
+            path: TokenBucket(os.path.join(directory, f"{name}{path.replace('/', '_')}"), **limits)
+            for path, limits in (endpoints or {}).items()
+        }
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, endpoint, priority=None, timeout=None):
+        """Block until a request to endpoint may go out; False if timeout passes first"""
+        priority = ENDPOINT_PRIORITIES.get(endpoint, NORMAL) if priority is None else priority
+        deadline = None if timeout is None else time.monotonic() + timeout
+        started = time.monotonic()
+        waiter = (priority, next(self._sequence))
+
+        with self._condition:
+            heapq.heappush(self._waiters, waiter)
+            self._condition.notify_all()  # a queued head may now need to yield to us
+            try:
+                while True:
+                    delay = None
+                    if self._waiters[0] == waiter:
+                        delay = self._try_take(endpoint, priority)
+                        if delay == 0:
+                            metrics.observe('rate_limit_wait_seconds', time.monotonic() - started, upstream=self.name)
+                            return True
+
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        metrics.increment('rate_limit_timeouts_total', upstream=self.name, endpoint=endpoint)
+                        return False
+                    self._condition.wait(min(value for value in (delay, remaining, 1.0) if value is not None))
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+    async def aacquire(self, endpoint, priority=None, timeout=None):
+        """acquire() for coroutines: polls the buckets, sleeping on the event loop in between.
+
+        Async requests respect the reserved shares but don't join the thread queue.
+        """
+        priority = ENDPOINT_PRIORITIES.get(endpoint, NORMAL) if priority is None else priority
+        deadline = None if timeout is None else time.monotonic() + timeout
+        started = time.monotonic()
+        while True:
+            delay = self._try_take(endpoint, priority)
+            if delay == 0:
+                metrics.observe('rate_limit_wait_seconds', time.monotonic() - started, upstream=self.name)
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                metrics.increment('rate_limit_timeouts_total', upstream=self.name, endpoint=endpoint)
+                return False
+            await asyncio.sleep(min(value for value in (delay, remaining, 1.0) if value is not None))
+
+    def penalize(self, seconds, endpoint=None):
+        """Back the whole upstream (or one endpoint) off for `seconds` after it answered 429"""
+        logger.warning(f"{self.name} is rate limiting us, pausing {endpoint or 'all requests'} for {seconds:.1f}s")
+        metrics.increment('rate_limited_total', upstream=self.name, endpoint=endpoint or '*')
+        bucket = self.endpoint_buckets.get(endpoint, self.bucket)
+        bucket.drain(seconds)
+
+    def _try_take(self, endpoint, priority):
+        """Take from the endpoint bucket (if any) then the venue bucket; 0 or seconds to wait"""
+        endpoint_bucket = self.endpoint_buckets.get(endpoint)
+        buckets = [endpoint_bucket, self.bucket] if endpoint_bucket is not None else [self.bucket]
+        taken = []
+        for bucket in buckets:
+            delay = bucket.try_take(1.0 + bucket.burst * self.reserve * priority / LOW)
+            if delay:
+                for taken_bucket in taken:
+                    taken_bucket.refund()
+                return delay
+            taken.append(bucket)
+        return 0.0
+
+
+def _bucket_directory():
+    return str(getattr(settings, 'RATE_LIMIT_DIR', None) or os.path.join(settings.BASE_DIR, '.cache', 'ratelimit'))
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name):
+    """The shared RateLimiter for an upstream, or None if settings.UPSTREAM_RATE_LIMITS has no entry for it"""
+    if name not in _limiters:
+        with _limiters_lock:
+            if name not in _limiters:
+                limits = getattr(settings, 'UPSTREAM_RATE_LIMITS', {}).get(name)
+                _limiters[name] = RateLimiter(name, **limits) if limits else None
+    return _limiters[name]
@@ -0,0 +1,140 @@
+import mmap
+import os
+import struct
+from decimal import Decimal
+
+from bot.orderbook import PRICE_PLACES, QTY_PLACES, BookSide, OrderBook, parse_fixed
+from bot.services import MarketSnapshot
+
+# Snapshot recordings are an append-only file of fixed-size int64 records so a
+# reader can memory-map the file and index snapshot i at a fixed offset:
+#
+#   file header:  8-byte magic, int64 depth
+#   record:       RECORD_FIELDS int64 header values, then for each of
+#                 bybit bids, bybit asks, valr bids, valr asks:
+#                 depth price ticks followed by depth satoshi quantities
+MAGIC = b'FPREC001'
+FILE_HEADER = struct.Struct('<8sq')
+RECORD_FIELDS = [
+    'fetched_at_ns', 'exchange_rate', 'bybit_ticker', 'valr_ticker', 'bybit_volume', 'valr_volume',
+    'bybit_bids', 'bybit_asks', 'valr_bids', 'valr_asks',
+]
+SIDES = [('bybit_orderbook', 'bids'), ('bybit_orderbook', 'asks'), ('valr_orderbook', 'bids'), ('valr_orderbook', 'asks')]
+MISSING = -2 ** 63
+DEFAULT_DEPTH = 200
+
+def record_size(depth):
+    """Size in int64 values of one snapshot record"""
+    return len(RECORD_FIELDS) + len(SIDES) * 2 * depth
+
+def _fixed(value, places):
+    return MISSING if value is None else parse_fixed(value, places)
+
+def _decimal(value, places):
+    return None if value == MISSING else Decimal(value) / Decimal(10 ** places)
+
+
+class RecordingWriter:
+    """Appends MarketSnapshots to a recording file, truncating each book side to `depth` levels"""
+
+    def __init__(self, path, depth=DEFAULT_DEPTH):
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, 'ab')
+        if exists:
+            with open(path, 'rb') as f:
+                magic, self.depth = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a snapshot recording")
+        else:
+            self.depth = depth
+            self.file.write(FILE_HEADER.pack(MAGIC, depth))
+        self.record = struct.Struct(f'<{record_size(self.depth)}q')
+
+    def append(self, snapshot):
+        values = [
+            int(snapshot.fetched_at * 1e9),
+            _fixed(snapshot.exchange_rate, PRICE_PLACES),
+            _fixed(snapshot.bybit_ticker, PRICE_PLACES),
+            _fixed(snapshot.valr_ticker, PRICE_PLACES),
+            _fixed(snapshot.bybit_volume, QTY_PLACES),
+            _fixed(snapshot.valr_volume, QTY_PLACES),
+        ]
+        sides = []
+        for book_name, side in SIDES:
+            book = getattr(snapshot, book_name)
+            book_side = book[side][:self.depth] if book else BookSide([], [])
+            values.append(len(book_side))
+            padding = [0] * (self.depth - len(book_side))
+            sides.extend(list(book_side.prices) + padding + list(book_side.quantities) + padding)
+
+        self.file.write(self.record.pack(*values, *sides))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Recording:
+    """Read-only, memory-mapped view of a recording; snapshots are decoded on access.
+
+    Order books are BookSides over slices of the mapping, so nothing is copied
+    and recordings larger than RAM are paged in by the OS as they are read.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.depth = FILE_HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot recording")
+        self.record_size = record_size(self.depth)
+        # Ignore a trailing partial record left by an interrupted writer
+        usable = (len(self.map) - FILE_HEADER.size) // (self.record_size * 8) * self.record_size
+        self.values = memoryview(self.map)[FILE_HEADER.size:FILE_HEADER.size + usable * 8].cast('q')
+
+    def __len__(self):
+        return len(self.values) // self.record_size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        record = self.values[index * self.record_size:(index + 1) * self.record_size]
+        header = dict(zip(RECORD_FIELDS, record[:len(RECORD_FIELDS)]))
+
+        books = {}
+        offset = len(RECORD_FIELDS)
+        for book_name, side in SIDES:
+            count = header[f'{book_name.split("_")[0]}_{side}']
+            books.setdefault(book_name, {})[side] = BookSide(
+                record[offset:offset + count], record[offset + self.depth:offset + self.depth + count]
+            )
+            offset += 2 * self.depth
+
+        return MarketSnapshot(
+            bybit_ticker=_decimal(header['bybit_ticker'], PRICE_PLACES),
+            bybit_orderbook=OrderBook(books['bybit_orderbook']['bids'], books['bybit_orderbook']['asks'], 'USD'),
+            bybit_volume=_decimal(header['bybit_volume'], QTY_PLACES),
+            valr_ticker=_decimal(header['valr_ticker'], PRICE_PLACES),
+            valr_orderbook=OrderBook(books['valr_orderbook']['bids'], books['valr_orderbook']['asks'], 'ZAR'),
+            valr_volume=_decimal(header['valr_volume'], QTY_PLACES),
+            exchange_rate=_decimal(header['exchange_rate'], PRICE_PLACES),
+            fetched_at=header['fetched_at_ns'] / 1e9,
+            version=index,
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def timestamp(self, index):
+        """fetched_at of a snapshot without decoding it"""
+        return self.values[index * self.record_size] / 1e9
+
+    def close(self):
+        self.values.release()
+        self.map.close()
+        self.file.close()
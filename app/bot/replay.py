@@ -0,0 +1,59 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def load_recording(path):
+    """Read a JSONL recording made by OrderBookStream into {venue: [(t, raw_message), ...]}"""
+    recording = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recording.setdefault(entry['venue'], []).append((entry['t'], entry['message']))
+    return recording
+
+
+class ReplayServer:
+    """Local websocket server that stands in for the exchanges by replaying a recording.
+
+    Connect to ``ws://host:port/<venue>``; after the client's subscribe message the
+    venue's recorded messages are sent with their original spacing divided by ``speed``
+    (``speed=0`` sends them back to back).
+    """
+
+    def __init__(self, recording, host='127.0.0.1', port=8765, speed=1.0):
+        self.recording = recording
+        self.host = host
+        self.port = port
+        self.speed = speed
+
+    async def handler(self, websocket, path=None):
+        # websockets >= 13 exposes the path on the request instead of passing it in
+        if path is None:
+            path = websocket.request.path
+        venue = path.strip('/')
+        messages = self.recording.get(venue)
+        if messages is None:
+            logger.warning(f"No recording for venue {venue!r}")
+            await websocket.close()
+            return
+
+        await websocket.recv()  # wait for the subscribe message, as the exchanges do
+        previous = messages[0][0]
+        for t, raw in messages:
+            if self.speed:
+                await asyncio.sleep((t - previous) / self.speed)
+            previous = t
+            await websocket.send(raw)
+        logger.info(f"Finished replaying {len(messages)} {venue} messages")
+        await websocket.wait_closed()
+
+    async def serve_forever(self):
+        import websockets  # optional dependency, only needed in streaming mode
+
+        async with websockets.serve(self.handler, self.host, self.port):
+            logger.info(f"Replaying {', '.join(self.recording)} on ws://{self.host}:{self.port}/<venue>")
+            await asyncio.Future()
@@ -1,52 +1,101 @@
-import requests
-import json
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from decimal import Decimal
 import logging
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+import bot.store as store
+from bot.cache import AsyncSingleFlight, ResponseCache, SingleFlight
+from bot import codec, matching, metrics, upstream
+from bot.orderbook import OrderBook, QTY_SCALE
+
 logger = logging.getLogger(__name__)
 
+# Upstream hosts, overridable via settings.UPSTREAM_BASE_URLS (e.g. to run against
+# the local simulator, manage.py simulate_exchanges)
+DEFAULT_UPSTREAM_BASE_URLS = {
+    'bybit': "https://api.bybit.com",
+    'valr': "https://api.valr.com",
+    'fx': "https://open.er-api.com",
+}
+UPSTREAM_BASE_URLS = {**DEFAULT_UPSTREAM_BASE_URLS, **getattr(settings, 'UPSTREAM_BASE_URLS', {})}
+
 # ByBit API endpoints
-BYBIT_BASE_URL = "https://api.bybit.com"
+BYBIT_BASE_URL = UPSTREAM_BASE_URLS['bybit']
 BYBIT_TICKER_ENDPOINT = "/v5/market/tickers"
 BYBIT_ORDERBOOK_ENDPOINT = "/v5/market/orderbook"
 BYBIT_KLINE_ENDPOINT = "/v5/market/kline"
 
 # Valr API endpoints
-VALR_BASE_URL = "https://api.valr.com"
-VALR_TICKER_ENDPOINT = "/v1/public/BTCZAR/marketsummary"
+VALR_BASE_URL = UPSTREAM_BASE_URLS['valr']
+VALR_MARKET_SUMMARY_ENDPOINT = "/v1/public/BTCZAR/marketsummary"  # ticker and 24h volume
 VALR_ORDERBOOK_ENDPOINT = "/v1/public/BTCZAR/orderbook"
-VALR_VOLUME_ENDPOINT = "/v1/public/BTCZAR/marketsummary"
 
 # Exchange rate API
-EXCHANGE_RATE_API = "https://open.er-api.com/v6/latest/USD"
+EXCHANGE_RATE_ENDPOINT = "/v6/latest/USD"
+EXCHANGE_RATE_API = UPSTREAM_BASE_URLS['fx'] + EXCHANGE_RATE_ENDPOINT
+
+# Overall deadline in seconds for a full market snapshot (per-call timeouts live
+# on the clients, see bot/clients.py and settings.EXCHANGE_CLIENTS)
+SNAPSHOT_DEADLINE = 8
+SNAPSHOT_MAX_WORKERS = 8
+
+# Minimum Live Gross Premium (%) before we consider trading at all
+MIN_PREMIUM_PERCENTAGE = Decimal('1')
+
+# Minimum marginal spread (%) for an order book level to be worth trading
+MIN_SPREAD_PERCENTAGE = Decimal('1')
+
+# Share of the smaller 24h volume we're willing to trade
+LIQUIDITY_FACTOR = Decimal('0.1')  # 10% of available liquidity
+
+# Taker fee charged on each leg (%)
+TAKER_FEE_PERCENTAGE = Decimal('0.1')
+
+# Published snapshots older than this many seconds are ignored and fetched live instead
+SNAPSHOT_MAX_AGE = 15
+
+# Without an ingestor, a live-fetched snapshot is reused by every request for this many seconds
+LIVE_SNAPSHOT_TTL = 2
 
 def handle_request_errors(func):
-    """Decorator to handle request errors with more detailed logging"""
+    """Decorator to handle request errors with more detailed logging (sync or async functions)"""
+    if inspect.iscoroutinefunction(func):
+        async def async_wrapper(*args, **kwargs):
+            try:
+                with metrics.timer(func.__name__):
+                    return await func(*args, **kwargs)
+            except Exception as e:
+                return _request_failed(func, e)
+        return async_wrapper
+
     def wrapper(*args, **kwargs):
         try:
-            return func(*args, **kwargs)
-        except requests.RequestException as e:
-            logger.error(f"API request failed in {func.__name__}: {e}")
-            return None
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing error in {func.__name__}: {e}")
-            return None
+            with metrics.timer(func.__name__):
+                return func(*args, **kwargs)
         except Exception as e:
-            logger.error(f"Unexpected error in {func.__name__}: {str(e)}", exc_info=True)
-            return None
+            return _request_failed(func, e)
     return wrapper
 
-@handle_request_errors
+def _request_failed(func, e):
+    return upstream.report_failure(func.__name__, e)
+
 def get_exchange_rate():
-    """Get USD to ZAR exchange rate"""
-    response = requests.get(EXCHANGE_RATE_API)
-    data = response.json()
-    return Decimal(str(data['rates']['ZAR']))
+    """Get USD to ZAR exchange rate, served from the reference cache"""
+    return _fetch('exchange_rate')
+
+async def aget_exchange_rate():
+    return (await upstream.afetch(['exchange_rate'])).get('exchange_rate')
 
 @handle_request_errors
-def zar_to_dollar(amount=None, zar_price=None):
-    """Convert ZAR to USD"""
-    exchange_rate = get_exchange_rate()
+def zar_to_dollar(amount=None, zar_price=None, exchange_rate=None):
+    """Convert ZAR to USD, at the given exchange rate or the current one"""
+    if exchange_rate is None:
+        exchange_rate = get_exchange_rate()
     
     if amount is not None:
         converted_amount = Decimal(str(amount)) / exchange_rate
@@ -61,96 +110,117 @@ def zar_to_dollar(amount=None, zar_price=None):
     
     return None
 
+# Upstream resources. Each is requested and decoded at most once per snapshot,
+# and snapshot fields are extracted from whichever resources the planner picks
+# (see bot.upstream)
+upstream.register_resource('bybit_ticker', upstream.Resource(
+    'bybit', BYBIT_BASE_URL, BYBIT_TICKER_ENDPOINT, {'category': 'spot', 'symbol': 'BTCUSDT'}))
+upstream.register_resource('bybit_orderbook', upstream.Resource(
+    'bybit', BYBIT_BASE_URL, BYBIT_ORDERBOOK_ENDPOINT, {'category': 'spot', 'symbol': 'BTCUSDT', 'limit': 50},
+    decode=lambda content: codec.get_codec().decode_bybit_orderbook(content)))
+upstream.register_resource('bybit_kline', upstream.Resource(
+    'bybit', BYBIT_BASE_URL, BYBIT_KLINE_ENDPOINT, {'category': 'spot', 'symbol': 'BTCUSDT', 'interval': 'D'}))
+upstream.register_resource('valr_summary', upstream.Resource('valr', VALR_BASE_URL, VALR_MARKET_SUMMARY_ENDPOINT))
+upstream.register_resource('valr_orderbook', upstream.Resource(
+    'valr', VALR_BASE_URL, VALR_ORDERBOOK_ENDPOINT,
+    decode=lambda content: codec.get_codec().decode_valr_orderbook(content)))
+# FX rates are reference data, served from the 'fx' reference cache between fetches
+upstream.register_resource('fx', upstream.Resource('fx', UPSTREAM_BASE_URLS['fx'], EXCHANGE_RATE_ENDPOINT, cache='fx'))
+
+def _bybit_ticker(payload):
+    if payload['retCode'] == 0 and payload['result']['list']:
+        return payload['result']['list'][0]
+    return None
+
+@upstream.extractor('bybit_ticker', 'bybit_ticker')
+def bybit_last_price(payload):
+    ticker = _bybit_ticker(payload)
+    return Decimal(ticker['lastPrice']) if ticker else None
+
+# The ticker's rolling 24h volume saves a kline call; today's daily candle is
+# only fetched when the ticker fails
+@upstream.extractor('bybit_volume', 'bybit_ticker')
+def bybit_base_volume(payload):
+    ticker = _bybit_ticker(payload)
+    return Decimal(ticker['volume24h']) if ticker else None
+
+@upstream.extractor('bybit_volume', 'bybit_kline')
+def bybit_kline_volume(payload):
+    if payload['retCode'] == 0 and payload['result']['list']:
+        # Volume is in the 6th position of each kline data
+        return Decimal(payload['result']['list'][0][5])
+    return None
+
+@upstream.extractor('bybit_turnover', 'bybit_ticker')
+def bybit_quote_volume(payload):
+    ticker = _bybit_ticker(payload)
+    return Decimal(ticker['turnover24h']) if ticker else None
+
+@upstream.extractor('bybit_orderbook', 'bybit_orderbook')
+@upstream.extractor('valr_orderbook', 'valr_orderbook')
+def decoded_orderbook(payload):
+    return payload
+
+@upstream.extractor('valr_ticker', 'valr_summary')
+def valr_last_price(payload):
+    return Decimal(payload['lastTradedPrice'])
+
+@upstream.extractor('valr_volume', 'valr_summary')
+def valr_base_volume(payload):
+    return Decimal(payload['baseVolume'])
+
+@upstream.extractor('valr_turnover', 'valr_summary')
+def valr_quote_volume(payload):
+    return Decimal(payload['quoteVolume'])
+
+@upstream.extractor('exchange_rate', 'fx')
+def usd_zar_rate(payload):
+    return Decimal(str(payload['rates']['ZAR']))
+
+def _fetch(field):
+    return upstream.fetch([field]).get(field)
+
 # ByBit API functions
 @handle_request_errors
 def bb_btc_ticker():
     """Get BTC ticker from ByBit"""
-    params = {
-        'category': 'spot',
-        'symbol': 'BTCUSDT'
-    }
-    response = requests.get(BYBIT_BASE_URL + BYBIT_TICKER_ENDPOINT, params=params)
-    data = response.json()
-    
-    if data['retCode'] == 0 and data['result']['list']:
-        return Decimal(data['result']['list'][0]['lastPrice'])
-    
-    return None
+    return _fetch('bybit_ticker')
 
 @handle_request_errors
 def bb_btc_orderbook():
     """Get BTC orderbook from ByBit"""
-    params = {
-        'category': 'spot',
-        'symbol': 'BTCUSDT',
-        'limit': 50
-    }
-    response = requests.get(BYBIT_BASE_URL + BYBIT_ORDERBOOK_ENDPOINT, params=params)
-    data = response.json()
-    
-    if data['retCode'] == 0:
-        return {
-            'bids': [(Decimal(bid[0]), Decimal(bid[1])) for bid in data['result']['b']],
-            'asks': [(Decimal(ask[0]), Decimal(ask[1])) for ask in data['result']['a']]
-        }
-    
-    return None
+    return _fetch('bybit_orderbook')
 
 @handle_request_errors
 def bb_btc_volume():
     """Get BTC 24h volume from ByBit"""
-    params = {
-        'category': 'spot',
-        'symbol': 'BTCUSDT',
-        'interval': 'D'
-    }
-    response = requests.get(BYBIT_BASE_URL + BYBIT_KLINE_ENDPOINT, params=params)
-    data = response.json()
-    
-    if data['retCode'] == 0 and data['result']['list']:
-        # Volume is in the 6th position of each kline data
-        return Decimal(data['result']['list'][0][5])
-    
-    return None
+    return _fetch('bybit_volume')
 
 # Valr API functions
 @handle_request_errors
 def vr_btc_ticker():
     """Get BTC ticker from Valr"""
-    response = requests.get(VALR_BASE_URL + VALR_TICKER_ENDPOINT)
-    data = response.json()
-    
-    return Decimal(data['lastTradedPrice'])
+    return _fetch('valr_ticker')
 
 @handle_request_errors
 def vr_order_book():
     """Get BTC orderbook from Valr"""
-    response = requests.get(VALR_BASE_URL + VALR_ORDERBOOK_ENDPOINT)
-    data = response.json()
-    
-    return {
-        'bids': [(Decimal(bid['price']), Decimal(bid['quantity'])) for bid in data['Bids']],
-        'asks': [(Decimal(ask['price']), Decimal(ask['quantity'])) for ask in data['Asks']]
-    }
+    return _fetch('valr_orderbook')
 
 @handle_request_errors
 def vr_btc_volume():
     """Get BTC 24h volume from Valr"""
-    response = requests.get(VALR_BASE_URL + VALR_VOLUME_ENDPOINT)
-    data = response.json()
-
-    # Sum up the volume from trade history
-    volume = Decimal(data['baseVolume'])
+    return _fetch('valr_volume')
 
-    return volume
-
-def calculate_tradable_btc(bybit_volume, valr_volume):
+def calculate_tradable_btc(bybit_volume, valr_volume, liquidity_factor=LIQUIDITY_FACTOR):
     """Calculate the tradable BTC volume"""
     # Using the minimum of both exchanges' volumes as a conservative approach
     # Typically we'd only want to trade up to some percentage of the available liquidity
-    return min(bybit_volume, valr_volume) * Decimal('0.1')  # 10% of available liquidity
+    return min(bybit_volume, valr_volume) * liquidity_factor
 
-def analyze_order_books(bybit_orderbook, valr_orderbook, target_btc_volume):
+@metrics.timed('analyze_order_books')
+def analyze_order_books(bybit_orderbook, valr_orderbook, target_btc_volume, usd_zar_rate=None,
+                        min_spread_percentage=MIN_SPREAD_PERCENTAGE):
     """Analyze order books to determine if trade is possible"""
     # Check if orderbooks are available
     if not bybit_orderbook or not valr_orderbook:
@@ -162,8 +232,10 @@ def analyze_order_books(bybit_orderbook, valr_orderbook, target_btc_volume):
         }
     
     try:
-        # Convert VALR orderbook prices from ZAR to USD for comparison
-        usd_zar_rate = get_exchange_rate()
+        # Convert VALR orderbook prices from ZAR to USD for comparison, using the
+        # caller's rate so a whole snapshot is priced consistently
+        if usd_zar_rate is None:
+            usd_zar_rate = get_exchange_rate()
         
         if not usd_zar_rate:
             logger.warning("Exchange rate not available")
@@ -173,61 +245,51 @@ def analyze_order_books(bybit_orderbook, valr_orderbook, target_btc_volume):
                 'trade_levels': []
             }
         
-        # Convert Valr asks to USD (these are the prices we buy at)
-        valr_asks_usd = [(ask_price / usd_zar_rate, quantity) for ask_price, quantity in valr_orderbook['asks']]
-        
-        # ByBit bids are the prices we sell at
+        # Valr asks are the prices we buy at (as a lazy USD view, only the levels
+        # we walk get converted), ByBit bids are the prices we sell at
+        valr_asks = valr_orderbook['asks']
+        valr_asks_usd = valr_orderbook.converted(usd_zar_rate, 'USD')['asks']
         bybit_bids = bybit_orderbook['bids']
         
-        # Check if we can execute the full trade with a profitable spread
-        cumulative_btc = Decimal('0')
-        trade_levels = []
+        # Walk both books by cumulative volume until the marginal spread drops
+        # below the threshold or the target volume is filled
+        fills = matching.walk_books(valr_asks_usd, bybit_bids, target_btc_volume, min_spread_percentage)
         
-        # Only add levels with a profitable spread (>= 1%)
-        for i in range(min(len(valr_asks_usd), len(bybit_bids))):
-            valr_price, valr_qty = valr_asks_usd[i]
-            bybit_price, bybit_qty = bybit_bids[i]
+        trade_levels = []
+        cumulative_btc = Decimal('0')
+        cost_usd = Decimal('0')
+        proceeds_usd = Decimal('0')
+        for ask_index, bid_index, satoshis in fills:
+            valr_price = valr_asks_usd.price(ask_index)
+            bybit_price = bybit_bids.price(bid_index)
+            trade_qty = Decimal(satoshis) / QTY_SCALE
             
-            # Calculate spread - valr_price is already in USD at this point
-            spread = bybit_price - valr_price
-            spread_percentage = (spread / valr_price) * 100
+            trade_levels.append({
+                'valr_price_zar': valr_asks.price(ask_index),
+                'valr_price_usd': valr_price,  # Add USD price for comparison
+                'bybit_price_usd': bybit_price,
+                'quantity': trade_qty,
+                'spread_percentage': matching.spread_percentage(valr_price, bybit_price)
+            })
             
-            # Only include levels with a profitable spread (>= 1%)
-            if spread_percentage >= 1:
-                trade_qty = min(valr_qty, bybit_qty)
-                
-                if cumulative_btc + trade_qty >= target_btc_volume:
-                    # Adjust trade_qty to meet target_btc_volume exactly
-                    trade_qty = target_btc_volume - cumulative_btc
-                    
-                    trade_levels.append({
-                        'valr_price_zar': valr_price * usd_zar_rate,
-                        'valr_price_usd': valr_price,  # Add USD price for comparison
-                        'bybit_price_usd': bybit_price,
-                        'quantity': trade_qty,
-                        'spread_percentage': spread_percentage
-                    })
-                    
-                    cumulative_btc += trade_qty
-                    break
-                else:
-                    trade_levels.append({
-                        'valr_price_zar': valr_price * usd_zar_rate,
-                        'valr_price_usd': valr_price,  # Add USD price for comparison
-                        'bybit_price_usd': bybit_price,
-                        'quantity': trade_qty,
-                        'spread_percentage': spread_percentage
-                    })
-                    
-                    cumulative_btc += trade_qty
-            else:
-                # If we hit a level with insufficient spread, stop
-                break
+            cumulative_btc += trade_qty
+            cost_usd += valr_price * trade_qty
+            proceeds_usd += bybit_price * trade_qty
+        
+        # Volume-weighted fill across all levels
+        vwap = {'vwap_valr_price_usd': None, 'vwap_bybit_price_usd': None, 'average_spread_percentage': None}
+        if cumulative_btc:
+            vwap = {
+                'vwap_valr_price_usd': cost_usd / cumulative_btc,
+                'vwap_bybit_price_usd': proceeds_usd / cumulative_btc,
+                'average_spread_percentage': matching.spread_percentage(cost_usd, proceeds_usd)
+            }
         
         return {
             'can_execute': cumulative_btc > Decimal('0'),
             'tradable_volume': cumulative_btc,
-            'trade_levels': trade_levels
+            'trade_levels': trade_levels,
+            **vwap
         }
     except Exception as e:
         logger.error(f"Error analyzing order books: {e}")
@@ -235,4 +297,197 @@ def analyze_order_books(bybit_orderbook, valr_orderbook, target_btc_volume):
             'can_execute': False,
             'tradable_volume': Decimal('0'),
             'trade_levels': []
-        }
\ No newline at end of file
+        }
+
+@metrics.timed('simulate_trades')
+def simulate_trades(snapshot, amounts_zar, fee_percentage=TAKER_FEE_PERCENTAGE):
+    """Depth-aware simulation of the trade we execute, buying BTC on Valr and selling it on ByBit, for every ZAR amount.
+
+    Each amount is spent down the Valr asks; the BTC bought, less the taker fee,
+    is sold down the ByBit bids and the USD raised, converted to ZAR, is charged
+    the fee again. Both books are summed once for the whole vector of amounts
+    and everything stays in Decimal. Amounts deeper than either book fill only
+    what the book holds (``fully_filled`` is False).
+    """
+    rate = snapshot.exchange_rate
+    fee = fee_percentage / 100
+    asks = snapshot.valr_orderbook['asks']
+    bids = snapshot.bybit_orderbook['bids']
+    if not len(asks) or not len(bids):
+        return []
+
+    btc_bought, zar_spent = matching.fill_curve(asks, amounts_zar, quote=True)
+    btc_to_sell = [btc * (1 - fee) for btc in btc_bought]
+    btc_sold, usd_raised = matching.fill_curve(bids, btc_to_sell)
+
+    best_ask_zar = asks.price(0)
+    best_bid_usd = bids.price(0)
+    results = []
+    for i, amount in enumerate(amounts_zar):
+        invested_zar = zar_spent[i]
+        raised_zar = usd_raised[i] * rate
+        proceeds_zar = raised_zar * (1 - fee)
+        valr_price = invested_zar / btc_bought[i] if btc_bought[i] else None
+        bybit_price = usd_raised[i] / btc_sold[i] if btc_sold[i] else None
+        profit_zar = proceeds_zar - invested_zar
+        results.append({
+            'amount_zar': amount,
+            'invested_zar': invested_zar,
+            'btc_bought': btc_bought[i],
+            'btc_sold': btc_sold[i],
+            'valr_avg_price_zar': valr_price,
+            'bybit_avg_price_usd': bybit_price,
+            # How far the average fill is from the best level
+            'valr_slippage_percentage': (valr_price / best_ask_zar - 1) * 100 if valr_price else None,
+            'bybit_slippage_percentage': (1 - bybit_price / best_bid_usd) * 100 if bybit_price else None,
+            'fees_zar': (invested_zar + raised_zar) * fee,
+            'profit_zar': profit_zar,
+            'profit_percentage': profit_zar / invested_zar * 100 if invested_zar else None,
+            'fully_filled': invested_zar == amount and btc_sold[i] == btc_to_sell[i],
+        })
+    return results
+
+
+# Market snapshot
+@dataclass
+class MarketSnapshot:
+    """Point-in-time view of both exchanges and the USD/ZAR exchange rate"""
+    bybit_ticker: Decimal = None
+    bybit_orderbook: OrderBook = None
+    bybit_volume: Decimal = None
+    bybit_turnover: Decimal = None
+    valr_ticker: Decimal = None
+    valr_orderbook: OrderBook = None
+    valr_volume: Decimal = None
+    valr_turnover: Decimal = None
+    exchange_rate: Decimal = None
+    fetched_at: float = field(default_factory=time.time)
+    elapsed: float = 0.0
+    missing: list = field(default_factory=list)
+    version: int = 0
+
+    @property
+    def valr_price_usd(self):
+        """Valr BTC price converted to USD at the snapshot's exchange rate"""
+        if self.valr_ticker is None or not self.exchange_rate:
+            return None
+        return self.valr_ticker / self.exchange_rate
+
+    @property
+    def premium(self):
+        """Valr USD price minus ByBit price (Live Gross Premium in USD)"""
+        valr_price_usd = self.valr_price_usd
+        if valr_price_usd is None or self.bybit_ticker is None:
+            return None
+        return valr_price_usd - self.bybit_ticker
+
+    @property
+    def percentage_premium(self):
+        """Live Gross Premium as a percentage of the ByBit price"""
+        premium = self.premium
+        if premium is None or not self.bybit_ticker:
+            return None
+        return (premium / self.bybit_ticker) * Decimal('100')
+
+
+# Fields of a full snapshot, all extracted from upstream resources (see above)
+SNAPSHOT_FIELDS = (
+    'bybit_ticker', 'bybit_orderbook', 'bybit_volume', 'bybit_turnover',
+    'valr_ticker', 'valr_orderbook', 'valr_volume', 'valr_turnover',
+    'exchange_rate',
+)
+
+# Shared, bounded pool so a slow upstream never holds up the caller past the deadline
+_snapshot_executor = ThreadPoolExecutor(max_workers=SNAPSHOT_MAX_WORKERS, thread_name_prefix='snapshot')
+
+@metrics.timed('fetch_market_snapshot')
+def fetch_market_snapshot(fields=None, deadline=SNAPSHOT_DEADLINE):
+    """Fetch all (or the given) snapshot fields within an overall deadline.
+
+    The fields are planned onto the fewest upstream resources, which are fetched
+    concurrently and decoded once each, however many fields they serve.
+    """
+    started = time.monotonic()
+    values = upstream.fetch(fields or SNAPSHOT_FIELDS, deadline, _snapshot_executor)
+    return _build_snapshot(fields or SNAPSHOT_FIELDS, values, started)
+
+@metrics.timed('afetch_market_snapshot')
+async def afetch_market_snapshot(fields=None, deadline=SNAPSHOT_DEADLINE):
+    """Async fetch_market_snapshot: every resource is a task on the event loop, no threads held"""
+    started = time.monotonic()
+    values = await upstream.afetch(fields or SNAPSHOT_FIELDS, deadline)
+    return _build_snapshot(fields or SNAPSHOT_FIELDS, values, started)
+
+def _build_snapshot(fields, values, started):
+    snapshot = MarketSnapshot()
+    for name in fields:
+        value = values.get(name)
+        if value is None:
+            # Failed, or past the deadline - leave the field empty rather than block the request
+            snapshot.missing.append(name)
+        setattr(snapshot, name, value)
+    snapshot.elapsed = time.monotonic() - started
+    return snapshot
+
+# Live fetches shared between concurrent requests, and reused for LIVE_SNAPSHOT_TTL
+_live_fetches = SingleFlight('live_snapshot')
+_alive_fetches = AsyncSingleFlight('live_snapshot')
+_live_snapshots = ResponseCache(ttl=LIVE_SNAPSHOT_TTL, max_entries=8)
+
+def current_snapshot(fields=None):
+    """Latest snapshot published by the ingestor, falling back to a live fetch if there is none.
+
+    Concurrent callers share one live fetch, and its snapshot is reused for
+    LIVE_SNAPSHOT_TTL seconds, so a burst of requests costs one set of upstream calls.
+    """
+    snapshot = store.latest_snapshot(max_age=SNAPSHOT_MAX_AGE)
+    if snapshot is not None:
+        return snapshot
+
+    # A full snapshot answers any request for a subset of its fields
+    key = tuple(sorted(fields)) if fields else None
+    snapshot = _live_snapshots.get(None) or (key and _live_snapshots.get(key))
+    if snapshot is not None:
+        return snapshot
+
+    return _live_fetches.do(key, lambda: _fetch_live_snapshot(key, fields))
+
+async def acurrent_snapshot(fields=None):
+    """Async current_snapshot; live fetches are coalesced per event loop"""
+    # Cache reads don't touch the ORM, so they needn't queue for Django's single sync thread
+    snapshot = await sync_to_async(store.latest_snapshot, thread_sensitive=False)(max_age=SNAPSHOT_MAX_AGE)
+    if snapshot is not None:
+        return snapshot
+
+    key = tuple(sorted(fields)) if fields else None
+    snapshot = _live_snapshots.get(None) or (key and _live_snapshots.get(key))
+    if snapshot is not None:
+        return snapshot
+
+    return await _alive_fetches.do(key, lambda: _afetch_live_snapshot(key, fields))
+
+async def _afetch_live_snapshot(key, fields):
+    logger.info("No recent published snapshot, fetching live")
+    snapshot = await afetch_market_snapshot(fields)
+    snapshot.version = time.time_ns() // 1_000_000
+    _live_snapshots.set(key, snapshot)
+    return snapshot
+
+def _fetch_live_snapshot(key, fields):
+    logger.info("No recent published snapshot, fetching live")
+    snapshot = fetch_market_snapshot(fields)
+    snapshot.version = time.time_ns() // 1_000_000
+    _live_snapshots.set(key, snapshot)
+    return snapshot
+
+def snapshot_version():
+    """Version of the published snapshot, without loading it; None if nothing fresh is published.
+
+    Without a published snapshot there's nothing cheap to key a response on, and
+    fetching one live just to version it would defeat conditional requests.
+    """
+    return store.latest_version(max_age=SNAPSHOT_MAX_AGE)
+
+async def asnapshot_version():
+    """Async snapshot_version"""
+    return await sync_to_async(store.latest_version, thread_sensitive=False)(max_age=SNAPSHOT_MAX_AGE)
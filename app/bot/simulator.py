@@ -0,0 +1,501 @@
+import asyncio
+import json
+import logging
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from bot import codec, services, venues
+from bot.mock_exchange import MockExchange
+from bot.streaming import ASKS, BIDS, BYBIT_ORDERBOOK_TOPIC, VALR_ORDERBOOK_PAIR
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable via settings.EXCHANGE_SIMULATOR
+DEFAULT_SIMULATOR_OPTIONS = {
+    'depth': 50,                  # price levels a side on each venue's book
+    'update_interval': 0.1,       # seconds between book updates (and websocket deltas)
+    'churn': 5,                   # levels re-sized a side per update, besides those the mid's move shifts in or out
+    'bybit_price': 60000,
+    'exchange_rate': 18.5,
+    'volatility': 0.00003,        # standard deviation of ByBit's log mid price move per update
+    'premium': 0.015,             # Valr's premium over ByBit, which it drifts around
+    'premium_volatility': 0.0005,
+    'latency': 0.0,               # seconds added to every REST response...
+    'jitter': 0.0,                # ...plus a uniformly random extra of up to this many
+    'error_rate': 0.0,            # fraction of market data requests answered with the venue's error response
+    'stall_rate': 0.0,            # fraction of REST requests held for `stall` seconds, past the clients' timeouts
+    'stall': 10,
+    'gap_rate': 0.0,              # fraction of websocket deltas dropped, so subscribers hit a sequence gap and resync
+    'disconnect_rate': 0.0,       # chance per update of dropping each websocket subscriber
+    'seed': None,
+}
+
+def simulator_options():
+    return {**DEFAULT_SIMULATOR_OPTIONS, **getattr(settings, 'EXCHANGE_SIMULATOR', {})}
+
+
+# Price step between adjacent levels of each venue's book (coarser than the venues'
+# tick sizes, as real books are sparse that close to the mid), and its starting 24h volume
+LEVEL_SPACING = {'bybit': Decimal('1.00'), 'valr': Decimal('20')}
+DAILY_VOLUMES = {'bybit': 2500.0, 'valr': 120.0}
+
+# Pull of Valr's premium back to its mean per update
+PREMIUM_REVERSION = 0.01
+
+# The error each venue answers with when error_rate strikes, in its own shape
+INJECTED_ERRORS = {
+    'bybit': (200, {'retCode': 10016, 'retMsg': 'Internal system error.', 'result': {}, 'retExtInfo': {}}),
+    'valr': (503, {'code': -1, 'message': 'Service Unavailable'}),
+    'fx': (503, {'result': 'error', 'error-type': 'service-unavailable'}),
+}
+
+
+class SimulatedBook:
+    """Price-level book `depth` levels deep a side, around a mid price that moves on every update.
+
+    Prices are held as integer ticks of `spacing` and each side is a contiguous
+    window of ticks, so a side renders best first without sorting, and an
+    update only touches the levels the move shifts in or out of the windows
+    plus `churn` re-sized ones a side. Each update bumps the sequence number.
+    """
+
+    def __init__(self, mid, spacing, depth, rng, churn=5, mean_quantity=0.25):
+        self.spacing = spacing
+        self.places = max(0, -spacing.as_tuple().exponent)
+        self.depth = depth
+        self.rng = rng
+        self.churn = churn
+        self.mean_quantity = mean_quantity
+        self.sequence = 1
+        self.levels = {BIDS: {}, ASKS: {}}
+        self.windows = {}
+        for side, low, high in self._windows(mid):
+            self.levels[side] = {tick: self._quantity() for tick in range(low, high + 1)}
+            self.windows[side] = (low, high)
+
+    def update(self, mid):
+        """Move the book to a new mid price; returns the changed levels, {side: {tick: quantity, 0 if removed}}"""
+        changes = {BIDS: {}, ASKS: {}}
+        for side, low, high in self._windows(mid):
+            levels, changed = self.levels[side], changes[side]
+            old_low, old_high = self.windows[side]
+            for tick in _outside(old_low, old_high, low, high):
+                del levels[tick]
+                changed[tick] = 0
+            for tick in _outside(low, high, old_low, old_high):
+                levels[tick] = changed[tick] = self._quantity()
+            for _ in range(self.churn):
+                tick = self.rng.randint(low, high)
+                levels[tick] = changed[tick] = self._quantity()
+            self.windows[side] = (low, high)
+        self.sequence += 1
+        return changes
+
+    def ticks(self, side, limit=None):
+        """Ticks of a side, best first"""
+        low, high = self.windows[side]
+        if limit is not None:
+            low, high = (max(low, high - limit + 1), high) if side == BIDS else (low, min(high, low + limit - 1))
+        return range(high, low - 1, -1) if side == BIDS else range(low, high + 1)
+
+    def best(self, side):
+        low, high = self.windows[side]
+        return high if side == BIDS else low
+
+    def price(self, tick):
+        return f'{tick * self.spacing:.{self.places}f}'
+
+    @staticmethod
+    def quantity(quantity):
+        return f'{quantity / 100_000_000:.8f}'
+
+    def average_price(self, side, quantity):
+        """Average price of a market order for `quantity` (in BTC) walking a side from the top"""
+        remaining = int(quantity * 100_000_000)
+        filled = cost = 0
+        for tick in self.ticks(side):
+            take = min(remaining, self.levels[side][tick])
+            filled += take
+            cost += take * tick
+            remaining -= take
+            if remaining <= 0:
+                break
+        tick = cost / filled if filled else self.best(side)
+        return (Decimal(tick) * self.spacing).quantize(self.spacing)
+
+    def _windows(self, mid):
+        best_bid = math.floor(mid / float(self.spacing))
+        yield BIDS, best_bid - self.depth + 1, best_bid
+        yield ASKS, best_bid + 1, best_bid + self.depth
+
+    def _quantity(self):
+        """A level's size in satoshis"""
+        return max(1, int(self.rng.expovariate(1 / self.mean_quantity) * 100_000_000))
+
+
+def _outside(low, high, other_low, other_high):
+    """Ticks in [low, high] that are not in [other_low, other_high]"""
+    yield from range(low, min(high, other_low - 1) + 1)
+    yield from range(max(low, other_high + 1), high + 1)
+
+
+class ExchangeSimulator(MockExchange):
+    """Local stand-in for ByBit, Valr and open.er-api, for soak and load testing the whole pipeline.
+
+    On top of MockExchange's order APIs it serves the public REST endpoints
+    bot.services and bot.venues read, in the venues' own shapes, from two
+    random-walk books (Valr's mid follows ByBit's through the FX rate and a
+    drifting premium). The same books are published as websocket feeds at
+    ``ws://host:ws_port/bybit`` and ``/valr`` in the shapes bot.streaming
+    consumes: a snapshot on subscribe, then a delta per update. Latency,
+    errors, stalls, sequence gaps and disconnects are injected at the
+    configured rates. Point settings.UPSTREAM_BASE_URLS and ORDERBOOK_STREAMS
+    at it.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8900, ws_port=8765, secrets=None, behaviour=None, **options):
+        super().__init__(host, port, secrets, **(behaviour or {}))
+        self.ws_port = ws_port
+        self.options = {**simulator_options(), **options}
+        self.rng = random.Random(self.options['seed'])
+        self.started_at = time.time()
+
+        self.bybit_mid = float(self.options['bybit_price'])
+        self.exchange_rate = float(self.options['exchange_rate'])
+        self.premium = float(self.options['premium'])
+        self.books = {
+            venue: SimulatedBook(mid, LEVEL_SPACING[venue], self.options['depth'], self.rng, self.options['churn'])
+            for venue, mid in self._mids()
+        }
+        self.stats = {
+            venue: {'open': mid, 'high': mid, 'low': mid, 'last': mid,
+                    'volume': DAILY_VOLUMES[venue], 'turnover': DAILY_VOLUMES[venue] * mid}
+            for venue, mid in self._mids()
+        }
+
+        self.routes = {
+            services.BYBIT_TICKER_ENDPOINT: self._bybit_tickers,
+            services.BYBIT_ORDERBOOK_ENDPOINT: self._bybit_orderbook,
+            services.BYBIT_KLINE_ENDPOINT: self._bybit_kline,
+            services.VALR_MARKET_SUMMARY_ENDPOINT: self._valr_summary,
+            venues.VALR_MARKET_SUMMARY_ENDPOINT: lambda query: [self._valr_summary(query)],
+            services.VALR_ORDERBOOK_ENDPOINT: self._valr_orderbook,
+            services.EXCHANGE_RATE_ENDPOINT: self._exchange_rate,
+        }
+        # Encoded REST responses for the current update, so load on the simulator stays cheap
+        self._rendered = {}
+        self._market_lock = threading.Lock()
+        self._subscribers = {venue: {} for venue in self.books}  # websocket -> sequence of its snapshot, or backlog
+        self._stopped = threading.Event()
+        self._loop = None
+        self._ws_stopped = None
+        self._websockets = None
+
+    def start(self):
+        """Serve REST and (with ws_port set) websockets from daemon threads and start updating the books"""
+        address = super().start()
+        threading.Thread(target=self._run, name='simulator-updates', daemon=True).start()
+        if self.ws_port is not None:
+            threading.Thread(target=asyncio.run, args=(self._serve_websockets(),), name='simulator-ws', daemon=True).start()
+        return address
+
+    def serve_forever(self):
+        self.start()
+        self._stopped.wait()
+
+    def stop(self):
+        self._stopped.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._ws_stopped.set)
+        super().stop()
+
+    def step(self):
+        """Advance the market by one update; returns {venue: (sequence, changed levels)}"""
+        options = self.options
+        with self._market_lock:
+            self.bybit_mid *= math.exp(self.rng.gauss(0, options['volatility']))
+            self.exchange_rate *= math.exp(self.rng.gauss(0, options['volatility'] / 10))  # FX moves far slower
+            self.premium += PREMIUM_REVERSION * (options['premium'] - self.premium)
+            self.premium += self.rng.gauss(0, options['premium_volatility'])
+
+            updates = {}
+            for venue, mid in self._mids():
+                book = self.books[venue]
+                changes = book.update(mid)
+                updates[venue] = (book.sequence, changes)
+                self._trade(venue, mid)
+            self._rendered.clear()
+        return updates
+
+    # MockExchange hooks
+
+    def venue(self, path):
+        return 'fx' if path == services.EXCHANGE_RATE_ENDPOINT else super().venue(path)
+
+    def delay(self, venue):
+        if venue in self.behaviour:
+            super().delay(venue)
+        options = self.options
+        if options['stall_rate'] and self.rng.random() < options['stall_rate']:
+            time.sleep(options['stall'])
+        elif options['latency'] or options['jitter']:
+            time.sleep(options['latency'] + self.rng.uniform(0, options['jitter']))
+
+    def public(self, venue, verb, url):
+        route = self.routes.get(url.path)
+        if route is None or verb != 'GET':
+            return super().public(venue, verb, url)
+        if self.options['error_rate'] and self.rng.random() < self.options['error_rate']:
+            return INJECTED_ERRORS[venue]
+
+        key = (url.path, url.query)
+        with self._market_lock:
+            body = self._rendered.get(key)
+            if body is None:
+                body = self._rendered[key] = codec.dumps(route(parse_qs(url.query)))
+        return 200, body
+
+    def fill_price(self, venue, side, quantity):
+        with self._market_lock:
+            return self.books[venue].average_price(ASKS if side == 'buy' else BIDS, quantity)
+
+    # REST payloads, built under the market lock
+
+    def _bybit_tickers(self, query):
+        symbol = query.get('symbol', ['BTCUSDT'])[0]
+        if symbol != 'BTCUSDT':
+            return _bybit_unknown_symbol()
+        book, stats = self.books['bybit'], self.stats['bybit']
+        return _bybit_result({'category': 'spot', 'list': [{
+            'symbol': 'BTCUSDT',
+            'bid1Price': book.price(book.best(BIDS)),
+            'bid1Size': book.quantity(book.levels[BIDS][book.best(BIDS)]),
+            'ask1Price': book.price(book.best(ASKS)),
+            'ask1Size': book.quantity(book.levels[ASKS][book.best(ASKS)]),
+            'lastPrice': f"{stats['last']:.2f}",
+            'prevPrice24h': f"{stats['open']:.2f}",
+            'price24hPcnt': f"{stats['last'] / stats['open'] - 1:.4f}",
+            'highPrice24h': f"{stats['high']:.2f}",
+            'lowPrice24h': f"{stats['low']:.2f}",
+            'turnover24h': f"{stats['turnover']:.8f}",
+            'volume24h': f"{stats['volume']:.8f}",
+        }]})
+
+    def _bybit_orderbook(self, query):
+        if query.get('symbol', ['BTCUSDT'])[0] != 'BTCUSDT':
+            return _bybit_unknown_symbol()
+        limit = int(query.get('limit', ['1'])[0])
+        book = self.books['bybit']
+        return _bybit_result({
+            's': 'BTCUSDT',
+            'b': self._bybit_levels(book, BIDS, limit),
+            'a': self._bybit_levels(book, ASKS, limit),
+            'ts': _milliseconds(),
+            'u': book.sequence,
+            'seq': book.sequence,
+        })
+
+    def _bybit_kline(self, query):
+        if query.get('symbol', ['BTCUSDT'])[0] != 'BTCUSDT':
+            return _bybit_unknown_symbol()
+        stats = self.stats['bybit']
+        day = int(self.started_at // 86400 * 86400 * 1000)
+        return _bybit_result({'category': 'spot', 'symbol': 'BTCUSDT', 'list': [[
+            str(day), f"{stats['open']:.2f}", f"{stats['high']:.2f}", f"{stats['low']:.2f}", f"{stats['last']:.2f}",
+            f"{stats['volume']:.8f}", f"{stats['turnover']:.8f}",
+        ]]})
+
+    def _valr_summary(self, query):
+        book, stats = self.books['valr'], self.stats['valr']
+        return {
+            'currencyPair': VALR_ORDERBOOK_PAIR,
+            'askPrice': book.price(book.best(ASKS)),
+            'bidPrice': book.price(book.best(BIDS)),
+            'lastTradedPrice': f"{stats['last']:.0f}",
+            'previousClosePrice': f"{stats['open']:.0f}",
+            'baseVolume': f"{stats['volume']:.8f}",
+            'quoteVolume': f"{stats['turnover']:.2f}",
+            'highPrice': f"{stats['high']:.0f}",
+            'lowPrice': f"{stats['low']:.0f}",
+            'created': _iso_now(),
+            'changeFromPrevious': f"{(stats['last'] / stats['open'] - 1) * 100:.2f}",
+        }
+
+    def _valr_orderbook(self, query):
+        book = self.books['valr']
+        return {
+            'Asks': self._valr_levels(book, ASKS, 'sell'),
+            'Bids': self._valr_levels(book, BIDS, 'buy'),
+            'LastChange': _iso_now(),
+            'SequenceNumber': book.sequence,
+        }
+
+    def _exchange_rate(self, query):
+        return {
+            'result': 'success',
+            'base_code': 'USD',
+            'time_last_update_unix': int(time.time()),
+            'rates': {'USD': 1, 'ZAR': round(self.exchange_rate, 4)},
+        }
+
+    @staticmethod
+    def _bybit_levels(book, side, limit=None):
+        return [[book.price(tick), book.quantity(book.levels[side][tick])] for tick in book.ticks(side, limit)]
+
+    @staticmethod
+    def _valr_levels(book, side, order_side):
+        return [
+            {'side': order_side, 'quantity': book.quantity(book.levels[side][tick]), 'price': book.price(tick),
+             'currencyPair': VALR_ORDERBOOK_PAIR, 'orderCount': 1}
+            for tick in book.ticks(side)
+        ]
+
+    # Websocket feeds
+
+    async def _serve_websockets(self):
+        import websockets  # optional dependency, only needed for the websocket feeds
+
+        self._websockets = websockets
+        self._ws_stopped = asyncio.Event()
+        async with websockets.serve(self._ws_handler, self.host, self.ws_port):
+            self._loop = asyncio.get_running_loop()
+            logger.info(f"Streaming simulated order books on ws://{self.host}:{self.ws_port}/<venue>")
+            await self._ws_stopped.wait()
+
+    async def _ws_handler(self, websocket, path=None):
+        # websockets >= 13 exposes the path on the request instead of passing it in
+        if path is None:
+            path = websocket.request.path
+        venue = path.strip('/')
+        if venue not in self.books:
+            logger.warning(f"No simulated feed for venue {venue!r}")
+            await websocket.close()
+            return
+
+        subscribers = self._subscribers[venue]
+        try:
+            async for raw in websocket:
+                message = json.loads(raw)
+                if venue == 'bybit' and message.get('op') in ('subscribe', 'ping'):
+                    await websocket.send(json.dumps({
+                        'success': True, 'ret_msg': 'pong' if message['op'] == 'ping' else '', 'op': message['op'],
+                    }))
+                elif venue == 'valr' and message.get('type') == 'PING':
+                    await websocket.send(json.dumps({'type': 'PONG'}))
+
+                subscribing = message.get('op') == 'subscribe' or message.get('type') == 'SUBSCRIBE'
+                if subscribing and websocket not in subscribers:
+                    with self._market_lock:
+                        book = self.books[venue]
+                        sequence = book.sequence
+                        changes = {
+                            side: {tick: book.levels[side][tick] for tick in book.ticks(side)} for side in (BIDS, ASKS)
+                        }
+                    # Deltas published while the snapshot goes out are held back until it has
+                    backlog = subscribers[websocket] = []
+                    await websocket.send(self._feed_message(venue, 'snapshot', sequence, changes))
+                    for delta_sequence, delta in backlog:
+                        if delta_sequence > sequence:
+                            await websocket.send(delta)
+                    subscribers[websocket] = sequence
+        finally:
+            subscribers.pop(websocket, None)
+
+    def _feed_message(self, venue, kind, sequence, changes):
+        book = self.books[venue]
+        if venue == 'bybit':
+            timestamp = _milliseconds()
+            return codec.dumps({
+                'topic': BYBIT_ORDERBOOK_TOPIC,
+                'type': kind,
+                'ts': timestamp,
+                'data': {
+                    's': 'BTCUSDT',
+                    'b': [[book.price(tick), book.quantity(quantity)] for tick, quantity in changes[BIDS].items()],
+                    'a': [[book.price(tick), book.quantity(quantity)] for tick, quantity in changes[ASKS].items()],
+                    'u': sequence,
+                    'seq': sequence,
+                },
+                'cts': timestamp,
+            }).decode()
+
+        def levels(side):
+            # A level with no orders left has been removed
+            return [
+                {'Price': book.price(tick),
+                 'Orders': [{'orderId': f'sim-{tick}', 'quantity': book.quantity(quantity)}] if quantity else []}
+                for tick, quantity in changes[side].items()
+            ]
+
+        return codec.dumps({
+            'type': 'FULL_ORDERBOOK_SNAPSHOT' if kind == 'snapshot' else 'FULL_ORDERBOOK_UPDATE',
+            'currencyPairSymbol': VALR_ORDERBOOK_PAIR,
+            'data': {'Asks': levels(ASKS), 'Bids': levels(BIDS), 'SequenceNumber': sequence, 'LastChange': _iso_now()},
+        }).decode()
+
+    def _publish(self, messages):
+        """Send each venue's delta to the subscribers whose snapshot predates it (runs on the websocket loop)"""
+        options = self.options
+        for venue, (sequence, raw) in messages.items():
+            subscribers = self._subscribers[venue]
+            if options['gap_rate'] and self.rng.random() < options['gap_rate']:
+                continue  # lost; subscribers see the gap at the next delta and resync
+            live = []
+            for websocket, since in subscribers.items():
+                if isinstance(since, list):
+                    since.append((sequence, raw))  # still sending its snapshot
+                elif since < sequence:
+                    live.append(websocket)
+            self._websockets.broadcast(live, raw)
+            if options['disconnect_rate']:
+                for websocket in list(subscribers):
+                    if self.rng.random() < options['disconnect_rate']:
+                        del subscribers[websocket]
+                        asyncio.ensure_future(websocket.close(1011, 'simulated disconnect'))
+
+    # Updates
+
+    def _run(self):
+        while not self._stopped.wait(self.options['update_interval']):
+            updates = self.step()
+            if self._loop is None or not any(self._subscribers.values()):
+                continue
+            messages = {
+                venue: (sequence, self._feed_message(venue, 'delta', sequence, changes))
+                for venue, (sequence, changes) in updates.items() if self._subscribers[venue]
+            }
+            self._loop.call_soon_threadsafe(self._publish, messages)
+
+    def _mids(self):
+        yield 'bybit', self.bybit_mid
+        yield 'valr', self.bybit_mid * self.exchange_rate * (1 + self.premium)
+
+    def _trade(self, venue, mid):
+        """Book a trade at the mid sized so volume accrues at about the venue's daily rate"""
+        stats = self.stats[venue]
+        quantity = self.rng.expovariate(86400 / (DAILY_VOLUMES[venue] * self.options['update_interval']))
+        stats['last'] = mid
+        stats['high'] = max(stats['high'], mid)
+        stats['low'] = min(stats['low'], mid)
+        stats['volume'] += quantity
+        stats['turnover'] += quantity * mid
+
+
+def _bybit_result(result):
+    return {'retCode': 0, 'retMsg': 'OK', 'result': result, 'retExtInfo': {}, 'time': _milliseconds()}
+
+def _bybit_unknown_symbol():
+    return {'retCode': 10001, 'retMsg': 'Not supported symbols', 'result': {}, 'retExtInfo': {}, 'time': _milliseconds()}
+
+def _milliseconds():
+    return int(time.time() * 1000)
+
+def _iso_now():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
@@ -0,0 +1,48 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+LATEST_SNAPSHOT_KEY = 'bot:snapshot:latest'
+# (version, fetched_at) of the latest snapshot, so freshness checks don't load the books
+LATEST_VERSION_KEY = 'bot:snapshot:latest-version'
+
+def _store():
+    return caches[getattr(settings, 'SNAPSHOT_CACHE_ALIAS', 'default')]
+
+def publish_snapshot(snapshot):
+    """Publish a snapshot as the latest one for every worker to serve"""
+    # Millisecond wall-clock versions stay increasing across ingestor restarts
+    snapshot.version = time.time_ns() // 1_000_000
+    _store().set_many({
+        LATEST_SNAPSHOT_KEY: snapshot,
+        LATEST_VERSION_KEY: (snapshot.version, snapshot.fetched_at),
+    }, timeout=None)
+    return snapshot.version
+
+def latest_snapshot(max_age=None):
+    """Return the latest published snapshot, or None if there is none or it is older than max_age seconds"""
+    snapshot = _store().get(LATEST_SNAPSHOT_KEY)
+    if snapshot is None:
+        return None
+
+    if max_age is not None and time.time() - snapshot.fetched_at > max_age:
+        logger.warning(f"Latest snapshot v{snapshot.version} is older than {max_age}s, ignoring it")
+        return None
+
+    return snapshot
+
+def latest_version(max_age=None):
+    """Version of the latest published snapshot, or None if there is none or it is older than max_age seconds"""
+    entry = _store().get(LATEST_VERSION_KEY)
+    if entry is None:
+        return None
+
+    version, fetched_at = entry
+    if max_age is not None and time.time() - fetched_at > max_age:
+        return None
+
+    return version
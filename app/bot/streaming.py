@@ -0,0 +1,299 @@
+import asyncio
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+from decimal import Decimal
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+from bot import codec
+from bot.orderbook import OrderBook
+
+logger = logging.getLogger(__name__)
+
+# Public websocket feeds; override via settings.ORDERBOOK_STREAMS (e.g. to point at the replay server)
+DEFAULT_STREAM_URLS = {
+    'bybit': 'wss://stream.bybit.com/v5/public/spot',
+    'valr': 'wss://api.valr.com/ws/trade',
+}
+
+BYBIT_ORDERBOOK_TOPIC = 'orderbook.50.BTCUSDT'
+VALR_ORDERBOOK_PAIR = 'BTCZAR'
+
+# Seconds between application-level pings, and the reconnect backoff cap
+PING_INTERVAL = 20
+MAX_RECONNECT_DELAY = 30
+
+BIDS = 'bids'
+ASKS = 'asks'
+
+
+class SequenceGapError(Exception):
+    """Raised when a delta does not follow the book's last applied sequence number"""
+
+
+class L2Book:
+    """Price-level order book maintained from a snapshot plus sequenced deltas.
+
+    Each side keeps a price -> quantity dict and a best-first sorted key list
+    (bids are stored negated) so ``top_n`` is a slice rather than a sort.
+    """
+
+    def __init__(self, venue, symbol):
+        self.venue = venue
+        self.symbol = symbol
+        self.sequence = None
+        self.synced = False
+        self.updated_at = None
+        self.last_changes = None  # prices touched by the last delta per side, None after a snapshot
+        self._levels = {BIDS: {}, ASKS: {}}
+        self._keys = {BIDS: [], ASKS: []}
+        self._lock = threading.Lock()
+
+    def apply_snapshot(self, bids, asks, sequence):
+        """Replace the whole book; bids/asks are iterables of (price, quantity)"""
+        with self._lock:
+            for side, levels in ((BIDS, bids), (ASKS, asks)):
+                self._levels[side] = {}
+                self._keys[side] = []
+                for price, quantity in levels:
+                    self._set_level(side, price, quantity)
+            self.sequence = sequence
+            self.synced = True
+            self.updated_at = time.time()
+            self.last_changes = None
+
+    def apply_delta(self, bids, asks, sequence):
+        """Apply changed levels (quantity 0 removes a level), checking for a sequence gap"""
+        with self._lock:
+            if not self.synced:
+                raise SequenceGapError(f"{self.venue} book is not synced")
+            if sequence != self.sequence + 1:
+                self.synced = False
+                raise SequenceGapError(f"{self.venue} expected sequence {self.sequence + 1}, got {sequence}")
+
+            changes = {BIDS: [], ASKS: []}
+            for side, levels in ((BIDS, bids), (ASKS, asks)):
+                for price, quantity in levels:
+                    changes[side].append(self._set_level(side, price, quantity))
+            self.sequence = sequence
+            self.updated_at = time.time()
+            self.last_changes = changes
+
+    def top_n(self, side, n=None):
+        """Best n levels of a side as (price, quantity) tuples, best first"""
+        with self._lock:
+            keys = self._keys[side][:n]
+            levels = self._levels[side]
+            if side == BIDS:
+                return [(-key, levels[-key]) for key in keys]
+            return [(key, levels[key]) for key in keys]
+
+    # Unlocked accessors for code running on the stream's own thread (e.g. listeners)
+    def size(self, side):
+        return len(self._keys[side])
+
+    def level(self, side, index):
+        """(price, quantity) of the level at a 0-based rank from the best price"""
+        key = self._keys[side][index]
+        price = -key if side == BIDS else key
+        return price, self._levels[side][price]
+
+    def rank(self, side, price):
+        """Rank a price has (or had, if just removed) on a side"""
+        return bisect.bisect_left(self._keys[side], -price if side == BIDS else price)
+
+    def as_orderbook(self, depth=None, currency=None):
+        """Compact OrderBook copy of the best levels, as the REST orderbook fetchers return"""
+        if not self.synced:
+            return None
+        return OrderBook.from_levels(self.top_n(BIDS, depth), self.top_n(ASKS, depth), currency)
+
+    def _set_level(self, side, price, quantity):
+        price, quantity = Decimal(price), Decimal(quantity)
+        levels, keys = self._levels[side], self._keys[side]
+        key = -price if side == BIDS else price
+
+        if quantity == 0:
+            if levels.pop(price, None) is not None:
+                del keys[bisect.bisect_left(keys, key)]
+            return price
+
+        if price not in levels:
+            bisect.insort(keys, key)
+        levels[price] = quantity
+        return price
+
+
+class OrderBookStream:
+    """Websocket subscriber that keeps an L2Book in sync, reconnecting (and so resyncing) on errors or gaps"""
+    venue = None
+    symbol = None
+    currency = None
+
+    def __init__(self, url=None, record_to=None):
+        self.url = url or getattr(settings, 'ORDERBOOK_STREAMS', {}).get(self.venue) or DEFAULT_STREAM_URLS[self.venue]
+        self.book = L2Book(self.venue, self.symbol)
+        self.listeners = []
+        self.record_to = record_to
+        self._started = time.monotonic()
+
+    def add_listener(self, callback):
+        """Register callback(book) to run after every applied snapshot or delta"""
+        self.listeners.append(callback)
+
+    async def run(self):
+        """Stream forever, reconnecting with jittered exponential backoff"""
+        import websockets  # optional dependency, only needed in streaming mode
+
+        attempt = 0
+        while True:
+            try:
+                # websockets >= 14 renamed extra_headers to additional_headers
+                headers_kwarg = 'additional_headers' if int(websockets.__version__.split('.')[0]) >= 14 else 'extra_headers'
+                connect_kwargs = {headers_kwarg: self.connect_headers()}
+                async with websockets.connect(self.url, ping_interval=None, **connect_kwargs) as ws:
+                    await ws.send(json.dumps(self.subscribe_message()))
+                    logger.info(f"Subscribed to {self.venue} order book at {self.url}")
+                    attempt = 0
+                    pinger = asyncio.ensure_future(self._ping(ws))
+                    try:
+                        async for raw in ws:
+                            self._record(raw)
+                            if self.handle_message(codec.loads(raw)):
+                                for callback in self.listeners:
+                                    callback(self.book)
+                    finally:
+                        pinger.cancel()
+            except SequenceGapError as e:
+                logger.warning(f"{e}, resyncing")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.venue} order book stream failed: {e}")
+
+            self.book.synced = False
+            delay = min(MAX_RECONNECT_DELAY, 2 ** attempt) * random.uniform(0.5, 1)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def connect_headers(self):
+        """Extra headers for the websocket handshake"""
+        return {}
+
+    def subscribe_message(self):
+        raise NotImplementedError
+
+    def ping_message(self):
+        raise NotImplementedError
+
+    def handle_message(self, message):
+        """Apply a decoded message to the book, returning True if the book changed"""
+        raise NotImplementedError
+
+    async def _ping(self, ws):
+        while True:
+            await asyncio.sleep(PING_INTERVAL)
+            await ws.send(json.dumps(self.ping_message()))
+
+    def _record(self, raw):
+        if self.record_to is not None:
+            line = {'t': time.monotonic() - self._started, 'venue': self.venue, 'message': raw}
+            self.record_to.write(json.dumps(line) + '\n')
+
+
+class BybitOrderBookStream(OrderBookStream):
+    """ByBit v5 public spot orderbook.50 stream"""
+    venue = 'bybit'
+    symbol = 'BTCUSDT'
+    currency = 'USD'
+
+    def subscribe_message(self):
+        return {'op': 'subscribe', 'args': [BYBIT_ORDERBOOK_TOPIC]}
+
+    def ping_message(self):
+        return {'op': 'ping'}
+
+    def handle_message(self, message):
+        if message.get('topic') != BYBIT_ORDERBOOK_TOPIC:
+            return False  # subscription acks and pongs
+
+        data = message['data']
+        # u == 1 is a fresh snapshot after a ByBit service restart
+        if message['type'] == 'snapshot' or data['u'] == 1:
+            self.book.apply_snapshot(data['b'], data['a'], data['u'])
+        else:
+            self.book.apply_delta(data['b'], data['a'], data['u'])
+        return True
+
+
+class ValrOrderBookStream(OrderBookStream):
+    """Valr FULL_ORDERBOOK_UPDATE stream (order-level, aggregated here to price levels)"""
+    venue = 'valr'
+    symbol = VALR_ORDERBOOK_PAIR
+    currency = 'ZAR'
+
+    def __init__(self, url=None, record_to=None, api_key=None, api_secret=None):
+        super().__init__(url, record_to)
+        credentials = getattr(settings, 'EXECUTION', {}).get('valr', {})
+        self.api_key = credentials.get('api_key', '') if api_key is None else api_key
+        self.api_secret = credentials.get('api_secret', '') if api_secret is None else api_secret
+
+    @property
+    def requires_auth(self):
+        """Valr only serves /ws/trade to signed connections; the local ws:// replay and simulator feeds are open"""
+        return self.url.startswith('wss://')
+
+    @property
+    def can_connect(self):
+        return not self.requires_auth or bool(self.api_key and self.api_secret)
+
+    def connect_headers(self):
+        if not self.requires_auth:
+            return {}
+        from bot.execution import valr_auth_headers  # pulls in the trading clients, only needed here
+
+        return valr_auth_headers(self.api_key, self.api_secret.encode(), 'GET', urlparse(self.url).path)
+
+    def subscribe_message(self):
+        return {
+            'type': 'SUBSCRIBE',
+            'subscriptions': [{'event': 'FULL_ORDERBOOK_UPDATE', 'pairs': [VALR_ORDERBOOK_PAIR]}]
+        }
+
+    def ping_message(self):
+        return {'type': 'PING'}
+
+    def handle_message(self, message):
+        message_type = message.get('type')
+        if message_type not in ('FULL_ORDERBOOK_SNAPSHOT', 'FULL_ORDERBOOK_UPDATE'):
+            return False
+
+        data = message['data']
+        bids = [self._level(level) for level in data.get('Bids', [])]
+        asks = [self._level(level) for level in data.get('Asks', [])]
+
+        if message_type == 'FULL_ORDERBOOK_SNAPSHOT':
+            self.book.apply_snapshot(bids, asks, data['SequenceNumber'])
+        else:
+            self.book.apply_delta(bids, asks, data['SequenceNumber'])
+        return True
+
+    def _level(self, level):
+        # A level with no orders left has been removed
+        quantity = sum((Decimal(order['quantity']) for order in level.get('Orders', [])), Decimal('0'))
+        return level['Price'], quantity
+
+
+def start_streams(streams):
+    """Run the given streams on an event loop in a daemon thread, returning the thread"""
+    async def run_all():
+        await asyncio.gather(*(stream.run() for stream in streams))
+
+    thread = threading.Thread(target=asyncio.run, args=(run_all(),), name='orderbook-streams', daemon=True)
+    thread.start()
+    return thread
@@ -1,3 +1,1753 @@
-from django.test import TestCase
+import asyncio
+import dataclasses
+import io
+import json
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+try:
+    import httpx  # optional, for the async clients
+except ImportError:
+    httpx = None
+
+import requests
+from django.core.cache import caches
+from django.core.management import call_command
+from django.http import HttpResponse, JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from bot import codec, matching, metrics, services, store, upstream, venues, views
+from bot.alerts import AlertEvaluator, CompiledRule
+from bot.backtest import run_backtest
+from bot.benchmarks import drive_load, pipeline_targets, simulating
+from bot.broadcast import SnapshotBroadcaster
+from bot.cache import ReferenceCache
+from bot.clients import AsyncExchangeClient, CircuitBreaker, CircuitOpenError, ExchangeClient, RateLimitedError, retry_after
+from bot.execution import BybitTrader, ExecutionEngine, ValrTrader, find_opportunity
+from bot.history import downsample
+from bot.management.commands import ingest_market_data
+from bot.mock_exchange import MockExchange
+from bot.models import AlertRule, MarketSnapshotRecord, Trade, TradeLevel
+from bot.orderbook import OrderBook, parse_fixed
+from bot.persistence import TradeWriter
+from bot.ratelimit import ENDPOINT_PRIORITIES, HIGH, LOW, RateLimiter, TokenBucket
+from bot.recording import Recording, RecordingWriter
+from bot.replay import ReplayServer, load_recording
+from bot.services import MarketSnapshot
+from bot.streaming import ASKS, BIDS, BybitOrderBookStream, L2Book, SequenceGapError, ValrOrderBookStream
+from bot.trades import decode_cursor, encode_cursor, trade_page
+
+
+def bybit_message(kind, sequence, bids=(), asks=()):
+    return json.dumps({
+        'topic': 'orderbook.50.BTCUSDT',
+        'type': kind,
+        'data': {'s': 'BTCUSDT', 'b': [list(level) for level in bids], 'a': [list(level) for level in asks],
+                 'u': sequence},
+    })
+
+
+def valr_message(kind, sequence, bids=(), asks=()):
+    def levels(side):
+        return [{'Price': price, 'Orders': [{'quantity': quantity}] if quantity != '0' else []}
+                for price, quantity in side]
+
+    return json.dumps({
+        'type': kind,
+        'data': {'Bids': levels(bids), 'Asks': levels(asks), 'SequenceNumber': sequence},
+    })
+
+
+# A ByBit session as OrderBookStream records it: a snapshot, two deltas, a gap
+# (sequence 13 is missing) and the snapshot the exchange sends after reconnecting
+BYBIT_RECORDING = [
+    bybit_message('snapshot', 10, bids=[('100.0', '1'), ('99.5', '2')], asks=[('100.5', '1'), ('101.0', '3')]),
+    bybit_message('delta', 11, bids=[('100.0', '0'), ('99.8', '4')]),
+    bybit_message('delta', 12, asks=[('100.4', '0.5')]),
+    bybit_message('delta', 14, asks=[('100.3', '1')]),
+    bybit_message('snapshot', 20, bids=[('98.0', '1')], asks=[('102.0', '1')]),
+    bybit_message('delta', 21, bids=[('98.5', '2')]),
+]
+
+VALR_RECORDING = [
+    valr_message('FULL_ORDERBOOK_SNAPSHOT', 1, bids=[('1800000', '0.5')], asks=[('1810000', '0.25')]),
+    valr_message('FULL_ORDERBOOK_UPDATE', 2, bids=[('1800000', '0'), ('1795000', '1')]),
+]
+
+
+def replay_into(stream, messages):
+    """Feed recorded messages through a stream as its run loop does, counting sequence gaps"""
+    gaps = 0
+    for raw in messages:
+        try:
+            stream.handle_message(codec.loads(raw))
+        except SequenceGapError:
+            gaps += 1
+    return gaps
+
+
+class CodecTests(SimpleTestCase):
+    def test_bybit_orderbook_decoding(self):
+        for name in codec.AVAILABLE_CODECS:
+            with self.subTest(codec=name):
+                decoder = codec.CODECS[name]()
+                book = decoder.decode_bybit_orderbook(
+                    b'{"retCode":0,"retMsg":"OK","result":{"s":"BTCUSDT","b":[["62000","1.5"]],"a":[["62001","2"]],"ts":1}}'
+                )
+                self.assertEqual(list(book.bids), [(Decimal('62000'), Decimal('1.5'))])
+                self.assertEqual(book.asks.depth(), Decimal('2'))
+
+                # Errors come with an empty result object
+                self.assertIsNone(decoder.decode_bybit_orderbook(b'{"retCode":10001,"retMsg":"bad","result":{}}'))
+                self.assertEqual(len(decoder.decode_bybit_orderbook(b'{"retCode":0,"result":{}}').bids), 0)
+
+
+class L2BookTests(SimpleTestCase):
+    def test_snapshot_then_deltas(self):
+        book = L2Book('bybit', 'BTCUSDT')
+        book.apply_snapshot([('100', '1'), ('99', '2')], [('101', '1'), ('102', '2')], 1)
+        book.apply_delta([('100', '0'), ('99.5', '3')], [('100.5', '1')], 2)
+
+        self.assertEqual(book.top_n(BIDS), [(Decimal('99.5'), Decimal('3')), (Decimal('99'), Decimal('2'))])
+        self.assertEqual(book.top_n(ASKS, 2), [(Decimal('100.5'), Decimal('1')), (Decimal('101'), Decimal('1'))])
+        self.assertEqual(book.sequence, 2)
+        self.assertEqual(book.last_changes, {BIDS: [Decimal('100'), Decimal('99.5')], ASKS: [Decimal('100.5')]})
+
+    def test_gap_unsyncs_until_the_next_snapshot(self):
+        book = L2Book('bybit', 'BTCUSDT')
+        book.apply_snapshot([('100', '1')], [('101', '1')], 1)
+
+        with self.assertRaises(SequenceGapError):
+            book.apply_delta([], [('101', '2')], 3)
+        self.assertFalse(book.synced)
+        self.assertIsNone(book.as_orderbook())
+        # The gapped delta was not applied, and nothing applies until a resync
+        self.assertEqual(book.top_n(ASKS), [(Decimal('101'), Decimal('1'))])
+        with self.assertRaises(SequenceGapError):
+            book.apply_delta([], [], 2)
+
+        book.apply_snapshot([('99', '1')], [('100', '1')], 7)
+        book.apply_delta([('99', '2')], [], 8)
+        self.assertTrue(book.synced)
+        self.assertEqual(book.top_n(BIDS), [(Decimal('99'), Decimal('2'))])
+
+    def test_rank_and_level(self):
+        book = L2Book('valr', 'BTCZAR')
+        book.apply_snapshot([('10', '1'), ('12', '1'), ('11', '1')], [('13', '1'), ('15', '1')], 1)
+
+        self.assertEqual(book.level(BIDS, 0), (Decimal('12'), Decimal('1')))
+        self.assertEqual(book.rank(BIDS, Decimal('11')), 1)
+        self.assertEqual(book.rank(ASKS, Decimal('14')), 1)
+        self.assertEqual(book.size(ASKS), 2)
+
+
+class OrderBookStreamTests(SimpleTestCase):
+    def test_bybit_recording_resyncs_after_a_gap(self):
+        stream = BybitOrderBookStream(url='ws://127.0.0.1:8765/bybit')
+        self.assertEqual(replay_into(stream, BYBIT_RECORDING[:3]), 0)
+        self.assertEqual(stream.book.top_n(BIDS, 1), [(Decimal('99.8'), Decimal('4'))])
+        self.assertEqual(stream.book.top_n(ASKS, 1), [(Decimal('100.4'), Decimal('0.5'))])
+
+        self.assertEqual(replay_into(stream, BYBIT_RECORDING[3:4]), 1)
+        self.assertFalse(stream.book.synced)
+
+        self.assertEqual(replay_into(stream, BYBIT_RECORDING[4:]), 0)
+        self.assertTrue(stream.book.synced)
+        self.assertEqual(stream.book.sequence, 21)
+        orderbook = stream.book.as_orderbook(currency='USD')
+        self.assertEqual(orderbook.bids[0], (Decimal('98.5'), Decimal('2')))
+        self.assertEqual(orderbook.asks[0], (Decimal('102.0'), Decimal('1')))
+
+    def test_bybit_restart_snapshot(self):
+        # u == 1 on a delta means ByBit restarted and is sending a fresh book
+        stream = BybitOrderBookStream(url='ws://127.0.0.1:8765/bybit')
+        replay_into(stream, BYBIT_RECORDING[:1])
+        replay_into(stream, [bybit_message('delta', 1, bids=[('50', '1')], asks=[('51', '1')])])
+        self.assertEqual(stream.book.top_n(BIDS), [(Decimal('50'), Decimal('1'))])
+
+    def test_valr_levels_are_aggregated_from_orders(self):
+        stream = ValrOrderBookStream(url='ws://127.0.0.1:8765/valr')
+        raw = valr_message('FULL_ORDERBOOK_SNAPSHOT', 5, asks=[('1810000', '0.25')])
+        message = json.loads(raw)
+        message['data']['Asks'][0]['Orders'].append({'quantity': '0.5'})
+        stream.handle_message(message)
+        self.assertEqual(stream.book.top_n(ASKS), [(Decimal('1810000'), Decimal('0.75'))])
+
+        self.assertEqual(replay_into(stream, VALR_RECORDING), 0)
+        self.assertEqual(stream.book.top_n(BIDS), [(Decimal('1795000'), Decimal('1'))])
+
+    def test_ignores_acks_and_pongs(self):
+        stream = ValrOrderBookStream(url='ws://127.0.0.1:8765/valr')
+        self.assertFalse(stream.handle_message({'type': 'PONG'}))
+        self.assertFalse(BybitOrderBookStream(url='ws://x').handle_message({'op': 'pong', 'success': True}))
+
+    def test_record_round_trips_through_load_recording(self):
+        record_to = io.StringIO()
+        stream = BybitOrderBookStream(url='ws://127.0.0.1:8765/bybit', record_to=record_to)
+        for raw in BYBIT_RECORDING:
+            stream._record(raw)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write(record_to.getvalue())
+        self.addCleanup(os.remove, f.name)
+
+        recording = load_recording(f.name)
+        self.assertEqual([raw for _, raw in recording['bybit']], BYBIT_RECORDING)
+
+    def test_valr_handshake_is_signed_for_the_exchange_only(self):
+        stream = ValrOrderBookStream(url='wss://api.valr.com/ws/trade', api_key='key', api_secret='secret')
+        self.assertTrue(stream.can_connect)
+        self.assertEqual(stream.connect_headers()['X-VALR-API-KEY'], 'key')
+        self.assertIn('X-VALR-SIGNATURE', stream.connect_headers())
+
+        self.assertFalse(ValrOrderBookStream(url='wss://api.valr.com/ws/trade', api_key='', api_secret='').can_connect)
+        local = ValrOrderBookStream(url='ws://127.0.0.1:8765/valr', api_key='', api_secret='')
+        self.assertTrue(local.can_connect)
+        self.assertEqual(local.connect_headers(), {})
+
+
+class FakeWebSocket:
+    """Just enough of a websockets server connection to drive ReplayServer.handler"""
+
+    def __init__(self, path):
+        self.path = path
+        self.sent = []
+        self.closed = False
+
+    async def recv(self):
+        return json.dumps({'op': 'subscribe'})
+
+    async def send(self, raw):
+        self.sent.append(raw)
+
+    async def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+class ReplayServerTests(SimpleTestCase):
+    def test_replays_a_venue_into_a_stream(self):
+        recording = {'bybit': [(i * 0.1, raw) for i, raw in enumerate(BYBIT_RECORDING)]}
+        server = ReplayServer(recording, speed=0)
+        websocket = FakeWebSocket('/bybit')
+        asyncio.run(server.handler(websocket, websocket.path))
+        self.assertEqual(websocket.sent, BYBIT_RECORDING)
+
+        stream = BybitOrderBookStream(url='ws://127.0.0.1:8765/bybit')
+        gaps = replay_into(stream, websocket.sent)
+        self.assertEqual(gaps, 1)
+        self.assertEqual(stream.book.sequence, 21)
+
+    def test_keeps_the_recorded_spacing(self):
+        recording = {'valr': [(0.0, VALR_RECORDING[0]), (0.5, VALR_RECORDING[1])]}
+        with mock.patch('bot.replay.asyncio.sleep', new=mock.AsyncMock()) as sleep:
+            asyncio.run(ReplayServer(recording, speed=2).handler(FakeWebSocket('/valr'), '/valr'))
+        self.assertEqual([call.args[0] for call in sleep.await_args_list], [0.0, 0.25])
+
+    def test_closes_unknown_venues(self):
+        websocket = FakeWebSocket('/kraken')
+        asyncio.run(ReplayServer({'bybit': []}).handler(websocket, websocket.path))
+        self.assertTrue(websocket.closed)
+        self.assertEqual(websocket.sent, [])
+
+
+class InlineTradeWriter(TradeWriter):
+    """TradeWriter that writes each record as it is enqueued, on the caller's thread and connection"""
+
+    def __init__(self, journal):
+        super().__init__(journal=journal)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def enqueue(self, trade, levels=None):
+        super().enqueue(trade, levels)
+        batch = list(self._pending)
+        self._pending.clear()
+        self.write(batch)
+
+
+class ExecutionEngineTests(TestCase):
+    def setUp(self):
+        self.exchange = MockExchange(port=0)
+        host, port = self.exchange.start()
+        self.addCleanup(self.exchange.stop)
+        self.base_url = f'http://{host}:{port}'
+
+        journal = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+        journal.close()
+        self.addCleanup(os.remove, journal.name)
+        self.writer = InlineTradeWriter(journal.name)
+        self.addCleanup(self.writer.close)
+
+        # ByBit bids 62000 USD against Valr asks of 1080000 ZAR (60000 USD at 18 ZAR/USD)
+        self.exchange.behaviour['bybit']['price'] = Decimal('62000')
+        self.snapshot = MarketSnapshot(
+            bybit_orderbook=OrderBook.from_levels([('62000', '1')], [('62100', '1')], 'USD'),
+            bybit_volume=Decimal('10'),
+            valr_orderbook=OrderBook.from_levels([('1070000', '1')], [('1080000', '1')], 'ZAR'),
+            valr_volume=Decimal('10'),
+            exchange_rate=Decimal('18'),
+        )
+
+    def engine(self, valr_secret='valr-secret', bybit_secret='bybit-secret'):
+        engine = ExecutionEngine(
+            ValrTrader(self.base_url, 'valr-key', valr_secret),
+            BybitTrader(self.base_url, 'bybit-key', bybit_secret),
+            writer=self.writer, fill_timeout=2, poll_interval=0.01,
+        )
+        self.addCleanup(engine.executor.shutdown)
+        return engine
+
+    def orders(self):
+        return sorted(self.exchange.orders.values(), key=lambda order: order['created_at'])
+
+    def test_signed_legs_fill_and_the_trade_is_persisted(self):
+        analysis = find_opportunity(self.snapshot)
+        self.assertEqual(analysis['tradable_volume'], Decimal('1'))
+
+        trade = self.engine().execute(self.snapshot, analysis, time.perf_counter())
+
+        legs = {order['venue']: order for order in self.orders()}
+        self.assertEqual(len(self.exchange.orders), 2)
+        self.assertEqual((legs['valr']['side'], legs['valr']['quantity']), ('buy', Decimal('1')))
+        self.assertEqual((legs['bybit']['side'], legs['bybit']['quantity']), ('sell', Decimal('1')))
+        self.assertEqual(legs['valr']['client_order_id'], f'b{trade.client_order_id}')
+        self.assertEqual(legs['bybit']['client_order_id'], f's{trade.client_order_id}')
+
+        stored = Trade.objects.get(client_order_id=trade.client_order_id)
+        self.assertEqual(stored.status, Trade.COMPLETED)
+        self.assertEqual(stored.valr_transaction_id, legs['valr']['id'])
+        self.assertEqual(stored.bybit_transaction_id, legs['bybit']['id'])
+        self.assertEqual(stored.btc_volume, Decimal('1'))
+        self.assertEqual(stored.profit_zar, Decimal('36000'))  # (62000 * 18 - 1080000) * 1 BTC
+        self.assertIsNotNone(stored.valr_ack_ms)
+        self.assertIsNone(stored.notes)
+        self.assertEqual(TradeLevel.objects.filter(trade=stored).count(), 1)
+
+    def test_badly_signed_leg_is_rejected_and_hedged(self):
+        analysis = find_opportunity(self.snapshot)
+        trade = self.engine(valr_secret='wrong-secret').execute(self.snapshot, analysis, time.perf_counter())
+
+        # Only ByBit accepted its order, so the BTC it sold is bought back there
+        orders = self.orders()
+        self.assertEqual([(order['venue'], order['side']) for order in orders], [('bybit', 'sell'), ('bybit', 'buy')])
+        self.assertEqual(orders[1]['client_order_id'], f'h{trade.client_order_id}')
+
+        stored = Trade.objects.get(client_order_id=trade.client_order_id)
+        self.assertEqual(stored.status, Trade.FAILED)
+        self.assertIsNone(stored.valr_transaction_id)
+        self.assertIn('invalid signature', stored.notes)
+        self.assertIn('Hedged buy 1.000000 BTC on bybit', stored.notes)
+
+    def test_partial_fill_is_flattened_on_the_overfilled_venue(self):
+        self.exchange.behaviour['bybit']['fill_ratio'] = Decimal('0.5')
+        analysis = find_opportunity(self.snapshot)
+        trade = self.engine().execute(self.snapshot, analysis, time.perf_counter())
+
+        hedge = self.orders()[-1]
+        self.assertEqual((hedge['venue'], hedge['side'], hedge['quantity']), ('valr', 'sell', Decimal('0.5')))
+        stored = Trade.objects.get(client_order_id=trade.client_order_id)
+        self.assertEqual(stored.status, Trade.FAILED)
+        self.assertEqual(stored.profit_zar, Decimal('18000'))  # on the 0.5 BTC both legs filled
+
+    def test_no_opportunity_against_the_traded_direction(self):
+        # Valr dearer than ByBit is a premium, but buying Valr to sell ByBit would lose
+        snapshot = dataclasses.replace(
+            self.snapshot, bybit_orderbook=OrderBook.from_levels([('58000', '1')], [('58100', '1')], 'USD'),
+        )
+        self.assertIsNone(find_opportunity(snapshot))
+
+
+def book_side(levels):
+    return OrderBook.from_levels(levels, [], 'USD').bids
+
+
+class OrderBookTests(SimpleTestCase):
+    def test_parse_fixed_truncates_to_the_scale(self):
+        self.assertEqual(parse_fixed('1.5', 8), 150000000)
+        self.assertEqual(parse_fixed('0.123456789', 8), 12345678)
+        self.assertEqual(parse_fixed('.25', 2), 25)
+        self.assertEqual(parse_fixed(Decimal('60000.01'), 8), 6000001000000)
+        self.assertEqual(parse_fixed(0.1, 8), 10000000)
+
+    def test_levels_round_trip_as_decimals(self):
+        side = book_side([('60000.12345678', '0.5'), ('59999', '1.25')])
+        self.assertEqual(list(side), [(Decimal('60000.12345678'), Decimal('0.5')), (Decimal('59999'), Decimal('1.25'))])
+        self.assertEqual(side.prices[0], 6000012345678)
+        self.assertEqual(side.quantities[1], 125000000)
+        self.assertEqual(side.depth(), Decimal('1.75'))
+        self.assertEqual(side.depth(1), Decimal('0.5'))
+
+    def test_slices_and_conversions_share_the_buffers(self):
+        book = OrderBook.from_levels([('36', '1'), ('18', '2')], [('54', '1')], 'ZAR')
+        top = book.top(1)
+        self.assertEqual(len(top.bids), 1)
+        self.assertEqual(top['bids'][0], (Decimal('36'), Decimal('1')))
+
+        usd = book.converted(Decimal('18'), 'USD')
+        self.assertIs(usd.bids.prices, book.bids.prices)
+        self.assertEqual(usd.currency, 'USD')
+        self.assertEqual(usd['bids'].price(1), Decimal('1'))
+        self.assertEqual(usd['asks'].converted(3).price(0), Decimal('1'))
+
+    def test_pickles_views_as_plain_arrays(self):
+        book = OrderBook.from_levels([('100', '1'), ('99', '2')], [('101', '1')], 'USD').top(1)
+        restored = pickle.loads(pickle.dumps(book))
+        self.assertEqual(list(restored.bids), [(Decimal('100'), Decimal('1'))])
+        self.assertEqual(restored.bids.depth(), Decimal('1'))
+
+
+class MatchingTests(SimpleTestCase):
+    def books(self, levels=50, seed=7):
+        """Valr-style asks a little under ByBit-style bids, converging with depth"""
+        rng = random.Random(seed)
+        asks = [(f'{100 + i * 0.1:.2f}', f'{rng.uniform(0.01, 2):.8f}') for i in range(levels)]
+        bids = [(f'{103 - i * 0.1:.2f}', f'{rng.uniform(0.01, 2):.8f}') for i in range(levels)]
+        return book_side(asks), book_side(bids)
+
+    def test_walk_carries_leftovers_and_stops_at_the_spread(self):
+        asks = book_side([('100', '1'), ('101', '1'), ('103', '5')])
+        bids = book_side([('104', '0.5'), ('103', '2')])
+        fills = matching.walk_books(asks, bids, min_spread_percentage=Decimal('1'))
+        # 0.5 at 100/104, 0.5 at 100/103, then 101/103 (1.98%) and 103/103 fails the 1% spread
+        self.assertEqual(fills, [(0, 0, 50000000), (0, 1, 50000000), (1, 1, 100000000)])
+
+    def test_walk_stops_at_the_target(self):
+        asks, bids = book_side([('100', '1')]), book_side([('110', '1')])
+        self.assertEqual(matching.walk_books(asks, bids, Decimal('0.25')), [(0, 0, 25000000)])
+        self.assertEqual(matching.walk_books(asks, bids, Decimal('0')), [])
+
+    def test_numpy_walk_matches_the_python_walk(self):
+        if matching.np is None:
+            self.skipTest("numpy is not installed")
+        asks, bids = self.books()
+        for target in (None, Decimal('0.3'), Decimal('5'), Decimal('1000')):
+            with self.subTest(target=target):
+                with mock.patch('bot.matching.VECTORIZE_MIN_LEVELS', 10 ** 9):
+                    python = matching.walk_books(asks, bids, target, Decimal('1'))
+                with mock.patch('bot.matching.VECTORIZE_MIN_LEVELS', 1):
+                    vectorized = matching.walk_books(asks, bids, target, Decimal('1'))
+                self.assertTrue(python)
+                self.assertEqual(vectorized, python)
+
+    def test_incremental_matcher_tracks_walk_books(self):
+        rng = random.Random(11)
+        ask_prices, bid_prices = range(1070000, 1110000, 1000), range(59000, 63000, 100)
+
+        def levels(prices):
+            return [(str(price), f'{rng.uniform(0.01, 1):.8f}') for price in prices]
+
+        valr, bybit = L2Book('valr', 'BTCZAR'), L2Book('bybit', 'BTCUSDT')
+        valr.apply_snapshot([], levels(ask_prices[::2]), 1)
+        bybit.apply_snapshot(levels(bid_prices[::2]), [], 1)
+        matcher = matching.IncrementalMatcher(valr, bybit, Decimal('18'), Decimal('2.5'), Decimal('1'))
+        matcher.recompute()
+
+        for step in range(500):
+            if step % 100 == 50:
+                matcher.configure(usd_zar_rate=rng.choice([Decimal('18'), Decimal('18.25')]),
+                                  target_volume=rng.choice([None, Decimal('1'), Decimal('2.5')]))
+            book, side, prices = rng.choice([(valr, ASKS, ask_prices), (bybit, BIDS, bid_prices)])
+            changes = [(str(rng.choice(prices)), '0' if rng.random() < 0.3 else f'{rng.uniform(0.01, 1):.8f}')
+                       for _ in range(rng.randint(1, 3))]
+            book.apply_delta(changes if side == BIDS else [], changes if side == ASKS else [], book.sequence + 1)
+            matcher.on_book_update(book)
+
+            expected = matching.walk_books(
+                valr.as_orderbook(currency='ZAR').converted(matcher.usd_zar_rate, 'USD')['asks'],
+                bybit.as_orderbook(currency='USD')['bids'], matcher.target_volume, Decimal('1'),
+            )
+            self.assertEqual([fill[:3] for fill in matcher.fills], expected, f"after delta {step}")
+            self.assertEqual(matcher.opportunity['tradable_volume'],
+                             Decimal(sum(satoshis for _, _, satoshis in expected)) / 10 ** 8)
+
+    def test_fill_curve(self):
+        side = book_side([('100', '1'), ('110', '2')])
+        base, notional = matching.fill_curve(side, [0.5, 2, 10])
+        self.assertEqual([float(value) for value in base], [0.5, 2.0, 3.0])
+        self.assertEqual([float(value) for value in notional], [50.0, 210.0, 320.0])
+
+        # Spending quote currency: 155 buys the first level and half of the second
+        base, notional = matching.fill_curve(side, [155], quote=True)
+        self.assertAlmostEqual(float(base[0]), 1.5)
+        self.assertAlmostEqual(float(notional[0]), 155.0)
+
+    def test_fill_curve_is_exact(self):
+        side = book_side([('60000.01', '0.33333333'), ('60000.07', '1')])
+        base, notional = matching.fill_curve(side, [Decimal('0.5'), Decimal('0.33333333')])
+        self.assertEqual(base, [Decimal('0.5'), Decimal('0.33333333')])
+        self.assertEqual(notional[0], Decimal('60000.01') * Decimal('0.33333333') + Decimal('60000.07') * Decimal('0.16666667'))
+
+        base, notional = matching.fill_curve(side, [Decimal('30000')], quote=True)
+        self.assertEqual(notional, [Decimal('30000')])
+        self.assertIsInstance(base[0], Decimal)
+
+    def test_fill_curve_on_an_empty_book(self):
+        base, notional = matching.fill_curve(book_side([]), [1, 2])
+        self.assertEqual([float(value) for value in base], [0.0, 0.0])
+
+
+def market_snapshot(fetched_at, bybit_bid='62000', valr_ask='1080000', **fields):
+    """ByBit bids against Valr asks at 18 ZAR/USD; the defaults are 60000 USD bought, 62000 sold"""
+    return MarketSnapshot(
+        bybit_ticker=Decimal(bybit_bid),
+        bybit_orderbook=OrderBook.from_levels([(bybit_bid, '1')], [(str(Decimal(bybit_bid) + 100), '1')], 'USD'),
+        bybit_volume=Decimal('10'),
+        valr_ticker=Decimal(valr_ask),
+        valr_orderbook=OrderBook.from_levels([(str(Decimal(valr_ask) - 10000), '1')], [(valr_ask, '1')], 'ZAR'),
+        valr_volume=Decimal('10'),
+        exchange_rate=Decimal('18'),
+        fetched_at=fetched_at,
+        **fields,
+    )
+
+
+class SimulationTests(SimpleTestCase):
+    def setUp(self):
+        # Valr asks 1080000 and 1090800 ZAR (60000 and 60600 USD at 18 ZAR/USD) against ByBit bids 62000 and 61000
+        self.snapshot = MarketSnapshot(
+            bybit_orderbook=OrderBook.from_levels([('62000', '1'), ('61000', '1')], [('62100', '1')], 'USD'),
+            valr_orderbook=OrderBook.from_levels([('1070000', '1')], [('1080000', '1'), ('1090800', '1')], 'ZAR'),
+            exchange_rate=Decimal('18'),
+            version=7,
+        )
+
+    def test_buys_valr_and_sells_bybit(self):
+        result, = services.simulate_trades(self.snapshot, [Decimal('540000')], Decimal('0'))
+        self.assertEqual(result['btc_bought'], Decimal('0.5'))
+        self.assertEqual(result['valr_avg_price_zar'], Decimal('1080000'))
+        self.assertEqual(result['bybit_avg_price_usd'], Decimal('62000'))
+        self.assertEqual(result['profit_zar'], Decimal('18000'))  # (62000 * 18 - 1080000) * 0.5 BTC
+        self.assertEqual(result['valr_slippage_percentage'], 0)
+        self.assertTrue(result['fully_filled'])
+
+    def test_fees_slippage_and_depth(self):
+        walked, beyond = services.simulate_trades(self.snapshot, [Decimal('1625400'), Decimal('5000000')], Decimal('0.1'))
+
+        # 1 BTC at 1080000 and 0.5 at 1090800, then that less 0.1% sold down 62000 and 61000 USD
+        self.assertEqual(walked['btc_bought'], Decimal('1.5'))
+        self.assertEqual(walked['btc_sold'], Decimal('1.4985'))
+        self.assertEqual(walked['invested_zar'], Decimal('1625400'))
+        raised = (Decimal('62000') + Decimal('0.4985') * Decimal('61000')) * 18
+        self.assertEqual(walked['fees_zar'], (Decimal('1625400') + raised) * Decimal('0.001'))
+        self.assertEqual(walked['profit_zar'], raised * Decimal('0.999') - Decimal('1625400'))
+        self.assertAlmostEqual(walked['valr_slippage_percentage'], Decimal(1) / 3)  # 1083600 average over 1080000
+        self.assertTrue(walked['fully_filled'])
+
+        # Deeper than the Valr asks: only the 2 BTC on offer are bought
+        self.assertEqual(beyond['invested_zar'], Decimal('2170800'))
+        self.assertEqual(beyond['btc_sold'], Decimal('1.998'))
+        self.assertFalse(beyond['fully_filled'])
+
+    def curve(self, **params):
+        with mock.patch('bot.services.snapshot_version', return_value=None), \
+                mock.patch('bot.services.current_snapshot', return_value=self.snapshot):
+            response = views.simulate_curve(RequestFactory().get('/api/simulate-curve/', params))
+        return response.status_code, json.loads(response.content)
+
+    def test_simulate_curve_view(self):
+        status, body = self.curve(amounts='540000,1620000', fee='0')
+        self.assertEqual(status, 200)
+        self.assertTrue(body['success'])
+        self.assertEqual(body['version'], 7)
+        self.assertEqual([s['amount_zar'] for s in body['simulations']], [540000, 1620000])
+        self.assertEqual(body['simulations'][0]['profit_zar'], 18000)
+
+        status, body = self.curve(start='1000', stop='100000', steps='5')
+        self.assertEqual([s['amount_zar'] for s in body['simulations']], [1000, 25750, 50500, 75250, 100000])
+
+    def test_simulate_curve_rejects_bad_amounts(self):
+        for params in ({'amounts': '1000,-5'}, {'steps': '0'}, {'steps': str(views.MAX_SIMULATION_AMOUNTS + 1)}):
+            with self.subTest(params=params):
+                status, body = self.curve(**params)
+                self.assertEqual(status, 400)
+                self.assertFalse(body['success'])
+
+
+class SnapshotResponseTests(SimpleTestCase):
+    def setUp(self):
+        views.response_cache.clear()
+        self.addCleanup(views.response_cache.clear)
+        self.version = 7
+        patcher = mock.patch('bot.services.snapshot_version', lambda: self.version)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+        @views.snapshot_response
+        def market(request):
+            self.calls += 1
+            self.release.wait(5)
+            return JsonResponse({'version': self.version, 'q': request.GET.get('q')})
+
+        self.view = market
+
+    def get(self, query=None, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.view(RequestFactory().get('/api/market-data/', query or {}, headers=headers))
+
+    def test_not_modified_while_the_version_holds(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], 'W/"7"')
+        self.assertEqual(json.loads(response.content), {'version': 7, 'q': None})
+
+        response = self.get(etag='W/"6", W/"7"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], 'W/"7"')
+
+        self.version = 8
+        response = self.get(etag='W/"7"')
+        self.assertEqual((response.status_code, response['ETag']), (200, 'W/"8"'))
+        self.assertEqual(self.calls, 2)
+
+    def test_responses_are_cached_per_version_and_query(self):
+        first = self.get({'q': 'a'})
+        self.assertEqual(self.get({'q': 'a'}).content, first.content)
+        self.assertEqual(self.calls, 1)
+
+        self.get({'q': 'b'})
+        self.version = 8
+        self.assertEqual(json.loads(self.get({'q': 'a'}).content), {'version': 8, 'q': 'a'})
+        self.assertEqual(self.calls, 3)
+
+    def test_uncached_without_a_published_snapshot(self):
+        self.version = None
+        for _ in range(2):
+            response = self.get()
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(self.calls, 2)
+
+    def test_concurrent_misses_share_one_render(self):
+        self.release.clear()
+        coalesced = views._response_builds.counters['coalesced']
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(self.get())) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+
+        deadline = time.monotonic() + 5
+        while views._response_builds.counters['coalesced'] - coalesced < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        waiting = views._response_builds.counters['coalesced'] - coalesced
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual((self.calls, waiting), (1, 4))
+        self.assertEqual([response.status_code for response in responses], [200] * 5)
+        self.assertEqual(len({response.content for response in responses}), 1)
+
+    def test_async_views_coalesce_per_event_loop(self):
+        @views.snapshot_response
+        async def amarket(request):
+            self.calls += 1
+            await asyncio.sleep(0.01)
+            return JsonResponse({'version': self.version})
+
+        async def concurrent_requests():
+            request = RequestFactory().get('/api/market-data/')
+            return await asyncio.gather(*(amarket(request) for _ in range(5)))
+
+        with mock.patch('bot.services.asnapshot_version', mock.AsyncMock(return_value=7)):
+            responses = asyncio.run(concurrent_requests())
+        self.assertEqual(self.calls, 1)
+        self.assertEqual({(response.status_code, response['ETag']) for response in responses}, {(200, 'W/"7"')})
+
+
+class SnapshotBroadcasterTests(SimpleTestCase):
+    def setUp(self):
+        self.snapshot = MarketSnapshot(bybit_ticker=Decimal('100'), valr_ticker=Decimal('1800'), version=1)
+        self.loads = 0
+
+        def latest_snapshot(max_age=None):
+            self.loads += 1
+            return self.snapshot
+
+        for name, replacement in (('latest_version', lambda max_age=None: self.snapshot.version),
+                                  ('latest_snapshot', latest_snapshot)):
+            patcher = mock.patch(f'bot.store.{name}', replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.broadcaster = SnapshotBroadcaster(lambda snapshot: {'bybit': snapshot.bybit_ticker, 'valr': snapshot.valr_ticker})
+        self.broadcaster.options.update(poll_interval=0.01, keepalive=5)
+
+    def publish(self, **changes):
+        self.snapshot = dataclasses.replace(self.snapshot, version=self.snapshot.version + 1, **changes)
+
+    async def caught_up(self):
+        while self.broadcaster.version != self.snapshot.version:
+            await asyncio.sleep(0.01)
+
+    @staticmethod
+    def event_data(event):
+        return json.loads(event.split('data: ', 1)[1])
+
+    def run_async(self, coroutine):
+        return asyncio.run(asyncio.wait_for(coroutine, 5))
+
+    def test_full_event_then_diffs(self):
+        async def stream():
+            events = self.broadcaster.subscribe()
+            full = await events.__anext__()
+            self.publish(bybit_ticker=Decimal('101'))
+            diff = await events.__anext__()
+            await events.aclose()
+            await self.broadcaster._producer
+            return full, diff
+
+        full, diff = self.run_async(stream())
+        self.assertTrue(full.startswith('event: snapshot\nid: 1\n'))
+        self.assertEqual(self.event_data(full), {'bybit': 100, 'valr': 1800, 'version': 1})
+        self.assertTrue(diff.startswith('event: diff\nid: 2\n'))
+        self.assertEqual(self.event_data(diff), {'bybit': 101, 'version': 2})
+        # The producer polls many times but only loads the snapshot when the version moves
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(self.broadcaster.subscribers, 0)
+
+    def test_slow_subscribers_get_one_diff_against_what_they_saw(self):
+        async def stream():
+            slow = self.broadcaster.subscribe()
+            await slow.__anext__()
+            self.publish(valr_ticker=Decimal('1810'))
+            await self.caught_up()
+            self.publish(bybit_ticker=Decimal('102'))
+            await self.caught_up()
+            event = await slow.__anext__()
+
+            late = self.broadcaster.subscribe()
+            first = await late.__anext__()
+            await slow.aclose()
+            await late.aclose()
+            return event, first
+
+        event, first = self.run_async(stream())
+        self.assertTrue(event.startswith('event: diff\nid: 3\n'))
+        self.assertEqual(self.event_data(event), {'bybit': 102, 'valr': 1810, 'version': 3})
+        self.assertEqual(self.event_data(first), {'bybit': 102, 'valr': 1810, 'version': 3})
+
+    def test_keepalive_while_nothing_changes(self):
+        self.broadcaster.options['keepalive'] = 0.05
+
+        async def stream():
+            events = self.broadcaster.subscribe()
+            await events.__anext__()
+            keepalive = await events.__anext__()
+            await events.aclose()
+            return keepalive
+
+        self.assertEqual(self.run_async(stream()), ': keepalive\n\n')
+
+    def test_fetches_live_without_an_ingestor(self):
+        live = MarketSnapshot(bybit_ticker=Decimal('99'), valr_ticker=Decimal('1790'))
+
+        async def stream():
+            events = self.broadcaster.subscribe()
+            event = await events.__anext__()
+            await events.aclose()
+            return event
+
+        with mock.patch('bot.store.latest_version', return_value=None), \
+                mock.patch('bot.services.afetch_market_snapshot', mock.AsyncMock(return_value=live)) as fetch:
+            event = self.run_async(stream())
+        self.assertEqual(fetch.await_count, 1)
+        self.assertEqual(self.event_data(event)['bybit'], 99)
+        self.assertEqual(self.loads, 0)
+
+
+class RecordingTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'snapshots.rec')
+
+    def record(self, snapshots, depth=4):
+        writer = RecordingWriter(self.path, depth=depth)
+        for snapshot in snapshots:
+            writer.append(snapshot)
+        writer.close()
+        recording = Recording(self.path)
+        self.addCleanup(recording.close)
+        return recording
+
+
+class RecordingTests(RecordingTestCase):
+    def test_round_trip(self):
+        snapshot = dataclasses.replace(
+            market_snapshot(1000.5),
+            valr_orderbook=OrderBook.from_levels([], [('1080000', '0.5'), ('1081000.25', '1.25')], 'ZAR'),
+            valr_volume=None,
+        )
+        recording = self.record([snapshot, market_snapshot(1001.5)])
+
+        self.assertEqual(len(recording), 2)
+        self.assertEqual(recording.timestamp(1), 1001.5)
+        restored = recording[0]
+        self.assertEqual(restored.fetched_at, 1000.5)
+        self.assertEqual(restored.version, 0)
+        self.assertEqual((restored.bybit_ticker, restored.exchange_rate), (Decimal('62000'), Decimal('18')))
+        self.assertIsNone(restored.valr_volume)
+        self.assertEqual(list(restored.bybit_orderbook['bids']), [(Decimal('62000'), Decimal('1'))])
+        self.assertEqual(list(restored.valr_orderbook['asks']),
+                         [(Decimal('1080000'), Decimal('0.5')), (Decimal('1081000.25'), Decimal('1.25'))])
+        self.assertEqual(len(restored.valr_orderbook['bids']), 0)
+        self.assertEqual(restored.valr_orderbook.currency, 'ZAR')
+        self.assertEqual([s.version for s in recording], [0, 1])
+        self.assertEqual(recording[-1].fetched_at, 1001.5)
+        with self.assertRaises(IndexError):
+            recording[2]
+
+    def test_books_are_truncated_to_the_depth(self):
+        levels = [(str(62000 - i), '1') for i in range(10)]
+        snapshot = dataclasses.replace(market_snapshot(1000), bybit_orderbook=OrderBook.from_levels(levels, [], 'USD'))
+        recording = self.record([snapshot], depth=3)
+        self.assertEqual([price for price, _ in recording[0].bybit_orderbook['bids']],
+                         [Decimal('62000'), Decimal('61999'), Decimal('61998')])
+
+    def test_appends_to_an_existing_recording_and_ignores_a_torn_record(self):
+        self.record([market_snapshot(1000)], depth=4)
+        writer = RecordingWriter(self.path, depth=100)  # the file's depth wins
+        self.assertEqual(writer.depth, 4)
+        writer.append(market_snapshot(1001))
+        writer.close()
+        with open(self.path, 'ab') as f:
+            f.write(b'\x01' * 24)  # an interrupted third append
+
+        recording = Recording(self.path)
+        self.addCleanup(recording.close)
+        self.assertEqual([recording.timestamp(i) for i in range(len(recording))], [1000, 1001])
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a recording at all')
+        with self.assertRaises(ValueError):
+            Recording(self.path)
+
+
+class BacktestTests(RecordingTestCase):
+    def test_profitable_when_valr_is_cheap(self):
+        # Buy 0.1 BTC (10% of the 1 BTC both venues trade) at 60000 USD on Valr, sell at 62000 on ByBit
+        recording = self.record([market_snapshot(1000 + i) for i in range(3)])
+        result = run_backtest(recording, fee_percentage=Decimal('0.1'))
+
+        self.assertEqual((result['snapshots'], result['trades'], result['missed_signals']), (3, 3, 0))
+        self.assertEqual(result['volume_btc'], Decimal('3'))
+        # 2000 USD spread per BTC less 0.1% on the 122000 USD both legs turn over
+        self.assertEqual(result['pnl_usd'], 3 * (Decimal('2000') - Decimal('122')))
+
+    def test_no_trades_when_valr_is_dear(self):
+        # Valr at 64000 USD is a premium over ByBit, but buying it to sell on ByBit would lose
+        recording = self.record([market_snapshot(1000 + i, valr_ask='1152000') for i in range(3)])
+        result = run_backtest(recording)
+        self.assertEqual((result['trades'], result['missed_signals'], result['pnl_usd']), (0, 0, Decimal('0')))
+
+    def test_latency_and_cooldown(self):
+        recording = self.record([
+            market_snapshot(1000),
+            market_snapshot(1000.5, valr_ask='1152000'),  # the spread closes before a 0.5s latency lands
+            market_snapshot(1001),
+            market_snapshot(1001.5),
+            market_snapshot(1002),
+        ])
+
+        # The signal at 1002 has no snapshot left to execute on
+        result = run_backtest(recording, latency=0.5)
+        self.assertEqual((result['trades'], result['missed_signals']), (2, 1))
+
+        # The trade at 1000 holds off every signal until 1002
+        result = run_backtest(recording, cooldown=2)
+        self.assertEqual((result['trades'], result['missed_signals']), (2, 0))
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_takes_until_empty_then_reports_the_wait(self):
+        bucket = TokenBucket(os.path.join(self.directory, 'bucket'), rate=0.001, burst=2)
+        self.assertEqual(bucket.try_take(), 0)
+        self.assertEqual(bucket.try_take(), 0)
+        self.assertAlmostEqual(bucket.try_take(), 1000, delta=1)
+
+        bucket.refund()
+        self.assertEqual(bucket.try_take(), 0)
+
+    def test_state_is_shared_through_the_file(self):
+        path = os.path.join(self.directory, 'bucket')
+        first = TokenBucket(path, rate=0.001, burst=1)
+        second = TokenBucket(path, rate=0.001, burst=1)
+        self.assertEqual(first.try_take(), 0)
+        self.assertGreater(second.try_take(), 0)
+
+    def test_drain_backs_off(self):
+        bucket = TokenBucket(os.path.join(self.directory, 'bucket'), rate=10, burst=5)
+        bucket.drain(2)
+        self.assertAlmostEqual(bucket.try_take(), 2.1, delta=0.05)
+
+    def test_reserve_is_left_to_high_priority(self):
+        limiter = RateLimiter('venue', rate=0.001, burst=4, reserve=0.25, directory=self.directory)
+        # LOW only takes while 1 + 4 * 0.25 tokens remain, HIGH down to the last one
+        for _ in range(3):
+            self.assertTrue(limiter.acquire('/v1/public/marketsummary', timeout=0))
+        self.assertFalse(limiter.acquire('/v1/public/marketsummary', timeout=0))
+        self.assertFalse(limiter.acquire('/v5/market/tickers', priority=LOW, timeout=0))
+        self.assertTrue(limiter.acquire('/v1/public/BTCZAR/orderbook', timeout=0))
+        self.assertFalse(limiter.acquire('/v5/market/tickers', priority=HIGH, timeout=0))
+
+    def test_endpoint_buckets_refund_the_venue_bucket(self):
+        limiter = RateLimiter(
+            'venue', rate=0.001, burst=2, reserve=0, directory=self.directory,
+            endpoints={'/v5/market/kline': {'rate': 0.001, 'burst': 1}},
+        )
+        self.assertTrue(limiter.acquire('/v5/market/kline', timeout=0))
+        self.assertFalse(limiter.acquire('/v5/market/kline', timeout=0))
+        # The refused kline request gave its venue token back
+        self.assertTrue(limiter.acquire('/v5/market/tickers', timeout=0))
+        self.assertFalse(limiter.acquire('/v5/market/tickers', timeout=0))
+
+    def test_every_resource_has_its_own_endpoint_priority(self):
+        # FX used to be requested at an empty path, which fell through to NORMAL
+        self.assertEqual(ENDPOINT_PRIORITIES[upstream.RESOURCES['fx'].path], LOW)
+        self.assertEqual(ENDPOINT_PRIORITIES[upstream.RESOURCES['bybit_orderbook'].path], HIGH)
+
+    def test_async_acquire(self):
+        limiter = RateLimiter('venue', rate=0.001, burst=1, reserve=0, directory=self.directory)
+        self.assertTrue(asyncio.run(limiter.aacquire('/v5/market/tickers', timeout=0)))
+        self.assertFalse(asyncio.run(limiter.aacquire('/v5/market/tickers', timeout=0)))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_the_threshold_and_half_opens_after_the_timeout(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        with mock.patch('bot.clients.time.monotonic', return_value=100.0):
+            self.assertIs(breaker.allow_request(), True)
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertIs(breaker.allow_request(), False)
+
+        with mock.patch('bot.clients.time.monotonic', return_value=130.0):
+            # Exactly one trial goes out
+            self.assertEqual(breaker.allow_request(), CircuitBreaker.HALF_OPEN)
+            self.assertIs(breaker.allow_request(), False)
+            breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        with mock.patch('bot.clients.time.monotonic', return_value=100.0):
+            breaker.record_failure()
+        with mock.patch('bot.clients.time.monotonic', return_value=131.0):
+            self.assertEqual(breaker.allow_request(), CircuitBreaker.HALF_OPEN)
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertIs(breaker.allow_request(), False)
+
+    def test_released_trial_lets_the_next_request_try(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        with mock.patch('bot.clients.time.monotonic', return_value=100.0):
+            breaker.record_failure()
+        with mock.patch('bot.clients.time.monotonic', return_value=131.0):
+            self.assertEqual(breaker.allow_request(), CircuitBreaker.HALF_OPEN)
+            breaker.release()
+            self.assertEqual(breaker.allow_request(), CircuitBreaker.HALF_OPEN)
+
+
+def http_response(status, headers=None, content=b'{}'):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = content
+    response.url = 'https://upstream.test/v5/ticker'
+    return response
+
+
+class ExchangeClientTests(SimpleTestCase):
+    def setUp(self):
+        self.exchange = ExchangeClient('upstream', 'https://upstream.test', backoff=0, failure_threshold=2)
+        self.exchange.limiter = None
+        patcher = mock.patch.object(self.exchange.session, 'get')
+        self.send = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_client_errors_raise_without_retrying(self):
+        self.send.return_value = http_response(404, content=b'not found')
+        with self.assertRaises(requests.HTTPError):
+            self.exchange.get('/v5/ticker')
+        self.assertEqual(self.send.call_count, 1)
+        self.assertEqual(self.exchange.breaker.failures, 1)
+
+    def test_retries_transient_failures(self):
+        self.send.side_effect = [requests.ConnectionError('refused'), http_response(503), http_response(200)]
+        with self.assertLogs('bot.clients', 'WARNING') as logs:
+            response = self.exchange.get('/v5/ticker')
+        self.assertEqual((response.status_code, self.send.call_count, len(logs.output)), (200, 3, 2))
+        self.assertEqual(self.exchange.breaker.failures, 0)
+
+    def test_backoff_doubles_per_attempt_with_full_jitter(self):
+        self.exchange.options['backoff'] = 0.5
+        self.send.side_effect = [http_response(502), http_response(502), http_response(200)]
+        with mock.patch('bot.clients.random.uniform', return_value=0.0) as uniform, \
+                mock.patch('bot.clients.time.sleep') as sleep, self.assertLogs('bot.clients', 'WARNING'):
+            self.exchange.get('/v5/ticker')
+        self.assertEqual(uniform.call_args_list, [mock.call(0, 0.5), mock.call(0, 1.0)])
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_exhausted_retries_raise_and_open_the_circuit(self):
+        self.send.side_effect = [requests.Timeout('slow')] * 3 + [http_response(500)] * 3
+        errors = []
+        with self.assertLogs('bot.clients', 'WARNING'):
+            for _ in range(3):
+                try:
+                    self.exchange.get('/v5/ticker')
+                except requests.RequestException as e:
+                    errors.append(type(e))
+        self.assertEqual(errors, [requests.Timeout, requests.HTTPError, CircuitOpenError])
+        self.assertEqual(self.send.call_count, 6)
+
+    def test_other_request_errors_are_not_retried(self):
+        self.send.side_effect = requests.TooManyRedirects('loop')
+        with self.assertRaises(requests.TooManyRedirects):
+            self.exchange.get('/v5/ticker')
+        self.assertEqual(self.send.call_count, 1)
+
+    def test_429_backs_the_rate_limiter_off(self):
+        self.exchange.limiter = mock.Mock(acquire=mock.Mock(return_value=True))
+        self.send.side_effect = [http_response(429, {'Retry-After': '7'}), http_response(200)]
+        with self.assertLogs('bot.clients', 'WARNING'):
+            self.exchange.get('/v5/ticker')
+        self.exchange.limiter.penalize.assert_called_once_with(7.0)
+        self.assertEqual(self.exchange.limiter.acquire.call_count, 2)
+
+    def test_rate_limit_queue_timeout(self):
+        self.exchange.limiter = mock.Mock(acquire=mock.Mock(return_value=False))
+        with self.assertRaises(RateLimitedError):
+            self.exchange.get('/v5/ticker')
+        self.send.assert_not_called()
+        self.assertEqual(self.exchange.breaker.failures, 0)
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after(http_response(429, {'Retry-After': '3'}), 0, 0.2), 3.0)
+        with mock.patch('bot.clients.time.time', return_value=1000.0):
+            reset = http_response(429, {'X-Bapi-Limit-Reset-Timestamp': '1002500'})
+            self.assertEqual(retry_after(reset, 0, 0.2), 2.5)
+            passed = http_response(429, {'X-Bapi-Limit-Reset-Timestamp': '999000'})
+            self.assertEqual(retry_after(passed, 0, 0.2), 0.0)
+        # Missing or unparseable headers fall back to the attempt's backoff
+        self.assertAlmostEqual(retry_after(http_response(429), 2, 0.2), 4.0)
+        self.assertAlmostEqual(retry_after(http_response(429, {'Retry-After': 'soon'}), 0, 0.2), 1.0)
+
+
+class AsyncExchangeClientTests(SimpleTestCase):
+    def setUp(self):
+        if httpx is None:
+            self.skipTest("httpx is not installed")
+        self.responses = []
+        self.requests = []
+        self.limiter = mock.Mock(aacquire=mock.AsyncMock(return_value=True))
+
+    def handler(self, request):
+        self.requests.append(request)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def exchange_client(self, **options):
+        """An AsyncExchangeClient whose requests go to self.handler; use within the loop that runs it"""
+        sync_client = ExchangeClient('upstream', 'https://upstream.test', backoff=0, failure_threshold=2, **options)
+        sync_client.limiter = self.limiter
+        client = AsyncExchangeClient(sync_client)
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+        return client
+
+    def get(self, client_options=None, concurrent=1, **params):
+        async def fetch():
+            client = self.exchange_client(**(client_options or {}))
+            try:
+                return await asyncio.gather(*(client.get('/v5/ticker', params or None) for _ in range(concurrent))), client
+            finally:
+                await client.aclose()
+        return asyncio.run(fetch())
+
+    def test_success(self):
+        self.responses.append(httpx.Response(200, json={'price': '1'}))
+        (response,), client = self.get(symbol='BTCUSDT')
+        self.assertEqual(response.json(), {'price': '1'})
+        self.assertEqual(str(self.requests[0].url), 'https://upstream.test/v5/ticker?symbol=BTCUSDT')
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_concurrent_identical_gets_go_out_once(self):
+        self.responses.append(httpx.Response(200, json={}))
+        responses, _ = self.get(concurrent=3)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(len({id(response) for response in responses}), 1)
+
+    def test_retries_transient_failures(self):
+        self.responses.extend([httpx.ConnectError('refused'), httpx.Response(503), httpx.Response(200, json={})])
+        (response,), client = self.get()
+        self.assertEqual((response.status_code, len(self.requests)), (200, 3))
+        self.assertEqual(client.breaker.failures, 0)
+
+    def test_429_backs_the_rate_limiter_off(self):
+        self.responses.extend([httpx.Response(429, headers={'Retry-After': '7'}), httpx.Response(200, json={})])
+        self.get()
+        self.limiter.penalize.assert_called_once_with(7.0)
+        self.assertEqual(self.limiter.aacquire.await_count, 2)
+
+    def test_client_errors_raise_without_retrying(self):
+        self.responses.append(httpx.Response(404, text='not found'))
+        with self.assertRaises(requests.HTTPError):
+            self.get()
+        self.assertEqual(len(self.requests), 1)
+
+    def test_exhausted_retries_raise_requests_errors_and_open_the_circuit(self):
+        self.responses.extend([httpx.ReadTimeout('slow')] * 2 + [httpx.Response(502)] * 2)
+
+        async def requests_until_open():
+            client = self.exchange_client(max_retries=1)
+            errors = []
+            for _ in range(3):
+                try:
+                    await client.get('/v5/ticker')
+                except Exception as e:
+                    errors.append(type(e))
+            await client.aclose()
+            return errors
+
+        errors = asyncio.run(requests_until_open())
+        self.assertEqual(errors, [requests.Timeout, requests.HTTPError, CircuitOpenError])
+        self.assertEqual(len(self.requests), 4)
+
+    def test_rate_limit_queue_timeout(self):
+        self.limiter.aacquire.return_value = False
+        with self.assertRaises(RateLimitedError):
+            self.get()
+        self.assertEqual(self.requests, [])
+
+
+def rule(rule_id, threshold, operator=AlertRule.ABOVE, metric=AlertRule.PREMIUM, change_window=None, cooldown=0):
+    return CompiledRule(rule_id, f'rule {rule_id}', metric, operator, threshold, change_window, cooldown)
+
+
+class AlertEvaluatorTests(SimpleTestCase):
+    def fired(self, evaluator, value, at, metric=AlertRule.PREMIUM):
+        return [alert.rule_id for alert in evaluator.evaluate({metric: value}, at)]
+
+    def test_fires_on_the_crossing_only(self):
+        evaluator = AlertEvaluator([rule(1, 1.0), rule(2, 2.0), rule(3, 3.0)])
+        self.assertEqual(self.fired(evaluator, 0.5, 0), [])
+        self.assertEqual(self.fired(evaluator, 2.5, 1), [1, 2])
+        self.assertEqual(self.fired(evaluator, 2.7, 2), [])  # still holding, no new edge
+        self.assertEqual(self.fired(evaluator, 3.0, 3), [3])
+        self.assertEqual(self.fired(evaluator, 0.0, 4), [])
+        self.assertEqual(self.fired(evaluator, 1.5, 5), [1])
+
+    def test_first_value_fires_what_already_holds(self):
+        evaluator = AlertEvaluator([rule(1, 1.0), rule(2, -1.0, AlertRule.BELOW)])
+        self.assertEqual(sorted(self.fired(evaluator, -2.0, 0)), [2])
+        self.assertEqual(self.fired(evaluator, 5.0, 1), [1])
+        self.assertEqual(self.fired(evaluator, -1.0, 2), [2])  # at the threshold holds
+
+    def test_cooldown_drops_crossings(self):
+        evaluator = AlertEvaluator([rule(1, 1.0, cooldown=60)])
+        self.assertEqual(self.fired(evaluator, 2.0, 0), [1])
+        self.fired(evaluator, 0.0, 10)
+        self.assertEqual(self.fired(evaluator, 2.0, 20), [])
+        self.fired(evaluator, 0.0, 70)
+        self.assertEqual(self.fired(evaluator, 2.0, 80), [1])
+
+    def test_recompiling_keeps_state(self):
+        evaluator = AlertEvaluator([rule(1, 1.0)])
+        self.assertEqual(self.fired(evaluator, 2.0, 0), [1])
+        evaluator = AlertEvaluator([rule(1, 1.0), rule(2, 5.0)], previous=evaluator)
+        self.assertEqual(self.fired(evaluator, 2.5, 1), [])
+        self.assertEqual(self.fired(evaluator, 6.0, 2), [2])
+
+    def test_change_window_compares_the_rate_per_minute(self):
+        evaluator = AlertEvaluator([rule(1, 1.0, change_window=60)])
+        self.assertEqual(self.fired(evaluator, 0.0, 0), [])
+        self.assertEqual(self.fired(evaluator, 0.2, 20), [])   # too little history for a rate
+        self.assertEqual(self.fired(evaluator, 0.4, 40), [])   # 0.6 per minute
+        self.assertEqual(self.fired(evaluator, 1.5, 60), [1])  # 1.5 per minute
+
+    def test_missing_metric_is_skipped(self):
+        evaluator = AlertEvaluator([rule(1, 1.0)])
+        self.assertEqual(evaluator.evaluate({AlertRule.PREMIUM: None}, 0), [])
+
+
+def create_trade(status=Trade.COMPLETED, **fields):
+    return Trade.objects.create(
+        investment_amount_zar=Decimal('10800'), btc_volume=Decimal('0.01'), bybit_price_usd=Decimal('62000'),
+        valr_price_zar=Decimal('1080000'), usd_zar_rate=Decimal('18'), premium_percentage=Decimal('3.33'),
+        status=status, **fields,
+    )
+
+
+class YieldingCondition(threading.Condition):
+    """Condition that lets other threads run before it is taken, to widen races around it"""
+
+    def __enter__(self):
+        time.sleep(0.0001)
+        return super().__enter__()
+
+
+class TradeWriterTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.journal = os.path.join(directory, 'trade-journal.jsonl')
+
+    def entry(self, seq, client_order_id, status=Trade.PENDING, levels=()):
+        trade = {
+            'client_order_id': client_order_id, 'investment_amount_zar': '10800.00', 'btc_volume': '0.01000000',
+            'bybit_price_usd': '62000', 'valr_price_zar': '1080000', 'usd_zar_rate': '18',
+            'premium_percentage': '3.33', 'status': status,
+        }
+        return {'trade': trade, 'levels': list(levels), 'seq': seq}
+
+    def test_replays_what_was_never_committed(self):
+        level = {'bybit_price_usd': '62000', 'valr_price_zar': '1080000', 'btc_volume': '0.01',
+                 'spread_percentage': '3.33'}
+        lines = [
+            self.entry(1, 'committed'),
+            {'committed': 1},
+            self.entry(2, 'pending', levels=[level]),
+            self.entry(3, 'pending', status=Trade.COMPLETED),
+        ]
+        with open(self.journal, 'w') as f:
+            f.writelines(json.dumps(line) + '\n' for line in lines)
+            f.write('{"trade": {"client_order_id": "to')  # torn by a crash mid-append
+
+        writer = TradeWriter(journal=self.journal)
+        self.assertEqual(writer._replay(), 2)
+        batch = list(writer._pending)
+        TradeWriter.write(batch)
+        TradeWriter.write(batch)  # replaying twice neither duplicates the trade nor its levels
+
+        trade = Trade.objects.get(client_order_id='pending')
+        self.assertEqual(trade.status, Trade.COMPLETED)
+        self.assertEqual(trade.levels.count(), 1)
+        self.assertFalse(Trade.objects.filter(client_order_id='committed').exists())
+
+    def test_concurrent_enqueues_replay_after_a_crash(self):
+        writer = TradeWriter(journal=self.journal, batch_size=50, flush_interval=0)
+        writer._journal = open(self.journal, 'a', encoding='utf-8')
+        writer._condition = YieldingCondition()
+        start = threading.Barrier(8)
+
+        def enqueue(thread):
+            start.wait()
+            for i in range(50):
+                writer.enqueue(Trade(
+                    client_order_id=f'{thread}-{i}', investment_amount_zar=Decimal('10800'), btc_volume=Decimal('0.01'),
+                    bybit_price_usd=Decimal('62000'), valr_price_zar=Decimal('1080000'), usd_zar_rate=Decimal('18'),
+                    premium_percentage=Decimal('3.33'),
+                ))
+
+        threads = [threading.Thread(target=enqueue, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([entry['seq'] for entry in writer._pending], list(range(1, 401)))
+
+        # One batch commits, then the process dies with the rest still queued
+        batch = writer._next_batch()
+        TradeWriter.write(batch)
+        writer._mark_committed(batch[-1]['seq'])
+        writer._journal.close()
+
+        restarted = TradeWriter(journal=self.journal)
+        self.assertEqual(restarted._replay(), 350)
+        self.assertEqual(restarted._pending[0]['seq'], 51)
+        TradeWriter.write(list(restarted._pending))
+        self.assertEqual(Trade.objects.count(), 400)
+
+    def test_empty_or_missing_journal(self):
+        self.assertEqual(TradeWriter(journal=self.journal)._replay(), 0)
+
+
+class TradePageTests(TestCase):
+    def setUp(self):
+        self.trades = [create_trade(status=Trade.FAILED if i % 3 == 0 else Trade.COMPLETED) for i in range(7)]
+        # Three trades share a timestamp, so the id tie-break has to hold across pages
+        shared = self.trades[2].created_at
+        Trade.objects.filter(id__in=[trade.id for trade in self.trades[2:5]]).update(created_at=shared)
+
+    def walk(self, **kwargs):
+        seen, cursor = [], None
+        while True:
+            page, cursor = trade_page(cursor=cursor, limit=2, **kwargs)
+            seen.extend(trade.id for trade in page)
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_trade_once_in_order(self):
+        expected = list(Trade.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk(), expected)
+        self.assertEqual(len(expected), 7)
+
+    def test_status_filter(self):
+        failed = self.walk(status=Trade.FAILED)
+        self.assertEqual(sorted(failed), sorted(trade.id for trade in self.trades if trade.status == Trade.FAILED))
+
+    def test_cursor_round_trip(self):
+        trade = self.trades[3]
+        trade.refresh_from_db()
+        self.assertEqual(decode_cursor(encode_cursor(trade)), (trade.created_at, trade.id))
+        with self.assertRaises(ValueError):
+            decode_cursor('not-a-cursor')
+
+
+class DownsampleTests(TestCase):
+    def test_hourly_rollup_weights_minutes_by_their_samples(self):
+        hour = datetime(2024, 1, 1, 10, tzinfo=dt_timezone.utc)
+        MarketSnapshotRecord.objects.bulk_create([
+            MarketSnapshotRecord(recorded_at=hour, resolution=MarketSnapshotRecord.MINUTE, samples=59,
+                                 premium_percentage=Decimal('1'), bybit_price_usd=Decimal('60000')),
+            # A minute the ingestor only caught once, and whose ticker was missing
+            MarketSnapshotRecord(recorded_at=hour + timedelta(minutes=1), resolution=MarketSnapshotRecord.MINUTE,
+                                 samples=1, premium_percentage=Decimal('3')),
+        ])
+
+        self.assertEqual(downsample(MarketSnapshotRecord.MINUTE, timedelta(days=1), now=hour + timedelta(days=2)), (1, 2))
+
+        rollup = MarketSnapshotRecord.objects.get(resolution=MarketSnapshotRecord.HOUR)
+        self.assertEqual(rollup.recorded_at, hour)
+        self.assertEqual(rollup.samples, 60)
+        # (59 * 1 + 1 * 3) / 60, where a mean of the two minute means would say 2
+        self.assertAlmostEqual(float(rollup.premium_percentage), 62 / 60, places=4)
+        self.assertEqual(rollup.bybit_price_usd, Decimal('60000'))
+        self.assertIsNone(rollup.valr_price_zar)
+
+
+UPSTREAM_PAYLOADS = {
+    'bybit_ticker': {'retCode': 0, 'result': {'list': [{'lastPrice': '62000', 'volume24h': '1200', 'turnover24h': '74400000'}]}},
+    'bybit_orderbook': OrderBook.from_levels([('62000', '1')], [('62100', '1')], 'USD'),
+    'bybit_kline': {'retCode': 0, 'result': {'list': [['1700000000000', '61000', '62500', '60500', '62000', '900', '0']]}},
+    'valr_summary': {'lastTradedPrice': '1080000', 'baseVolume': '50', 'quoteVolume': '54000000'},
+    'valr_orderbook': OrderBook.from_levels([('1070000', '1')], [('1080000', '1')], 'ZAR'),
+    'fx': {'rates': {'ZAR': 18.0}},
+}
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_quantiles_interpolate_within_buckets(self):
+        histogram = metrics.Histogram((1, 2, 4))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 0])
+        self.assertEqual(histogram.quantile(0.5), 1.5)  # rank 2 is half way through the (1, 2] bucket
+        self.assertEqual(histogram.quantile(1), 4)
+        histogram.observe(100)
+        self.assertEqual(histogram.quantile(1), 4)  # +Inf reports the last bound
+
+    def test_render(self):
+        registry = metrics.Registry()
+        registry.describe('requests_total', 'Requests served')
+        registry.increment('requests_total', view='market')
+        registry.increment('requests_total', 2, view='market')
+        registry.observe('latency_seconds', 0.3, buckets=(0.1, 0.5), view='market')
+
+        lines = registry.render().splitlines()
+        self.assertEqual(lines[:3], [
+            '# HELP requests_total Requests served',
+            '# TYPE requests_total counter',
+            'requests_total{view="market"} 3',
+        ])
+        self.assertIn('latency_seconds_bucket{view="market",le="0.1"} 0', lines)
+        self.assertIn('latency_seconds_bucket{view="market",le="0.5"} 1', lines)
+        self.assertIn('latency_seconds_bucket{view="market",le="+Inf"} 1', lines)
+        self.assertIn('latency_seconds_count{view="market"} 1', lines)
+        self.assertIn('# TYPE latency_seconds_quantile gauge', lines)
+
+    def test_timers_feed_the_histogram_and_the_request(self):
+        @metrics.timed('unit_test_section')
+        def work():
+            return 'done'
+
+        timings = []
+        token = metrics._request_timings.set(timings)
+        try:
+            self.assertEqual(work(), 'done')
+        finally:
+            metrics._request_timings.reset(token)
+        work()  # outside a request, only the histogram sees it
+
+        self.assertEqual([name for name, _ in timings], ['unit_test_section'])
+        key = (f'{metrics.NAMESPACE}_timing_seconds', (('section', 'unit_test_section'),))
+        self.assertEqual(metrics.registry.histograms[key].count, 2)
+
+
+class ServerTimingMiddlewareTests(SimpleTestCase):
+    @staticmethod
+    def view(request):
+        with metrics.timer('analyze'):
+            return HttpResponse('ok')
+
+    def test_off_by_default(self):
+        with override_settings(METRICS={}):
+            response = metrics.ServerTimingMiddleware(self.view)(RequestFactory().get('/'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(METRICS={'server_timing': True})
+    def test_lists_the_request_sections(self):
+        response = metrics.ServerTimingMiddleware(self.view)(RequestFactory().get('/'))
+        self.assertRegex(response['Server-Timing'], r'^analyze;dur=\d+\.\d{2}, total;dur=\d+\.\d{2}$')
+
+    @override_settings(METRICS={'server_timing': True})
+    def test_async(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = metrics.ServerTimingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = asyncio.run(middleware(RequestFactory().get('/')))
+        self.assertTrue(response['Server-Timing'].startswith('analyze;dur='))
+
+
+class ReferenceCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ReferenceCache('rates', ttl=60, stale_ttl=600)
+        self.loads = 0
+
+    def loader(self, value='fresh'):
+        def load():
+            self.loads += 1
+            return value
+        return load
+
+    def age(self, key, value, seconds):
+        self.cache._local[key] = (value, time.time() - seconds)
+
+    def wait_for_refresh(self):
+        deadline = time.monotonic() + 5
+        while self.cache._refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.cache._refreshing)
+
+    def test_fresh_values_are_served_without_loading(self):
+        self.assertEqual(self.cache.get('usd', self.loader()), 'fresh')
+        self.assertEqual(self.cache.get('usd', self.loader('other')), 'fresh')
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.stats()['hit_rate'], 0.5)
+
+    def test_stale_values_are_served_while_one_refresh_runs(self):
+        self.age('usd', 'stale', 120)
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        def slow_load():
+            released.wait(5)
+            return self.loader()()
+
+        # Every stale lookup returns at once, and only the first starts a refresh
+        self.assertEqual([self.cache.get('usd', slow_load) for _ in range(3)], ['stale'] * 3)
+        released.set()
+        self.wait_for_refresh()
+
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.get('usd', self.loader('other')), 'fresh')
+        self.assertEqual((self.cache.counters['stale_hits'], self.cache.counters['refreshes']), (3, 1))
+
+    def test_expired_values_are_loaded_on_the_caller(self):
+        self.age('usd', 'expired', 700)
+        self.assertEqual(self.cache.get('usd', self.loader()), 'fresh')
+        self.assertEqual(self.cache.counters['misses'], 1)
+        self.assertFalse(self.cache._refreshing)
+
+    def test_failed_loads_are_not_cached(self):
+        self.assertIsNone(self.cache.get('usd', self.loader(None)))
+        self.assertEqual(self.cache.get('usd', self.loader()), 'fresh')
+        self.assertEqual(self.cache.counters['errors'], 1)
+
+    def test_aget(self):
+        async def aload(value='fresh'):
+            self.loads += 1
+            await asyncio.sleep(0)
+            return value
+
+        async def lookups():
+            first = await self.cache.aget('usd', aload)
+            second = await self.cache.aget('usd', lambda: aload('other'))
+            self.age('usd', 'stale', 120)
+            stale = [await self.cache.aget('usd', lambda: aload('refreshed')) for _ in range(3)]
+            await asyncio.gather(*self.cache._tasks)
+            return first, second, stale, await self.cache.aget('usd', aload)
+
+        first, second, stale, refreshed = asyncio.run(lookups())
+        self.assertEqual((first, second, stale, refreshed), ('fresh', 'fresh', ['stale'] * 3, 'refreshed'))
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(self.cache.counters['refreshes'], 1)
+
+    def test_shared_tier_serves_other_workers(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        worker, other_worker = (ReferenceCache('rates', ttl=60, shared=True, cache_alias='default') for _ in range(2))
+
+        self.assertEqual(worker.get('usd', self.loader()), 'fresh')
+        self.assertEqual(other_worker.get('usd', self.loader('other')), 'fresh')
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(other_worker.counters['shared_hits'], 1)
+
+
+BYBIT_TICKERS = {'retCode': 0, 'result': {'list': [
+    {'symbol': 'BTCUSDT', 'lastPrice': '60000', 'volume24h': '1000'},
+    {'symbol': 'ETHUSDT', 'lastPrice': '3000', 'volume24h': ''},
+    {'symbol': 'SOLUSDT', 'lastPrice': '', 'volume24h': '10'},  # never traded
+    {'symbol': 'BTCUSDC', 'lastPrice': '60010', 'volume24h': '5'},
+]}}
+
+VALR_MARKET_SUMMARY = [
+    {'currencyPair': 'BTCZAR', 'lastTradedPrice': '1098000', 'baseVolume': '20'},
+    {'currencyPair': 'ETHZAR', 'lastTradedPrice': '53100', 'baseVolume': '300'},
+    {'currencyPair': 'XRPZAR', 'lastTradedPrice': '11', 'baseVolume': '50000'},
+    {'currencyPair': 'BTCUSDC', 'lastTradedPrice': '60000', 'baseVolume': '1'},
+]
+
+
+class FixtureAdapter(venues.VenueAdapter):
+    def __init__(self, name, currency, tickers):
+        self.name, self.currency, self.tickers = name, currency, tickers
+
+    def fetch_tickers(self):
+        return self.tickers
+
+
+class VenueTests(SimpleTestCase):
+    def respond(self, payload):
+        client = mock.Mock()
+        client.get.return_value.content = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        return mock.patch('bot.venues.get_client', return_value=client)
+
+    def test_bybit_tickers(self):
+        with self.respond(BYBIT_TICKERS) as get_client:
+            tickers = venues.BybitAdapter().fetch_tickers()
+        get_client.return_value.get.assert_called_once_with(venues.BYBIT_TICKER_ENDPOINT, params={'category': 'spot'})
+        self.assertEqual(tickers, {
+            'BTC': {'last_price': Decimal('60000'), 'base_volume': Decimal('1000')},
+            'ETH': {'last_price': Decimal('3000'), 'base_volume': Decimal('0')},
+        })
+
+        with self.respond({'retCode': 10001, 'retMsg': 'params error'}):
+            self.assertIsNone(venues.BybitAdapter().fetch_tickers())
+
+    def test_valr_tickers(self):
+        with self.respond(VALR_MARKET_SUMMARY):
+            tickers = venues.ValrAdapter().fetch_tickers()
+        self.assertEqual(sorted(tickers), ['BTC', 'ETH', 'XRP'])
+        self.assertEqual(tickers['BTC'], {'last_price': Decimal('1098000'), 'base_volume': Decimal('20')})
+
+        with self.respond(b'<html>502 Bad Gateway</html>'), self.assertLogs('bot.upstream', 'ERROR'):
+            self.assertIsNone(venues.ValrAdapter().fetch_tickers())
+
+    def scan(self, usd_tickers, zar_tickers, **kwargs):
+        adapters = [FixtureAdapter('usd-venue', 'USD', usd_tickers), FixtureAdapter('zar-venue', 'ZAR', zar_tickers)]
+        return venues.scan_premiums(venues=adapters, **kwargs)
+
+    def test_scanner_ranks_every_base_on_both_venues(self):
+        with self.respond(BYBIT_TICKERS):
+            usd_tickers = venues.BybitAdapter().fetch_tickers()
+        with self.respond(VALR_MARKET_SUMMARY):
+            zar_tickers = venues.ValrAdapter().fetch_tickers()
+
+        opportunities = self.scan(usd_tickers, zar_tickers, bases=['ETH', 'BTC', 'XRP'], exchange_rate=Decimal('18'))
+
+        # XRP only trades on the ZAR venue
+        self.assertEqual([o['base'] for o in opportunities], ['BTC', 'ETH'])
+        btc, eth = opportunities
+        self.assertEqual((btc['zar_venue'], btc['usd_venue']), ('zar-venue', 'usd-venue'))
+        self.assertEqual(btc['zar_price_usd'], Decimal('61000'))
+        self.assertEqual(btc['premium_usd'], Decimal('1000'))
+        self.assertAlmostEqual(btc['premium_percentage'], Decimal('1.6667'), places=4)
+        self.assertAlmostEqual(eth['premium_percentage'], Decimal('-1.6667'), places=4)
+        self.assertEqual((eth['zar_volume'], eth['usd_volume']), (Decimal('300'), Decimal('0')))
+
+    def test_scanner_without_tickers_or_a_rate(self):
+        tickers = {'BTC': {'last_price': Decimal('60000'), 'base_volume': Decimal('1')}}
+        self.assertEqual(self.scan(None, tickers, bases=['BTC'], exchange_rate=Decimal('18')), [])
+        with mock.patch('bot.venues.get_exchange_rate', return_value=None), self.assertLogs('bot.venues', 'WARNING'):
+            self.assertEqual(self.scan(tickers, tickers, bases=['BTC']), [])
+
+
+class UpstreamTests(SimpleTestCase):
+    def setUp(self):
+        self.loaded = []
+        self.failing = set()
+        self.blocked = {}
+        patcher = mock.patch('bot.upstream.load', self.load)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def load(self, name):
+        self.loaded.append(name)
+        if name in self.blocked:
+            self.blocked[name].wait(5)
+        return None if name in self.failing else UPSTREAM_PAYLOADS[name]
+
+    def test_full_snapshot_plan_skips_the_kline(self):
+        self.assertEqual(upstream.plan(services.SNAPSHOT_FIELDS),
+                         ['bybit_ticker', 'bybit_orderbook', 'valr_summary', 'valr_orderbook', 'fx'])
+        self.assertEqual(upstream.plan(['valr_ticker', 'valr_volume', 'valr_turnover']), ['valr_summary'])
+
+    def test_kline_serves_volume_when_the_ticker_is_excluded(self):
+        self.assertEqual(upstream.plan(['bybit_volume'], exclude=['bybit_ticker']), ['bybit_kline'])
+        # Nothing else serves the turnover, so it drops out of the plan
+        self.assertEqual(upstream.plan(['bybit_volume', 'bybit_turnover'], exclude=['bybit_ticker']), ['bybit_kline'])
+
+    def test_fetch_falls_back_to_the_kline_when_the_ticker_fails(self):
+        self.failing.add('bybit_ticker')
+        values = upstream.fetch(['bybit_ticker', 'bybit_volume', 'exchange_rate'])
+        self.assertEqual(values, {'bybit_volume': Decimal('900'), 'exchange_rate': Decimal('18.0')})
+        self.assertEqual(self.loaded, ['bybit_ticker', 'fx', 'bybit_kline'])
+
+    def test_fetch_market_snapshot(self):
+        snapshot = services.fetch_market_snapshot()
+        self.assertEqual(snapshot.missing, [])
+        self.assertEqual(sorted(self.loaded), ['bybit_orderbook', 'bybit_ticker', 'fx', 'valr_orderbook', 'valr_summary'])
+        self.assertEqual((snapshot.bybit_ticker, snapshot.bybit_volume, snapshot.valr_ticker, snapshot.exchange_rate),
+                         (Decimal('62000'), Decimal('1200'), Decimal('1080000'), Decimal('18.0')))
+        self.assertIs(snapshot.valr_orderbook, UPSTREAM_PAYLOADS['valr_orderbook'])
+
+    def test_fetch_market_snapshot_leaves_late_and_failed_fields_missing(self):
+        released = threading.Event()
+        self.addCleanup(released.set)
+        self.blocked['valr_orderbook'] = released
+        self.failing.add('fx')
+
+        started = time.monotonic()
+        with self.assertLogs('bot.upstream', 'WARNING') as logs:
+            snapshot = services.fetch_market_snapshot(deadline=0.2)
+        self.assertIn('valr_orderbook missed the 0.2s deadline', logs.output[0])
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(snapshot.missing, ['valr_orderbook', 'exchange_rate'])
+        self.assertIsNone(snapshot.valr_orderbook)
+        self.assertEqual(snapshot.valr_ticker, Decimal('1080000'))
+
+
+class SimulatorLoadTests(SimpleTestCase):
+    def test_fetch_market_snapshot_against_the_simulator(self):
+        with simulating(depth=10, seed=1) as simulator:
+            snapshot = services.fetch_market_snapshot()
+            self.assertEqual(snapshot.missing, [])
+            self.assertEqual((len(snapshot.bybit_orderbook['bids']), len(snapshot.valr_orderbook['asks'])), (10, 10))
+            self.assertAlmostEqual(float(snapshot.exchange_rate), simulator.exchange_rate, delta=1)
+
+            result = drive_load(pipeline_targets()['fetch_market_snapshot'], concurrency=4, duration=0.5)
+        self.assertEqual(result['errors'], {})
+        self.assertGreater(result['rounds'], 0)
+        self.assertLessEqual(result['median'], result['max'])
+
+
+@override_settings(SNAPSHOT_CACHE_ALIAS='default')
+class SnapshotStoreTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+
+    def test_nothing_published(self):
+        self.assertIsNone(store.latest_snapshot())
+        self.assertIsNone(store.latest_version())
+
+    def test_publish_versions_the_latest_snapshot(self):
+        with mock.patch('bot.store.time.time_ns', return_value=1_700_000_000_123_456_789):
+            version = store.publish_snapshot(market_snapshot(time.time()))
+        self.assertEqual(version, 1_700_000_000_123)
+        self.assertEqual(store.latest_version(), version)
+        latest = store.latest_snapshot()
+        self.assertEqual((latest.version, latest.bybit_ticker), (version, Decimal('62000')))
+
+        newer = store.publish_snapshot(market_snapshot(time.time(), bybit_bid='63000'))
+        self.assertGreater(newer, version)
+        self.assertEqual(store.latest_version(), newer)
+        self.assertEqual(store.latest_snapshot().bybit_ticker, Decimal('63000'))
+
+    def test_max_age(self):
+        version = store.publish_snapshot(market_snapshot(time.time() - 60))
+        with self.assertLogs('bot.store', 'WARNING'):
+            self.assertIsNone(store.latest_snapshot(max_age=30))
+        self.assertIsNone(store.latest_version(max_age=30))
+        self.assertEqual(store.latest_snapshot(max_age=120).version, version)
+        self.assertEqual(store.latest_version(max_age=120), version)
+
+
+class IngestCommandTests(SimpleTestCase):
+    def command(self):
+        command = ingest_market_data.Command(stdout=io.StringIO())
+        command.engine = command.recorder = command.snapshot_file = command.alerts = None
+        return command
+
+    @override_settings(SNAPSHOT_CACHE_ALIAS='default')
+    def test_once_publishes_and_records_a_snapshot(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'snapshots.rec')
+
+        fetched_at = time.time()
+        with mock.patch('bot.services.fetch_market_snapshot', return_value=market_snapshot(fetched_at)) as fetch:
+            call_command('ingest_market_data', '--once', '--no-history', '--no-alerts', '--snapshot-file', path,
+                         stdout=io.StringIO())
+        fetch.assert_called_once_with()
+        self.assertEqual(store.latest_snapshot().fetched_at, fetched_at)
+        recording = Recording(path)
+        self.addCleanup(recording.close)
+        self.assertEqual(len(recording), 1)
+        self.assertEqual(recording.timestamp(0), fetched_at)
+
+    def test_publish_trades_before_storing_the_snapshot(self):
+        command = self.command()
+        calls = []
+        command.engine = mock.Mock(submit=mock.Mock(side_effect=lambda *args: calls.append('submit')))
+        command.recorder = mock.Mock(record=mock.Mock(side_effect=lambda snapshot: calls.append('record')))
+        command.alerts = mock.Mock(evaluate=mock.Mock(side_effect=lambda snapshot: calls.append('alerts')))
+        snapshot = market_snapshot(time.time(), missing=['bybit_turnover', 'valr_turnover'])
+
+        with mock.patch('bot.store.publish_snapshot', side_effect=lambda snapshot: calls.append('publish') or 1), \
+                self.assertLogs('bot.management.commands.ingest_market_data', 'INFO'):
+            command.publish(snapshot)
+        self.assertEqual(calls, ['submit', 'publish', 'record', 'alerts'])
+        submitted, analysis, _ = command.engine.submit.call_args.args
+        self.assertIs(submitted, snapshot)
+        self.assertEqual(analysis['tradable_volume'], Decimal('1'))
+
+    def test_snapshot_with_every_field_missing_is_not_published(self):
+        command = self.command()
+        command.engine = mock.Mock()
+        snapshot = MarketSnapshot(missing=list(services.SNAPSHOT_FIELDS))
+        with mock.patch('bot.store.publish_snapshot') as publish, \
+                self.assertLogs('bot.management.commands.ingest_market_data', 'ERROR'):
+            command.publish(snapshot)
+        publish.assert_not_called()
+        command.engine.submit.assert_not_called()
+
+    def test_tradable_opportunities_wake_the_publish_loop_and_logs_are_rate_limited(self):
+        command = self.command()
+        tradable = {'tradable_volume': Decimal('0.5'), 'average_spread_percentage': Decimal('2'), 'levels': 3}
+        nothing = {'tradable_volume': Decimal('0'), 'average_spread_percentage': None, 'levels': 0}
+
+        with self.assertLogs('bot.management.commands.ingest_market_data', 'DEBUG') as logs:
+            command.opportunity_changed(nothing)
+            self.assertFalse(command.opportunity_ready.is_set())
+            command.opportunity_changed(tradable)
+            self.assertTrue(command.opportunity_ready.is_set())
+        self.assertEqual([record.levelname for record in logs.records], ['INFO', 'DEBUG'])
@@ -0,0 +1,229 @@
+import base64
+import logging
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, FloatField, Max, Prefetch, Q, Sum
+from django.db.models.functions import Cast, TruncDay, TruncWeek
+from django.utils import timezone
+
+from bot.models import Trade, TradeLevel, TradePnlRollup
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable via settings.TRADE_HISTORY
+DEFAULT_TRADE_HISTORY_OPTIONS = {
+    'page_size': 50,
+    'max_page_size': 200,
+    # Serve finished P&L periods from TradePnlRollup (kept fresh by manage.py rollup_trades)
+    'use_rollups': False,
+    'batch_size': 500,      # rows per bulk_create when refreshing rollups
+}
+
+# Period -> truncation function bucketing trades into it
+PERIODS = {
+    TradePnlRollup.DAY: TruncDay,
+    TradePnlRollup.WEEK: TruncWeek,
+}
+
+def trade_history_options():
+    return {**DEFAULT_TRADE_HISTORY_OPTIONS, **getattr(settings, 'TRADE_HISTORY', {})}
+
+
+def encode_cursor(trade):
+    """Opaque cursor pointing just past a trade in (-created_at, -id) order"""
+    return base64.urlsafe_b64encode(f'{trade.created_at.isoformat()}|{trade.id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor; ValueError if it is malformed"""
+    try:
+        created_at, trade_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        return datetime.fromisoformat(created_at), int(trade_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+def trade_page(cursor=None, limit=None, status=None):
+    """One page of trades, newest first, with their levels; returns (trades, next cursor or None).
+
+    Pages are keyset paginated on (created_at, id), so every page is a range
+    scan of trade_created_idx (or trade_status_created_idx when filtering by
+    status) however deep it is, and levels come in one extra query per page.
+    """
+    options = trade_history_options()
+    limit = max(1, min(limit or options['page_size'], options['max_page_size']))
+
+    trades = Trade.objects.order_by('-created_at', '-id').prefetch_related(
+        Prefetch('levels', queryset=TradeLevel.objects.order_by('id'))
+    )
+    if status:
+        trades = trades.filter(status=status)
+    if cursor:
+        created_at, trade_id = decode_cursor(cursor)
+        # A plain range on created_at keeps the index usable; the exclude only
+        # drops the few rows sharing the cursor's timestamp
+        trades = trades.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=trade_id)
+
+    page = list(trades[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+def trade_to_dict(trade):
+    """JSON-ready trade with its (prefetched) levels"""
+    return {
+        'id': trade.id,
+        'created_at': trade.created_at.isoformat(),
+        'status': trade.status,
+        'btc_volume': trade.btc_volume,
+        'investment_amount_zar': trade.investment_amount_zar,
+        'bybit_price_usd': trade.bybit_price_usd,
+        'valr_price_zar': trade.valr_price_zar,
+        'usd_zar_rate': trade.usd_zar_rate,
+        'premium_percentage': trade.premium_percentage,
+        'profit_zar': trade.profit_zar,
+        'profit_percentage': trade.profit_percentage,
+        'bybit_ack_ms': trade.bybit_ack_ms,
+        'valr_ack_ms': trade.valr_ack_ms,
+        'levels': [
+            {
+                'bybit_price_usd': level.bybit_price_usd,
+                'valr_price_zar': level.valr_price_zar,
+                'btc_volume': level.btc_volume,
+                'spread_percentage': level.spread_percentage,
+            }
+            for level in trade.levels.all()
+        ],
+    }
+
+
+def period_start(moment, period):
+    """Start of the day or (Monday-based) week containing moment, as TruncDay / TruncWeek compute it"""
+    start = timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == TradePnlRollup.WEEK:
+        start -= timedelta(days=start.weekday())
+    return start
+
+def aggregate_pnl(trades, period):
+    """Per-period trade count, wins, volume, investment, P&L and win rate, all computed by the database"""
+    return (
+        trades.annotate(period_start=PERIODS[period]('created_at'))
+        .values('period_start')
+        .annotate(
+            trade_count=Count('id'),
+            win_count=Count('id', filter=Q(profit_zar__gt=0)),
+            win_rate=Cast(Count('id', filter=Q(profit_zar__gt=0)), FloatField()) / Cast(Count('id'), FloatField()),
+            volume_btc=Sum('btc_volume'),
+            invested_zar=Sum('investment_amount_zar'),
+            pnl_zar=Sum('profit_zar'),
+        )
+        .order_by('period_start')
+    )
+
+def pnl_summary(period, start, end=None, use_rollups=None):
+    """P&L of completed trades per period from the period containing start up to end.
+
+    With rollups on, every period before the newest materialized one is read
+    from TradePnlRollup and only the rest is aggregated from trades.
+    """
+    if use_rollups is None:
+        use_rollups = trade_history_options()['use_rollups']
+    start = period_start(start, period)
+
+    buckets = []
+    live_from = start
+    if use_rollups:
+        rollups = TradePnlRollup.objects.filter(period=period)
+        # The newest rollup may be a partial period, so it is always aggregated live
+        newest = rollups.aggregate(newest=Max('period_start'))['newest']
+        if newest is not None and newest > start:
+            materialized = rollups.filter(period_start__gte=start, period_start__lt=newest)
+            if end is not None:
+                materialized = materialized.filter(period_start__lt=end)
+            buckets.extend(_rollup_bucket(rollup) for rollup in materialized.order_by('period_start'))
+            live_from = newest
+
+    trades = Trade.objects.filter(status=Trade.COMPLETED, created_at__gte=live_from)
+    if end is not None:
+        trades = trades.filter(created_at__lt=end)
+    buckets.extend(_bucket(row) for row in aggregate_pnl(trades, period))
+    return buckets
+
+def _bucket(row):
+    return _with_return({
+        'period_start': row['period_start'],
+        'trades': row['trade_count'],
+        'wins': row['win_count'],
+        'win_rate': row['win_rate'],
+        'btc_volume': row['volume_btc'],
+        'investment_zar': row['invested_zar'],
+        'profit_zar': row['pnl_zar'],
+    })
+
+def _rollup_bucket(rollup):
+    return _with_return({
+        'period_start': rollup.period_start,
+        'trades': rollup.trades,
+        'wins': rollup.wins,
+        'win_rate': rollup.wins / rollup.trades if rollup.trades else None,
+        'btc_volume': rollup.btc_volume,
+        'investment_zar': rollup.investment_zar,
+        'profit_zar': rollup.profit_zar,
+    })
+
+def _with_return(bucket):
+    invested, profit = bucket['investment_zar'], bucket['profit_zar']
+    bucket['profit_percentage'] = profit / invested * 100 if invested and profit is not None else None
+    return bucket
+
+def pnl_totals(buckets):
+    """Totals over a pnl_summary() result"""
+    trades = sum(bucket['trades'] for bucket in buckets)
+    wins = sum(bucket['wins'] for bucket in buckets)
+    return _with_return({
+        'trades': trades,
+        'wins': wins,
+        'win_rate': wins / trades if trades else None,
+        'btc_volume': sum(bucket['btc_volume'] or 0 for bucket in buckets),
+        'investment_zar': sum(bucket['investment_zar'] or 0 for bucket in buckets),
+        'profit_zar': sum(bucket['profit_zar'] or 0 for bucket in buckets),
+    })
+
+
+def refresh_rollups(period, full=False):
+    """Recompute materialized P&L rows from the period before the newest one on (or all of them).
+
+    Trades resolve within seconds of being created, so only the newest two
+    periods can still change; refreshing them is an index range scan.
+    """
+    rollups = TradePnlRollup.objects.filter(period=period)
+    trades = Trade.objects.filter(status=Trade.COMPLETED)
+    newest = None if full else rollups.aggregate(newest=Max('period_start'))['newest']
+    if newest is not None:
+        trades = trades.filter(created_at__gte=period_start(newest - timedelta(days=1), period))
+
+    rows = [
+        TradePnlRollup(
+            period=period,
+            period_start=row['period_start'],
+            trades=row['trade_count'],
+            wins=row['win_count'],
+            btc_volume=row['volume_btc'] or 0,
+            investment_zar=row['invested_zar'] or 0,
+            profit_zar=row['pnl_zar'] or 0,
+        )
+        for row in aggregate_pnl(trades, period)
+    ]
+
+    with transaction.atomic():
+        if full:
+            rollups.delete()
+        TradePnlRollup.objects.bulk_create(
+            rows,
+            batch_size=trade_history_options()['batch_size'],
+            update_conflicts=True,
+            unique_fields=['period', 'period_start'],
+            update_fields=['trades', 'wins', 'btc_volume', 'investment_zar', 'profit_zar', 'refreshed_at'],
+        )
+
+    logger.info(f"Refreshed {len(rows)} {period} P&L rollups")
+    return len(rows)
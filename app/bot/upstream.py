@@ -0,0 +1,219 @@
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from concurrent.futures import wait
+from dataclasses import dataclass
+
+import requests
+
+from bot import codec, metrics
+from bot.cache import get_cache
+from bot.clients import get_async_client, get_client
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Resource:
+    """One upstream HTTP resource. Within a fetch it is requested and decoded at most once,
+    however many fields are extracted from it.
+
+    ``decode`` turns the response body into the payload extractors read (the
+    codec's loads by default). With ``cache`` set, the decoded payload is kept
+    in that reference cache (see bot.cache) instead of being fetched every time.
+    """
+    client: str
+    base_url: str
+    path: str
+    params: dict = None
+    decode: object = None
+    cache: str = None
+
+
+# Resource name -> Resource
+RESOURCES = {}
+
+# Field -> {resource name: extractor(payload)}, in order of preference
+SOURCES = {}
+
+
+def register_resource(name, resource):
+    RESOURCES[name] = resource
+    _plan.cache_clear()
+    return resource
+
+def extractor(field, resource):
+    """Register the decorated function as a way to read `field` out of a resource's payload.
+
+    A field may be served by several resources; the ones registered first are
+    preferred when the planner has a choice.
+    """
+    def register(func):
+        SOURCES.setdefault(field, {})[resource] = func
+        _plan.cache_clear()
+        return func
+    return register
+
+
+def plan(fields, exclude=()):
+    """The smallest set of resources that covers `fields`, as resource names.
+
+    Ties go to the resources registered first. Resources in `exclude` are never
+    picked, and fields no remaining resource serves are left out of the plan.
+    """
+    return list(_plan(tuple(sorted(set(fields))), tuple(sorted(set(exclude)))))
+
+@functools.lru_cache(maxsize=64)
+def _plan(fields, exclude):
+    candidates = [
+        name for name in RESOURCES
+        if name not in exclude and any(name in SOURCES.get(field, ()) for field in fields)
+    ]
+    wanted = [set(SOURCES[field]).intersection(candidates) for field in fields if field in SOURCES]
+    wanted = [sources for sources in wanted if sources]
+
+    # A handful of resources per venue, so checking every subset by size is cheap
+    for size in range(len(candidates) + 1):
+        for chosen in itertools.combinations(candidates, size):
+            if all(sources.intersection(chosen) for sources in wanted):
+                return chosen
+    return tuple(candidates)
+
+
+def extract(fields, payloads):
+    """Values of `fields` from already decoded payloads ({resource name: payload or None}).
+
+    Each field is read from the first preferred resource that has a payload and
+    yields a value; fields nothing yields are left out.
+    """
+    values = {}
+    for field in fields:
+        for name, extract_field in SOURCES.get(field, {}).items():
+            payload = payloads.get(name)
+            if payload is None:
+                continue
+            try:
+                value = extract_field(payload)
+            except Exception as e:
+                report_failure(f'extract_{field}', e)
+                continue
+            if value is not None:
+                values[field] = value
+                break
+    return values
+
+
+def fetch(fields, deadline=None, executor=None):
+    """Fetch `fields` with as few upstream calls as possible, returning {field: value}.
+
+    The planned resources are requested concurrently on `executor` (one after
+    another without one) and anything still running at `deadline` seconds is
+    dropped. Fields whose resource failed are retried from another resource
+    that serves them, if there is one and time is left. Missing fields are
+    left out of the result.
+    """
+    ends = None if deadline is None else time.monotonic() + deadline
+    payloads = {}
+    values = {}
+    pending = list(fields)
+    while pending:
+        resources = plan(pending, exclude=payloads)
+        if not resources:
+            break
+
+        if executor is None:
+            payloads.update((name, load(name)) for name in resources)
+        else:
+            futures = {name: executor.submit(load, name) for name in resources}
+            wait(futures.values(), timeout=None if ends is None else max(0.0, ends - time.monotonic()))
+            for name, future in futures.items():
+                if future.done():
+                    payloads[name] = future.result()  # load() never raises
+                else:
+                    future.cancel()
+                    logger.warning(f"Upstream resource {name} missed the {deadline}s deadline")
+                    payloads[name] = None
+
+        values.update(extract(pending, payloads))
+        pending = [field for field in pending if field not in values]
+        if ends is not None and time.monotonic() >= ends:
+            break
+    return values
+
+async def afetch(fields, deadline=None):
+    """Async fetch(): the planned resources are requested as tasks on the running loop"""
+    ends = None if deadline is None else time.monotonic() + deadline
+    payloads = {}
+    values = {}
+    pending = list(fields)
+    while pending:
+        resources = plan(pending, exclude=payloads)
+        if not resources:
+            break
+
+        tasks = {name: asyncio.ensure_future(aload(name)) for name in resources}
+        await asyncio.wait(tasks.values(), timeout=None if ends is None else max(0.0, ends - time.monotonic()))
+        for name, task in tasks.items():
+            if task.done():
+                payloads[name] = task.result()  # aload() never raises
+            else:
+                task.cancel()
+                logger.warning(f"Upstream resource {name} missed the {deadline}s deadline")
+                payloads[name] = None
+
+        values.update(extract(pending, payloads))
+        pending = [field for field in pending if field not in values]
+        if ends is not None and time.monotonic() >= ends:
+            break
+    return values
+
+
+def load(name):
+    """Decoded payload of a resource (through its reference cache, if it has one), or None on failure"""
+    resource = RESOURCES[name]
+    if resource.cache:
+        return get_cache(resource.cache).get(name, lambda: _request(name, resource))
+    return _request(name, resource)
+
+async def aload(name):
+    resource = RESOURCES[name]
+    if resource.cache:
+        return await get_cache(resource.cache).aget(name, lambda: _arequest(name, resource))
+    return await _arequest(name, resource)
+
+def _request(name, resource):
+    try:
+        with metrics.timer(f'fetch_{name}'):
+            response = get_client(resource.client, resource.base_url).get(resource.path, params=resource.params)
+            return _decode(resource, response.content)
+    except Exception as e:
+        return report_failure(f'fetch_{name}', e)
+
+async def _arequest(name, resource):
+    try:
+        with metrics.timer(f'fetch_{name}'):
+            client = get_async_client(resource.client, resource.base_url)
+            response = await client.get(resource.path, params=resource.params)
+            return _decode(resource, response.content)
+    except Exception as e:
+        return report_failure(f'fetch_{name}', e)
+
+def _decode(resource, content):
+    with metrics.timer('decode', client=resource.client):
+        return resource.decode(content) if resource.decode is not None else codec.loads(content)
+
+
+def report_failure(name, e):
+    """Log and count a failed upstream call or extraction; returns None for the caller to pass on"""
+    if isinstance(e, requests.RequestException):
+        logger.error(f"API request failed in {name}: {e}")
+        metrics.increment('fetch_errors_total', function=name, reason='request')
+    elif isinstance(e, codec.decode_errors()):
+        logger.error(f"JSON parsing error in {name}: {e}")
+        metrics.increment('fetch_errors_total', function=name, reason='json')
+    else:
+        logger.error(f"Unexpected error in {name}: {str(e)}", exc_info=True)
+        metrics.increment('fetch_errors_total', function=name, reason='unexpected')
+    return None
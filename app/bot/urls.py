@@ -1,8 +1,23 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI (settings.ASYNC_VIEWS) the market data views wait on the upstreams without holding a thread
+if settings.ASYNC_VIEWS:
+    market_data_view, simulate_trade_view = views.aget_market_data, views.asimulate_trade
+else:
+    market_data_view, simulate_trade_view = views.get_market_data, views.simulate_trade
+
 urlpatterns = [
     path('dash/', views.dashboard, name='dashboard'),
-    path('api/market-data/', views.get_market_data, name='market_data'),
-    path('api/simulate-trade/', views.simulate_trade, name='simulate_trade'),
+    path('api/market-data/', market_data_view, name='market_data'),
+    path('api/market-stream/', views.market_stream, name='market_stream'),
+    path('api/simulate-trade/', simulate_trade_view, name='simulate_trade'),
+    path('api/simulate-curve/', views.simulate_curve, name='simulate_curve'),
+    path('api/scan/', views.scan_premiums, name='scan_premiums'),
+    path('api/history/', views.market_history, name='market_history'),
+    path('api/trades/', views.trade_history, name='trade_history'),
+    path('api/trades/pnl/', views.trade_pnl, name='trade_pnl'),
+    path('api/cache-stats/', views.cache_stats, name='cache_stats'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
 ]
\ No newline at end of file
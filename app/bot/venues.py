@@ -0,0 +1,114 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+
+from bot import codec
+from bot.clients import get_client
+from bot.services import (
+    BYBIT_BASE_URL, BYBIT_TICKER_ENDPOINT, VALR_BASE_URL, get_exchange_rate, handle_request_errors,
+)
+
+logger = logging.getLogger(__name__)
+
+VALR_MARKET_SUMMARY_ENDPOINT = "/v1/public/marketsummary"
+
+# Base assets scanned by default, overridable via settings.SCANNER_BASES
+DEFAULT_SCANNER_BASES = ['BTC', 'ETH', 'SOL', 'XRP']
+
+
+class VenueAdapter:
+    """One exchange, quoting every base asset in a single currency, with a bulk ticker call"""
+    name = None
+    quote = None      # quote asset in the venue's symbols, e.g. USDT
+    currency = None   # currency the quote is priced in for premium maths, e.g. USD
+
+    def fetch_tickers(self):
+        """All of the venue's tickers in one request: {base: {'last_price', 'base_volume'}}"""
+        raise NotImplementedError
+
+    def _by_base(self, rows):
+        tickers = {}
+        for symbol, last_price, base_volume in rows:
+            if symbol.endswith(self.quote) and last_price:
+                tickers[symbol[:-len(self.quote)]] = {
+                    'last_price': Decimal(last_price),
+                    'base_volume': Decimal(base_volume or '0'),
+                }
+        return tickers
+
+
+class BybitAdapter(VenueAdapter):
+    name = 'bybit'
+    quote = 'USDT'
+    currency = 'USD'
+
+    @handle_request_errors
+    def fetch_tickers(self):
+        # Without a symbol the tickers endpoint returns every spot market
+        response = get_client('bybit', BYBIT_BASE_URL).get(BYBIT_TICKER_ENDPOINT, params={'category': 'spot'})
+        data = codec.loads(response.content)
+        if data['retCode'] != 0:
+            return None
+        return self._by_base((row['symbol'], row['lastPrice'], row['volume24h']) for row in data['result']['list'])
+
+
+class ValrAdapter(VenueAdapter):
+    name = 'valr'
+    quote = 'ZAR'
+    currency = 'ZAR'
+
+    @handle_request_errors
+    def fetch_tickers(self):
+        response = get_client('valr', VALR_BASE_URL).get(VALR_MARKET_SUMMARY_ENDPOINT)
+        data = codec.loads(response.content)
+        return self._by_base((row['currencyPair'], row['lastTradedPrice'], row['baseVolume']) for row in data)
+
+
+VENUES = [BybitAdapter(), ValrAdapter()]
+
+_ticker_executor = ThreadPoolExecutor(max_workers=len(VENUES), thread_name_prefix='scanner')
+
+
+def scan_premiums(bases=None, venues=None, exchange_rate=None):
+    """Premium of every ZAR venue over every USD venue for each base asset, best first.
+
+    Costs one request per venue (plus the cached FX rate) however many bases are scanned.
+    """
+    bases = bases or getattr(settings, 'SCANNER_BASES', DEFAULT_SCANNER_BASES)
+    venues = venues or VENUES
+
+    futures = {venue.name: _ticker_executor.submit(venue.fetch_tickers) for venue in venues}
+    tickers = {name: future.result() or {} for name, future in futures.items()}
+    exchange_rate = exchange_rate or get_exchange_rate()
+    if not exchange_rate:
+        logger.warning("Exchange rate not available, cannot scan premiums")
+        return []
+
+    opportunities = []
+    for zar_venue in (venue for venue in venues if venue.currency == 'ZAR'):
+        for usd_venue in (venue for venue in venues if venue.currency == 'USD'):
+            for base in bases:
+                zar_ticker = tickers[zar_venue.name].get(base)
+                usd_ticker = tickers[usd_venue.name].get(base)
+                if not zar_ticker or not usd_ticker:
+                    continue
+
+                zar_price_usd = zar_ticker['last_price'] / exchange_rate
+                premium = zar_price_usd - usd_ticker['last_price']
+                opportunities.append({
+                    'base': base,
+                    'zar_venue': zar_venue.name,
+                    'usd_venue': usd_venue.name,
+                    'zar_price': zar_ticker['last_price'],
+                    'zar_price_usd': zar_price_usd,
+                    'usd_price': usd_ticker['last_price'],
+                    'premium_usd': premium,
+                    'premium_percentage': premium / usd_ticker['last_price'] * Decimal('100'),
+                    'zar_volume': zar_ticker['base_volume'],
+                    'usd_volume': usd_ticker['base_volume'],
+                })
+
+    opportunities.sort(key=lambda opportunity: opportunity['premium_percentage'], reverse=True)
+    return opportunities
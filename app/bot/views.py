@@ -1,153 +1,422 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+import functools
+import inspect
 import bot.services as services
+import bot.history as history
+import bot.trades as trades
+import bot.venues as venues
+import bot.cache as cache
+import bot.metrics as metrics
+from bot.broadcast import SnapshotBroadcaster
+from bot.cache import AsyncSingleFlight, ResponseCache, SingleFlight
+from bot.codec import CodecJsonResponse
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Rendered responses of snapshot-derived endpoints, keyed on the snapshot version
+response_cache = ResponseCache(**getattr(settings, 'RESPONSE_CACHE', {'ttl': 5}))
+_response_builds = SingleFlight('responses')
+_async_response_builds = AsyncSingleFlight('responses')
+
+def snapshot_response(view):
+    """Serve a view's response from a cache keyed on snapshot version and query string, with ETag / 304.
+
+    Concurrent requests for an uncached response share one call to the view.
+    With no snapshot published the view runs uncached and without an ETag.
+    """
+    if inspect.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request):
+            version = await services.asnapshot_version()
+            if version is None:
+                return await view(request)
+            etag = f'W/"{version}"'
+            if _etag_matches(request, etag):
+                return _not_modified(etag)
+
+            key = (view.__name__, version, request.GET.urlencode())
+            cached = response_cache.get(key)
+            if cached is None:
+                cached = await _async_response_builds.do(key, lambda: _arender(key, view, request))
+            return _cached_response(cached, etag)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request):
+        version = services.snapshot_version()
+        if version is None:
+            return view(request)
+        etag = f'W/"{version}"'
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+
+        key = (view.__name__, version, request.GET.urlencode())
+        cached = response_cache.get(key)
+        if cached is None:
+            cached = _response_builds.do(key, lambda: _render(key, view, request))
+        return _cached_response(cached, etag)
+    return wrapper
+
+def _etag_matches(request, etag):
+    return etag in (tag.strip() for tag in request.headers.get('If-None-Match', '').split(','))
+
+def _not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+def _cached_response(cached, etag):
+    status, content_type, content = cached
+    response = HttpResponse(content, status=status, content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'  # always revalidate, it's cheap
+    return response
+
+def _render(key, view, request):
+    response = view(request)
+    rendered = (response.status_code, response['Content-Type'], response.content)
+    response_cache.set(key, rendered)
+    return rendered
+
+async def _arender(key, view, request):
+    response = await view(request)
+    rendered = (response.status_code, response['Content-Type'], response.content)
+    response_cache.set(key, rendered)
+    return rendered
+
 def dashboard(request):
     """Render the main dashboard view"""
     return render(request, 'dashboard.html')
 
+def build_market_data(snapshot):
+    """Build the JSON-ready market data payload (LGP and order book analysis) for a snapshot"""
+    # Get ByBit data
+    bybit_data = {
+        'btc_ticker': snapshot.bybit_ticker,
+        'btc_orderbook': snapshot.bybit_orderbook,
+        'volume_24h': snapshot.bybit_volume,
+        'turnover_24h': snapshot.bybit_turnover
+    }
+
+    # Get Valr data
+    valr_data = {
+        'btc_ticker': snapshot.valr_ticker,
+        'btc_orderbook': snapshot.valr_orderbook,
+        'volume_24h': snapshot.valr_volume,
+        'turnover_24h': snapshot.valr_turnover
+    }
+
+    # Get exchange rate
+    exchange_rate = snapshot.exchange_rate
+
+    # Calculate LGP (Live Gross Premium)
+    valr_btc_usd = snapshot.valr_price_usd
+    bybit_btc_usd = bybit_data['btc_ticker']
+
+    premium = Decimal(str(valr_btc_usd)) - Decimal(str(bybit_btc_usd))
+    percentage_premium = (premium / Decimal(str(bybit_btc_usd))) * Decimal('100')
+
+    # Determine if premium is suitable for trading (> 1%)
+    can_trade = percentage_premium >= services.MIN_PREMIUM_PERCENTAGE
+
+    # If premium is suitable, calculate tradable BTC
+    tradable_btc = None
+    order_book_analysis = None
+
+    if can_trade:
+        tradable_btc = services.calculate_tradable_btc(
+            bybit_data['volume_24h'], 
+            valr_data['volume_24h']
+        )
+
+        # Analyze order books to determine if trade is possible
+        order_book_analysis = services.analyze_order_books(
+            bybit_data['btc_orderbook'],
+            valr_data['btc_orderbook'],
+            tradable_btc,
+            usd_zar_rate=exchange_rate
+        )
+
+    # Decimals are left as they are, the codec writes them as JSON numbers
+    return {
+        'bybit_price_usd': bybit_btc_usd or None,
+        'valr_price_zar': valr_data['btc_ticker'] or None,
+        'valr_price_usd': valr_btc_usd or None,
+        'exchange_rate': exchange_rate or None,
+        'premium_usd': premium or None,
+        'premium_percentage': percentage_premium or None,
+        'can_trade': can_trade,
+        'tradable_btc': tradable_btc or None,
+        'order_book_analysis': order_book_analysis,
+    }
+
+@snapshot_response
 def get_market_data(request):
     """API endpoint to get the current market data"""
     try:
-        # Get ByBit data
-        bybit_data = {
-            'btc_ticker': services.bb_btc_ticker(),
-            'btc_orderbook': services.bb_btc_orderbook(),
-            'volume_24h': services.bb_btc_volume()
-        }
-        
-        # Get Valr data
-        valr_data = {
-            'btc_ticker': services.vr_btc_ticker(),
-            'btc_orderbook': services.vr_order_book(),
-            'volume_24h': services.vr_btc_volume()
-        }
-        
-        # Get exchange rate
-        exchange_rate = services.get_exchange_rate()
-        
-        # Calculate LGP (Live Gross Premium)
-        valr_btc_usd = services.zar_to_dollar(zar_price=valr_data['btc_ticker'])
-        bybit_btc_usd = bybit_data['btc_ticker']
-        
-        premium = Decimal(str(valr_btc_usd)) - Decimal(str(bybit_btc_usd))
-        percentage_premium = (premium / Decimal(str(bybit_btc_usd))) * Decimal('100')
-        
-        # Determine if premium is suitable for trading (> 1%)
-        can_trade = percentage_premium >= 1
-        
-        # If premium is suitable, calculate tradable BTC
-        tradable_btc = None
-        order_book_analysis = None
-        
-        if can_trade:
-            tradable_btc = services.calculate_tradable_btc(
-                bybit_data['volume_24h'], 
-                valr_data['volume_24h']
-            )
-            
-            # Analyze order books to determine if trade is possible
-            order_book_analysis = services.analyze_order_books(
-                bybit_data['btc_orderbook'],
-                valr_data['btc_orderbook'],
-                tradable_btc
-            )
-            
-            # Convert Decimal objects in order_book_analysis for JSON serialization
-            if order_book_analysis and 'trade_levels' in order_book_analysis:
-                serialized_levels = []
-                for level in order_book_analysis['trade_levels']:
-                    serialized_level = {
-                        'valr_price_zar': float(level['valr_price_zar']),
-                        'bybit_price_usd': float(level['bybit_price_usd']),
-                        'quantity': float(level['quantity']),
-                        'spread_percentage': float(level['spread_percentage'])
-                    }
-                    
-                    # Add valr_price_usd if present
-                    if 'valr_price_usd' in level:
-                        serialized_level['valr_price_usd'] = float(level['valr_price_usd'])
-                    else:
-                        # If not present, calculate it from ZAR price
-                        serialized_level['valr_price_usd'] = serialized_level['valr_price_zar'] / float(exchange_rate)
-                        
-                    serialized_levels.append(serialized_level)
-                
-                order_book_analysis['trade_levels'] = serialized_levels
-                order_book_analysis['can_execute'] = bool(order_book_analysis['can_execute'])
-                order_book_analysis['tradable_volume'] = float(order_book_analysis['tradable_volume'])
+        # Serve the ingestor's latest snapshot (or fetch one live if it isn't running)
+        with metrics.timer('snapshot'):
+            snapshot = services.current_snapshot()
+        return _market_data_response(snapshot)
+    except Exception as e:
+        return _market_data_error(e)
+
+@snapshot_response
+async def aget_market_data(request):
+    """get_market_data for ASGI, waiting on the store and the upstreams without holding a thread (needs httpx)"""
+    try:
+        with metrics.timer('snapshot'):
+            snapshot = await services.acurrent_snapshot()
+        return _market_data_response(snapshot)
+    except Exception as e:
+        return _market_data_error(e)
+
+def _market_data_response(snapshot):
+    with metrics.timer('build_payload'):
+        data = build_market_data(snapshot)
+
+    with metrics.timer('serialize', view='market_data'):
+        return CodecJsonResponse({
+            'success': True,
+            'data': data
+        })
+
+def _market_data_error(e):
+    logger.error(f"Error getting market data: {e}")
+    return JsonResponse({
+        'success': False,
+        'error': str(e)
+    })
+
+# One broadcaster per process, shared by every streaming client
+broadcaster = SnapshotBroadcaster(build_market_data)
+
+async def market_stream(request):
+    """Server-Sent Events endpoint pushing each new snapshot (full first, then diffs)"""
+    if not hasattr(request, 'scope'):
+        # Under WSGI an endless stream would pin a worker thread, clients fall back to polling
+        return JsonResponse({
+            'success': False,
+            'error': 'Streaming requires the ASGI server'
+        }, status=503)
+
+    response = StreamingHttpResponse(broadcaster.subscribe(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx buffering the stream
+    return response
+
+def scan_premiums(request):
+    """API endpoint scanning the premium across many assets and venues (?bases=BTC,ETH,...)"""
+    try:
+        bases = [base.strip().upper() for base in request.GET.get('bases', '').split(',') if base.strip()]
+        opportunities = venues.scan_premiums(bases or None)
+
+        return CodecJsonResponse({
+            'success': True,
+            'opportunities': opportunities
+        })
+    except Exception as e:
+        logger.error(f"Error scanning premiums: {e}")
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+def market_history(request):
+    """API endpoint returning LGP and top-of-book history for the last `hours` hours"""
+    try:
+        hours = float(request.GET.get('hours', '24'))
+        end = datetime.now(timezone.utc)
+        rows = history.premium_history(end - timedelta(hours=hours), end, request.GET.get('resolution'))
+
+        fields = ['recorded_at', 'premium_percentage', 'tradable_btc', 'bybit_price_usd', 'valr_price_zar', 'usd_zar_rate']
+        series = [
+            {name: (value.isoformat() if name == 'recorded_at' else float(value) if value is not None else None)
+             for name, value in zip(fields, row)}
+            for row in rows.values_list(*fields)
+        ]
         
         return JsonResponse({
             'success': True,
-            'data': {
-                'bybit_price_usd': float(bybit_btc_usd) if bybit_btc_usd else None,
-                'valr_price_zar': float(valr_data['btc_ticker']) if valr_data['btc_ticker'] else None,
-                'valr_price_usd': float(valr_btc_usd) if valr_btc_usd else None,
-                'exchange_rate': float(exchange_rate) if exchange_rate else None,
-                'premium_usd': float(premium) if premium else None,
-                'premium_percentage': float(percentage_premium) if percentage_premium else None,
-                'can_trade': can_trade,
-                'tradable_btc': float(tradable_btc) if tradable_btc else None,
-                'order_book_analysis': order_book_analysis,
-            }
+            'history': series
+        })
+    except Exception as e:
+        logger.error(f"Error getting market history: {e}")
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+def trade_history(request):
+    """API endpoint listing trades newest first with their levels, keyset paginated by `cursor`"""
+    try:
+        page, next_cursor = trades.trade_page(
+            cursor=request.GET.get('cursor'),
+            limit=int(request.GET['limit']) if 'limit' in request.GET else None,
+            status=request.GET.get('status'),
+        )
+        return CodecJsonResponse({
+            'success': True,
+            'trades': [trades.trade_to_dict(trade) for trade in page],
+            'next_cursor': next_cursor
         })
     except Exception as e:
-        logger.error(f"Error getting market data: {e}")
+        logger.error(f"Error getting trade history: {e}")
         return JsonResponse({
             'success': False,
             'error': str(e)
         })
 
+def trade_pnl(request):
+    """API endpoint with daily or weekly P&L and win rate of completed trades over the last `days` days"""
+    try:
+        period = request.GET.get('period', 'day')
+        if period not in trades.PERIODS:
+            raise ValueError(f"Unknown period {period!r}")
+        days = float(request.GET.get('days', '30'))
+        buckets = trades.pnl_summary(period, datetime.now(timezone.utc) - timedelta(days=days))
+        for bucket in buckets:
+            bucket['period_start'] = bucket['period_start'].isoformat()
+
+        return CodecJsonResponse({
+            'success': True,
+            'period': period,
+            'buckets': buckets,
+            'totals': trades.pnl_totals(buckets)
+        })
+    except Exception as e:
+        logger.error(f"Error getting trade P&L: {e}")
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+def cache_stats(request):
+    """API endpoint exposing reference cache hit/miss counters"""
+    return JsonResponse({
+        'success': True,
+        'caches': cache.cache_stats()
+    })
+
+def prometheus_metrics(request):
+    """Prometheus scrape endpoint: upstream and hot-path latencies, payload sizes, errors and cache hits"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Snapshot fields a trade simulation needs
+SIMULATION_FIELDS = ['bybit_ticker', 'valr_ticker', 'exchange_rate']
+
+@snapshot_response
 def simulate_trade(request):
     """API endpoint to simulate a trade based on current market conditions"""
     try:
-        investment_amount = Decimal(request.GET.get('amount', '10000'))  # Default 10,000 ZAR
-        
-        # Get current market data
-        bybit_btc_usd = services.bb_btc_ticker()
-        valr_btc_usd = services.vr_btc_ticker()
-        exchange_rate = services.get_exchange_rate()
-        
-        premium = Decimal(str(valr_btc_usd)) - Decimal(str(bybit_btc_usd))
-        percentage_premium = (premium / Decimal(str(bybit_btc_usd))) * Decimal('100')
+        return _simulate_trade(request, services.current_snapshot(fields=SIMULATION_FIELDS))
+    except Exception as e:
+        return _simulate_trade_error(e)
 
-        
-        # Check if premium is suitable for trading
-        if percentage_premium < 1:
+@snapshot_response
+async def asimulate_trade(request):
+    """simulate_trade for ASGI (needs httpx)"""
+    try:
+        return _simulate_trade(request, await services.acurrent_snapshot(fields=SIMULATION_FIELDS))
+    except Exception as e:
+        return _simulate_trade_error(e)
+
+def _simulate_trade(request, snapshot):
+    investment_amount = Decimal(request.GET.get('amount', '10000'))  # Default 10,000 ZAR
+    
+    # Get current market data
+    bybit_btc_usd = snapshot.bybit_ticker
+    valr_btc_usd = snapshot.valr_ticker
+    exchange_rate = snapshot.exchange_rate
+    
+    premium = Decimal(str(valr_btc_usd)) - Decimal(str(bybit_btc_usd))
+    percentage_premium = (premium / Decimal(str(bybit_btc_usd))) * Decimal('100')
+
+    
+    # Check if premium is suitable for trading
+    if percentage_premium < services.MIN_PREMIUM_PERCENTAGE:
+        return JsonResponse({
+            'success': False,
+            'message': f'Premium too low ({percentage_premium:.2f}%)'
+        })
+    
+    # Calculate amount of BTC to buy on ByBit
+    investment_usd = investment_amount / exchange_rate
+    btc_amount = investment_usd / bybit_btc_usd
+    
+    # Calculate expected profit
+    sell_value_zar = btc_amount * valr_btc_usd
+    expected_profit_zar = sell_value_zar - investment_amount
+    expected_profit_percentage = (expected_profit_zar / investment_amount) * 100
+    
+    return JsonResponse({
+        'success': True,
+        'simulation': {
+            'investment_amount_zar': float(investment_amount),
+            'investment_amount_usd': float(investment_usd),
+            'btc_amount': float(btc_amount),
+            'bybit_buy_price_usd': float(bybit_btc_usd),
+            'valr_sell_price_zar': float(valr_btc_usd),
+            'expected_profit_zar': float(expected_profit_zar),
+            'expected_profit_percentage': float(expected_profit_percentage),
+            'exchange_rate': float(exchange_rate)
+        }
+    })
+
+def _simulate_trade_error(e):
+    logger.error(f"Error simulating trade: {e}")
+    return JsonResponse({
+        'success': False,
+        'error': str(e)
+    })
+
+# Most amounts one batch simulation may price
+MAX_SIMULATION_AMOUNTS = 1000
+
+@snapshot_response
+def simulate_curve(request):
+    """API endpoint simulating many investment sizes against the order books in one pass.
+
+    Takes ?amounts=1000,5000,... or ?start=&stop=&steps= (ZAR), and optionally ?fee= (%).
+    """
+    try:
+        if request.GET.get('amounts'):
+            amounts = [Decimal(amount) for amount in request.GET['amounts'].split(',') if amount.strip()]
+        else:
+            start = Decimal(request.GET.get('start', '1000'))
+            stop = Decimal(request.GET.get('stop', '100000'))
+            steps = int(request.GET.get('steps', '50'))
+            amounts = [start + (stop - start) * i / max(steps - 1, 1) for i in range(steps)]
+
+        if not amounts or len(amounts) > MAX_SIMULATION_AMOUNTS or any(amount <= 0 for amount in amounts):
+            return JsonResponse({
+                'success': False,
+                'error': f'Between 1 and {MAX_SIMULATION_AMOUNTS} positive amounts are required'
+            }, status=400)
+
+        snapshot = services.current_snapshot()
+        if snapshot.bybit_orderbook is None or snapshot.valr_orderbook is None or not snapshot.exchange_rate:
             return JsonResponse({
                 'success': False,
-                'message': f'Premium too low ({percentage_premium:.2f}%)'
+                'error': 'Order books unavailable'
             })
-        
-        # Calculate amount of BTC to buy on ByBit
-        investment_usd = investment_amount / exchange_rate
-        btc_amount = investment_usd / bybit_btc_usd
-        
-        # Calculate expected profit
-        sell_value_zar = btc_amount * valr_btc_usd
-        expected_profit_zar = sell_value_zar - investment_amount
-        expected_profit_percentage = (expected_profit_zar / investment_amount) * 100
-        
-        return JsonResponse({
+
+        fee = Decimal(request.GET.get('fee', str(services.TAKER_FEE_PERCENTAGE)))
+        return CodecJsonResponse({
             'success': True,
-            'simulation': {
-                'investment_amount_zar': float(investment_amount),
-                'investment_amount_usd': float(investment_usd),
-                'btc_amount': float(btc_amount),
-                'bybit_buy_price_usd': float(bybit_btc_usd),
-                'valr_sell_price_zar': float(valr_btc_usd),
-                'expected_profit_zar': float(expected_profit_zar),
-                'expected_profit_percentage': float(expected_profit_percentage),
-                'exchange_rate': float(exchange_rate)
-            }
+            'version': snapshot.version,
+            'exchange_rate': snapshot.exchange_rate,
+            'fee_percentage': fee,
+            'simulations': services.simulate_trades(snapshot, amounts, fee),
         })
     except Exception as e:
-        logger.error(f"Error simulating trade: {e}")
+        logger.error(f"Error simulating trade sizes: {e}")
         return JsonResponse({
             'success': False,
             'error': str(e)
-        })
\ No newline at end of file
+        })
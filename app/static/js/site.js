@@ -70,6 +70,48 @@ function updateMarketData() {
         });
 }
 
+// Subscribe to pushed market data, falling back to polling if streaming is unavailable
+function streamMarketData() {
+    if (!window.EventSource) {
+        pollMarketData();
+        return;
+    }
+
+    let marketData = null;
+    let received = false;
+    const source = new EventSource('/api/market-stream/');
+
+    // The first event carries the full payload, later ones only the fields that changed
+    source.addEventListener('snapshot', event => {
+        received = true;
+        marketData = JSON.parse(event.data);
+        displayMarketData(marketData);
+        updateLastUpdatedTime();
+    });
+
+    source.addEventListener('diff', event => {
+        if (!marketData) return;
+        Object.assign(marketData, JSON.parse(event.data));
+        displayMarketData(marketData);
+        updateLastUpdatedTime();
+    });
+
+    source.onerror = function () {
+        // EventSource reconnects by itself once it has worked; if it never did
+        // (e.g. the server runs under WSGI) switch to polling instead
+        if (!received) {
+            source.close();
+            pollMarketData();
+        }
+    };
+}
+
+// Poll market data every 30 seconds
+function pollMarketData() {
+    updateMarketData();
+    setInterval(updateMarketData, 30000);
+}
+
 // Display market data on the dashboard
 function displayMarketData(data) {
     // Update prices
@@ -237,9 +279,6 @@ document.addEventListener('DOMContentLoaded', function () {
         };
     }
 
-    // Initial market data update
-    updateMarketData();
-
-    // Set interval to update market data every 30 seconds
-    setInterval(updateMarketData, 30000);
+    // Receive market data as it changes
+    streamMarketData();
 });
\ No newline at end of file